@@ -2,37 +2,127 @@
 Script that creates backups of tables in the MotherDuck DB. Should be run before every DB update
 to ensure no loss of data.
 """
+import os
+import sys
 import argparse
+from concurrent.futures import ThreadPoolExecutor
 
 import duckdb
 
+# The modules in hockey/ import each other by name, so that directory needs to be on the path
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'hockey'))
 
-def main(source: str) -> None:
+import storage
+import metrics
+import snapshots
+import backup_journal
+
+
+def table_checksum(conn: duckdb.DuckDBPyConnection, table: str) -> tuple[int, int]:
     """
-    Script works by downloading the entire source table into a DataFrame, and then creating/
-    replacing a backup table from that DataFrame.
+    Computes a cheap checksum of a table inside the database: its row count, plus the sum of a
+    hash of every row. The sum doesn't depend on row order, so a table and a copy of it always
+    have the same checksum.
+
+    :param duckdb.DuckDBPyConnection conn: Connection to the database.
+    :param str table: Name of the table.
+    :return tuple[int, int]: Row count and aggregate hash.
+    """
+    return conn.execute(f'SELECT count(*), sum(hash(t)) FROM {table} t').fetchone()
 
-    The name of every backup table will be f"backup_{source}".
 
+def backup_table(conn: duckdb.DuckDBPyConnection, source: str) -> None:
+    """
+    Creates/replaces the backup table for a source table entirely within the database, and
+    verifies that the backup's checksum matches the source's.
+
+    The copy and both checksums are done in one transaction, so a write to the source from
+    another connection can't make them disagree. For tables covered by the backup journal, the
+    snapshot is also recorded there.
+
+    :param duckdb.DuckDBPyConnection conn: Connection to the database.
     :param str source: Name of the source table that is being backed up.
+    :raises ValueError: If the backup doesn't match the source.
     """
+    print(f'Creating backup table for {source}...')
+
+    with metrics.span('backup', table=source) as span:
+        conn.execute('BEGIN TRANSACTION')
+        try:
+            conn.execute(f'CREATE OR REPLACE TABLE backup_{source} AS SELECT * FROM {source}')
+            source_checksum = table_checksum(conn, source)
+            backup_checksum = table_checksum(conn, f'backup_{source}')
+            if source_checksum != backup_checksum:
+                raise ValueError(f'Checksum of backup_{source} {backup_checksum} does not match '
+                                 f'{source} {source_checksum}, exiting...')
+
+            # Mark the snapshot in the journal, so that later batches can be replayed on top of it
+            if backup_journal.is_journaled(conn, source):
+                backup_journal.record_snapshot(conn, source)
+
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+        span.rows_in = source_checksum[0]
+        span.rows_out = backup_checksum[0]
+
+    print(f'Backup of {source} verified ({source_checksum[0]} rows)')
+
+
+def main(sources: list[str], parallel: bool = False, snapshot_dir: str | None = None) -> None:
+    """
+    Script works by copying each source table into a backup table with CREATE TABLE ... AS,
+    so the data never leaves the database. All tables are backed up over the process' shared
+    connection (see hockey/storage.py).
+
+    The name of every backup table will be f"backup_{source}".
+
+    :param list[str] sources: Names of the source tables that are being backed up.
+    :param bool parallel: If True, back up all the tables at once, each from its own cursor on
+                          the shared connection.
+    :param str snapshot_dir: If provided, also export a season-partitioned Parquet snapshot of
+                             each table into this directory (see hockey/snapshots.py).
+    """
+
+    conn = storage.get_connection()
 
-    conn = duckdb.connect('md:')
+    with metrics.span('backup_dbs', parallel=parallel):
+        if parallel:
+            # Created up front, since the workers' transactions would conflict creating them
+            for source in sources:
+                if backup_journal.is_journaled(conn, source):
+                    backup_journal.ensure_journal(conn, source)
 
-    print(f"Download data from {source}...")
-    full_df = conn.sql(f'SELECT * FROM {source};').pl()
+            with ThreadPoolExecutor(max_workers=len(sources)) as pool:
+                futures = [pool.submit(metrics.propagate(backup_table), conn.cursor(), source)
+                           for source in sources]
+                # Consume the results so that any failed backup raises here
+                for future in futures:
+                    future.result()
+        else:
+            for source in sources:
+                backup_table(conn, source)
 
-    print('Creating backup table...')
-    conn.sql(f'CREATE OR REPLACE TABLE backup_{source} AS SELECT * FROM full_df')
+        if snapshot_dir is not None:
+            for source in sources:
+                with metrics.span('snapshot', table=source):
+                    snapshots.export_table(conn, source, snapshot_dir)
 
+        with metrics.span('persist'):
+            storage.persist()
     print('Backup complete!')
-    conn.close()
 
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
-    parser.add_argument('-s', '--source', required=True, type=str,
-                        help='The source table for which a backup will be created/updated.')
+    parser.add_argument('-s', '--source', required=True, type=str, nargs='+',
+                        help='The source table(s) for which a backup will be created/updated.')
+    parser.add_argument('--parallel', action='store_true', default=False,
+                        help='Back up all the given tables at the same time.')
+    parser.add_argument('--snapshot-dir', type=str, default=None,
+                        help='Also export a Parquet snapshot of each table into this directory.')
     args = parser.parse_args()
 
-    main(source=args.source)
+    main(sources=args.source, parallel=args.parallel, snapshot_dir=args.snapshot_dir)
@@ -0,0 +1,321 @@
+"""
+Consistency checks of the pipeline's writes, run against copies of the database loaded by the
+benchmark. Each check either makes one step of a write fail, or loads data that changes what is
+already stored, and then checks that every table the write touches was left consistent.
+
+Normally started by run.py once the stages have run, with the same environment as stages.py. Each
+check gets its own copy of the database, and writes 'ok' or the reason it failed to the result
+file.
+
+Usage:
+    python checks.py --db bench.duckdb --nst-path bench_data/nst --result checks.json
+    python checks.py --db bench.duckdb --nst-path bench_data/nst -c rolling_failure
+"""
+import os
+import sys
+import csv
+import glob
+import json
+import shutil
+import tempfile
+from argparse import ArgumentParser
+from contextlib import contextmanager
+from collections.abc import Iterator
+
+import duckdb
+import polars as pl
+
+# The modules in hockey/ import each other by name, so that directory needs to be on the path
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'hockey'))
+
+import storage
+import metrics
+import change_log
+import backup_journal
+import rolling_tables
+import season_aggregates
+import update_tables
+import update_player_game_tables
+
+
+class InjectedFailure(Exception):
+    """
+    Raised by a step of a write that a check made fail.
+    """
+
+
+@contextmanager
+def failing(module: object, name: str) -> Iterator[None]:
+    """
+    Makes a function of a module raise InjectedFailure while the context is open.
+
+    :param object module: Module the function is looked up on.
+    :param str name: Name of the function.
+    """
+    original = getattr(module, name)
+
+    def fail(*args, **kwargs):
+        raise InjectedFailure(f'{module.__name__}.{name}')
+
+    setattr(module, name, fail)
+    try:
+        yield
+    finally:
+        setattr(module, name, original)
+
+
+def checksum(conn: duckdb.DuckDBPyConnection, table_name: str) -> tuple[int, int]:
+    """
+    :param duckdb.DuckDBPyConnection conn: Connection to the database.
+    :param str table_name: Table to checksum.
+    :return tuple[int, int]: Row count and sum of row hashes of the table.
+    """
+    return conn.execute(f'SELECT count(*), sum(hash(t)) FROM {table_name} t').fetchone()
+
+
+def expect(condition: bool, message: str) -> None:
+    """
+    :param bool condition: What the check expects to be true.
+    :param str message: Reason the check fails if it isn't.
+    :raises ValueError: If the condition is false.
+    """
+    if not condition:
+        raise ValueError(f'{message}, exiting...')
+
+
+def totals_differences(conn: duckdb.DuckDBPyConnection, table_name: str) -> int:
+    """
+    Compares the season totals of a game table with a fresh aggregate of the table. Sums of
+    floating point columns are rounded, since the totals add them up in a different order.
+
+    :param duckdb.DuckDBPyConnection conn: Connection to the database.
+    :param str table_name: Game table, one of season_aggregates.TOTALS_TABLES.
+    :return int: Number of totals rows that are only in the totals table or only in the aggregate.
+    """
+    summed = season_aggregates.SUMMED_COLUMNS[table_name]
+
+    def rounded(expr: str, column: str) -> str:
+        return f'round({expr}, 6)' if summed[column] == 'DOUBLE' else f'{expr}::BIGINT'
+
+    key = ', '.join(season_aggregates.KEY)
+    stored = f"""
+        SELECT {key}, games, {', '.join(rounded(column, column) for column in summed)}
+        FROM {season_aggregates.TOTALS_TABLES[table_name]}
+    """
+    fresh = f"""
+        SELECT {key}, count(*), {', '.join(rounded(f'sum({column})', column) for column in summed)}
+        FROM {table_name} GROUP BY ALL
+    """
+
+    return conn.execute(f"""
+        SELECT count(*) FROM (
+            ({stored} EXCEPT ALL {fresh}) UNION ALL ({fresh} EXCEPT ALL {stored})
+        )
+    """).fetchone()[0]
+
+
+def write_without_player(nst_path: str, game_id: int, name: str, team: str, corrected: str) -> None:
+    """
+    Copies the NST CSVs of a game, leaving every row of one player out of their team's files.
+
+    :param str nst_path: Folder of NST CSVs loaded by update_player_game_tables.
+    :param int game_id: Game to copy.
+    :param str name: Player left out.
+    :param str team: Team of the player.
+    :param str corrected: Folder the CSVs are copied to.
+    """
+    for filename in glob.glob(os.path.join(nst_path, f'*_{game_id}_*.csv')):
+        with open(filename, newline='') as f:
+            rows = list(csv.reader(f))
+        if f'_{team}_' in os.path.basename(filename):
+            # NST writes names with non-breaking spaces, which the loader replaces
+            rows = [row for row in rows if row[0].replace('\xa0', ' ') != name]
+        with open(os.path.join(corrected, os.path.basename(filename)), 'w', newline='') as f:
+            csv.writer(f).writerows(rows)
+
+
+def check_rolling_failure(conn: duckdb.DuckDBPyConnection, nst_path: str) -> None:
+    """
+    A team_games write whose rolling table update fails is rolled back as a whole, in every write
+    mode, and once it goes through the rolling table matches a full rebuild of the season.
+    """
+    season = conn.execute('SELECT max(season) FROM team_games').fetchone()[0]
+    # Every game of one team changes, so the rolling table has to be recomputed for it
+    df = conn.execute(f'SELECT * FROM team_games WHERE season = {season}').pl()
+    team = df['team'][0]
+    df = df.with_columns(pl.when(pl.col('team') == team)
+                         .then(pl.col('xGoalsFor') + 1)
+                         .otherwise(pl.col('xGoalsFor')))
+
+    tables = ['team_games', rolling_tables.ROLLING_TABLE, change_log.CHANGE_LOG_TABLE]
+    before = {table_name: checksum(conn, table_name) for table_name in tables}
+
+    for write_mode in update_tables.WRITE_MODES:
+        with failing(rolling_tables, 'update_rolling'):
+            try:
+                if write_mode == 'staged':
+                    update_tables.publish_tables(conn, {'team_games': df}, season)
+                else:
+                    update_tables.write_table(conn, df, 'team_games', season,
+                                              write_mode=write_mode)
+            except InjectedFailure:
+                pass
+            else:
+                expect(False, f'The injected failure was not raised in the {write_mode} mode')
+
+        for table_name in tables:
+            expect(checksum(conn, table_name) == before[table_name],
+                   f'{table_name} was changed by a failed {write_mode} write')
+
+    update_tables.write_table(conn, df, 'team_games', season)
+    expect(checksum(conn, 'team_games') != before['team_games'],
+           'team_games was not changed by the write')
+
+    written = checksum(conn, rolling_tables.ROLLING_TABLE)
+    conn.execute('BEGIN TRANSACTION')
+    rolling_tables.update_rolling(conn, season)
+    rebuilt = checksum(conn, rolling_tables.ROLLING_TABLE)
+    conn.execute('ROLLBACK')
+    expect(written == rebuilt, 'The rolling table does not match a rebuild of the season')
+
+
+def check_dropped_player(conn: duckdb.DuckDBPyConnection, nst_path: str) -> None:
+    """
+    Reloading a game whose corrected data no longer has one of its players removes that player's
+    rows from the game, in both write modes, and the season totals and change log follow.
+    """
+    game_id, name, team = conn.execute("""
+        SELECT gameID, name, team FROM skater_games ORDER BY gameID, team, name LIMIT 1
+    """).fetchone()
+
+    for staged in [False, True]:
+        with tempfile.TemporaryDirectory() as corrected:
+            write_without_player(nst_path, game_id, name, team, corrected)
+            update_player_game_tables.main(corrected, [str(game_id)], staged=staged, force=True)
+
+        mode = 'staged' if staged else 'default'
+        remaining = conn.execute("""
+            SELECT count(*) FROM skater_games WHERE gameID = ? AND name = ? AND team = ?
+        """, [game_id, name, team]).fetchone()[0]
+        expect(remaining == 0, f'{remaining} rows of {name} were kept in game {game_id} by a '
+                               f'{mode} reload')
+
+        for table_name in season_aggregates.TOTALS_TABLES:
+            differences = totals_differences(conn, table_name)
+            expect(differences == 0, f'{differences} rows of the {table_name} totals differ from '
+                                     f'a fresh aggregate after a {mode} reload')
+
+    deleted = conn.execute(f"""
+        SELECT count(*) FROM {change_log.CHANGE_LOG_TABLE}
+        WHERE runID = ? AND tableName = 'skater_games' AND operation = 'delete'
+          AND (key->>'name') = ?
+    """, [metrics.RUN_ID, name]).fetchone()[0]
+    expect(deleted > 0, f'The rows of {name} removed from game {game_id} were not logged')
+
+
+def reinserted(conn: duckdb.DuckDBPyConnection, name: str) -> int:
+    """
+    :param duckdb.DuckDBPyConnection conn: Connection to the database.
+    :param str name: Skater whose rows are counted.
+    :return int: Number of inserts of the skater's rows logged by this run.
+    """
+    return conn.execute(f"""
+        SELECT count(*) FROM {change_log.CHANGE_LOG_TABLE}
+        WHERE runID = ? AND tableName = 'skater_games' AND operation = 'insert'
+          AND (key->>'name') = ?
+    """, [metrics.RUN_ID, name]).fetchone()[0]
+
+
+def check_rollback_totals(conn: duckdb.DuckDBPyConnection, nst_path: str) -> None:
+    """
+    Undoing a journaled reload of a game, by rolling back or by restoring the snapshot taken
+    before it, puts the game's rows back, and the season totals and change log follow.
+    """
+    game_id, name, team = conn.execute("""
+        SELECT gameID, name, team FROM skater_games ORDER BY gameID, team, name LIMIT 1
+    """).fetchone()
+    tables = list(season_aggregates.TOTALS_TABLES)
+    before = {table_name: checksum(conn, table_name) for table_name in tables}
+
+    # Snapshot of each table, as taken by backup_dbs.py
+    snapshots = {}
+    for table_name in tables:
+        conn.execute(f'CREATE OR REPLACE TABLE backup_{table_name} AS SELECT * FROM {table_name}')
+        snapshots[table_name] = backup_journal.record_snapshot(conn, table_name)
+
+    for revert in ['restore', 'rollback']:
+        with tempfile.TemporaryDirectory() as corrected:
+            write_without_player(nst_path, game_id, name, team, corrected)
+            update_player_game_tables.main(corrected, [str(game_id)], journal=True, force=True)
+
+        logged = reinserted(conn, name)
+        for table_name in tables:
+            if revert == 'restore':
+                backup_journal.restore(conn, table_name, snapshots[table_name])
+            else:
+                backup_journal.rollback(conn, table_name, snapshots[table_name])
+
+        for table_name in tables:
+            expect(checksum(conn, table_name) == before[table_name],
+                   f'{table_name} was not returned to its snapshot by a {revert}')
+            differences = totals_differences(conn, table_name)
+            expect(differences == 0, f'{differences} rows of the {table_name} totals differ from '
+                                     f'a fresh aggregate after a {revert}')
+
+        expect(reinserted(conn, name) > logged,
+               f'The rows of {name} put back by a {revert} were not logged')
+
+
+# Name of each check -> function running it
+CHECKS = {
+    'rolling_failure': check_rolling_failure,
+    'dropped_player': check_dropped_player,
+    'rollback_totals': check_rollback_totals
+}
+
+
+def run_check(name: str, db_path: str, nst_path: str) -> str:
+    """
+    Runs a check against its own copy of the database.
+
+    :param str name: One of CHECKS.
+    :param str db_path: The benchmark database, after every stage has run.
+    :param str nst_path: Folder of NST CSVs loaded by update_player_game_tables.
+    :return str: 'ok', or the reason the check failed.
+    """
+    copy_path = f'{os.path.splitext(db_path)[0]}_{name}.duckdb'
+    shutil.copy(db_path, copy_path)
+    storage.configure('duckdb', copy_path)
+
+    print(f'Running check {name}...')
+    try:
+        CHECKS[name](storage.get_connection(), nst_path)
+        result = 'ok'
+    except ValueError as e:
+        result = str(e)
+    finally:
+        storage.close()
+        os.remove(copy_path)
+
+    print(f'{name}: {result}')
+    return result
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument('--db', required=True, type=str,
+                        help='The benchmark database, after every stage has run.')
+    parser.add_argument('--nst-path', required=True, type=str,
+                        help='Folder of NST CSVs loaded by update_player_game_tables.')
+    parser.add_argument('-c', '--checks', type=str, nargs='*', choices=list(CHECKS),
+                        default=list(CHECKS), help='Checks to run, defaults to all of them.')
+    parser.add_argument('--result', type=str, default=None,
+                        help='JSON file to write the result of each check to.')
+    args = parser.parse_args()
+
+    results = {name: run_check(name, args.db, args.nst_path) for name in args.checks}
+    if args.result is not None:
+        with open(args.result, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    sys.exit(0 if all(result == 'ok' for result in results.values()) else 1)
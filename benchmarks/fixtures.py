@@ -0,0 +1,404 @@
+"""
+Synthetic MoneyPuck and NST inputs for the benchmarks, generated at a configurable scale. The
+files have the same layout, columns and quirks as the real ones (a duplicated 'team' column in
+teams.csv, NST team codes and non-breaking spaces in names, empty values in the goalie CSVs), with
+extra unused columns so that parsing costs about what it does on the real files.
+
+Every value is derived from a hash of its row number, so the same scale always produces the same
+files.
+
+Layout:
+    {directory}/moneypuck/playerData/seasonSummary/{season}/regular/skaters.csv
+    {directory}/moneypuck/playerData/seasonSummary/{season}/regular/goalies.csv
+    {directory}/moneypuck/playerData/seasonSummary/{season}/regular/teams.csv
+    {directory}/moneypuck/playerData/careers/gameByGame/all_teams.csv
+    {directory}/nst/{date}_{gameID}_{team}_{state}_{st,oi,goalies}.csv
+
+Usage:
+    python fixtures.py -d bench_data --profile default
+"""
+import os
+import sys
+from datetime import date, timedelta
+from dataclasses import dataclass
+from argparse import ArgumentParser
+
+import polars as pl
+
+# The modules in hockey/ import each other by name, so that directory needs to be on the path
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'hockey'))
+
+import dimensions
+
+
+@dataclass(frozen=True)
+class Scale:
+    """
+    Size of a set of fixtures.
+
+    :param int seasons: Number of seasons loaded by the benchmark, ending with FINAL_SEASON.
+    :param int history_seasons: Extra earlier seasons in all_teams.csv, which are only parsed.
+    :param int players_per_team: Skaters on each team's roster.
+    :param int games: Number of NST games, from the start of the final season.
+    :param int extra_columns: Unused columns added to every MoneyPuck CSV.
+    """
+    seasons: int
+    history_seasons: int
+    players_per_team: int
+    games: int
+    extra_columns: int
+
+
+############## Constants ################
+
+PROFILES = {
+    'small': Scale(seasons=1, history_seasons=1, players_per_team=25, games=10, extra_columns=10),
+    'default': Scale(seasons=3, history_seasons=5, players_per_team=30, games=100,
+                     extra_columns=40),
+    'large': Scale(seasons=5, history_seasons=12, players_per_team=35, games=400,
+                   extra_columns=100)
+}
+
+FINAL_SEASON = 2024
+
+MONEYPUCK_DIR = os.path.join('moneypuck', 'playerData')
+NST_DIR = 'nst'
+
+TEAMS = dimensions.TEAMS[:32]
+
+# Codes NST uses for some teams, see dimensions.NST_TEAM_CODES
+NST_TEAMS = {'SJS': 'SJ', 'LAK': 'LA', 'TBL': 'TB', 'NJD': 'NJ'}
+
+SITUATIONS = ['all', '5on5', '5on4', '4on5', 'other']
+NST_STATES = ['all', '5v5', 'pp', 'pk']
+
+GAMES_PER_TEAM = 82
+PLAYOFF_GAMES = 40
+GOALIES_PER_TEAM = 3
+DRESSED_SKATERS = 18
+
+FIRST_NAMES = ['Connor', 'Auston', 'Nathan', 'Sidney', 'J.T.', 'Elias', 'Mikko', 'Tim', 'Quinn',
+               'Jack', 'Matthew', 'Brady', 'Kirill', 'Nikita', 'Adam', 'Evan', 'Ryan', 'Alex']
+LAST_NAMES = ['Hughes', 'Tkachuk', 'Miller', 'Pettersson', 'Stützle', "O'Reilly", 'Larkin',
+              'Ekman-Larsson', 'Kaprizov', 'Kucherov', 'Fox', 'Bouchard', 'Nugent-Hopkins',
+              'Rantanen', 'Barkov', 'Aho', 'Marner', 'Eichel', 'Point', 'Makar', 'Josi']
+
+# Columns of each MoneyPuck CSV that the pipeline reads, and the range of their values
+SKATER_METRICS = {
+    'games_played': (1, 82), 'icetime': (600, 120000), 'I_F_points': (0, 120),
+    'I_F_goals': (0, 60), 'I_F_xGoals': (0.0, 50.0),
+    'OnIce_F_flurryScoreVenueAdjustedxGoals': (0.0, 90.0),
+    'OnIce_A_flurryScoreVenueAdjustedxGoals': (0.0, 90.0),
+    'OnIce_F_goals': (0, 100), 'OnIce_A_goals': (0, 100),
+    'I_F_oZoneShiftStarts': (0, 400), 'I_F_dZoneShiftStarts': (0, 400),
+    'I_F_neutralZoneShiftStarts': (0, 400), 'I_F_flyShiftStarts': (0, 1200),
+    'faceoffsWon': (0, 900), 'faceoffsLost': (0, 900), 'shotsBlockedByPlayer': (0, 200),
+    'penalties': (0, 40), 'penaltiesDrawn': (0, 40)
+}
+# In the order of the real goalies.csv, which isn't the order the pipeline reads them in
+GOALIE_METRICS = {
+    'games_played': (1, 65), 'icetime': (3600, 240000), 'xGoals': (0.0, 200.0), 'goals': (0, 200),
+    'lowDangerShots': (0, 1200), 'mediumDangerShots': (0, 400), 'highDangerShots': (0, 300),
+    'lowDangerxGoals': (0.0, 60.0), 'mediumDangerxGoals': (0.0, 60.0),
+    'highDangerxGoals': (0.0, 80.0), 'lowDangerGoals': (0, 60), 'mediumDangerGoals': (0, 60),
+    'highDangerGoals': (0, 80)
+}
+TEAM_METRICS = {
+    'games_played': (82, 82), 'iceTime': (10000, 300000), 'goalsFor': (0, 320),
+    'goalsAgainst': (0, 320), 'flurryScoreVenueAdjustedxGoalsFor': (0.0, 320.0),
+    'flurryScoreVenueAdjustedxGoalsAgainst': (0.0, 320.0)
+}
+GAME_METRICS = {
+    'iceTime': (300, 3900), 'xGoalsPercentage': (0.0, 1.0), 'corsiPercentage': (0.0, 1.0),
+    'xGoalsFor': (0.0, 6.0), 'xGoalsAgainst': (0.0, 6.0), 'penalityMinutesFor': (0, 30),
+    'penalityMinutesAgainst': (0, 30), 'goalsFor': (0, 8), 'goalsAgainst': (0, 8)
+}
+
+# Columns of each NST CSV, and the range of their values. The first columns are the ones the
+# pipeline reads.
+NST_INDIVIDUAL_METRICS = {
+    'TOI': (0.0, 25.0), 'Goals': (0, 2), 'First Assists': (0, 2), 'Second Assists': (0, 2),
+    'Shots': (0, 8), 'ixG': (0.0, 1.5), 'Total Penalties': (0, 2), 'Penalties Drawn': (0, 2),
+    'Hits': (0, 8), 'iCF': (0, 12), 'iFF': (0, 10), 'iSCF': (0, 6), 'iHDCF': (0, 4),
+    'Rush Attempts': (0, 3), 'Rebounds Created': (0, 3), 'PIM': (0, 10), 'Giveaways': (0, 4),
+    'Takeaways': (0, 4), 'Hits Taken': (0, 6), 'Shots Blocked': (0, 5), 'Faceoffs Won': (0, 15),
+    'Faceoffs Lost': (0, 15)
+}
+NST_ONICE_METRICS = {
+    'CF': (0, 30), 'CA': (0, 30), 'GF': (0, 3), 'GA': (0, 3), 'xGF': (0.0, 2.5),
+    'xGA': (0.0, 2.5), 'FF': (0, 25), 'FA': (0, 25), 'SF': (0, 20), 'SA': (0, 20),
+    'SCF': (0, 15), 'SCA': (0, 15), 'HDCF': (0, 8), 'HDCA': (0, 8), 'Off. Zone Starts': (0, 10),
+    'Def. Zone Starts': (0, 10)
+}
+NST_GOALIE_METRICS = {
+    'TOI': (50.0, 65.0), 'Shots Against': (15, 45), 'Saves': (10, 45), 'Goals Against': (0, 6),
+    'Expected Goals Against': (0.0, 5.0), 'HD Shots Against': (0, 15), 'HD Saves': (0, 15)
+}
+
+########### End Constants ###############
+
+
+def noise(n: int, seed: int, low: int | float, high: int | float) -> pl.Series:
+    """
+    Deterministic pseudo-random values, taken from a hash of each row number.
+
+    :param int n: Number of values.
+    :param int seed: Seed for the hash, different for every column.
+    :param int | float low: Smallest value.
+    :param int | float high: Largest value. If both bounds are ints, the values are ints.
+    :return pl.Series: The values.
+    """
+    fraction = (pl.int_range(n, eager=True).hash(seed) % 1_000_003) / 1_000_003
+    if isinstance(low, int) and isinstance(high, int):
+        return (fraction * (high - low + 1)).floor().cast(pl.Int64) + low
+
+    return (fraction * (high - low) + low).round(4)
+
+
+def metric_columns(n: int, metrics: dict[str, tuple], seed: int,
+                   extra_columns: int = 0) -> dict[str, pl.Series]:
+    """
+    :param int n: Number of rows.
+    :param dict[str, tuple] metrics: Column -> (low, high).
+    :param int seed: Seed for the first column, each column after it uses the next one.
+    :param int extra_columns: Number of unused columns added after the metrics.
+    :return dict[str, pl.Series]: Column -> values.
+    """
+    columns = {column: noise(n, seed + i, low, high)
+               for i, (column, (low, high)) in enumerate(metrics.items())}
+    for i in range(extra_columns):
+        columns[f'extra_{i}'] = noise(n, seed + len(metrics) + i, 0.0, 100.0)
+
+    return columns
+
+
+def write_csv(df: pl.DataFrame, path: str, header: list[str] | None = None) -> None:
+    """
+    Writes a CSV, optionally with a header that polars can't write itself (e.g. with a
+    duplicated column name).
+
+    :param pl.DataFrame df: Rows to write.
+    :param str path: File to write.
+    :param list[str] header: Column names to write instead of the DataFrame's.
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    if header is None:
+        df.write_csv(path)
+        return
+
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(','.join(header) + '\n')
+        f.write(df.write_csv(include_header=False))
+
+
+def seasons(scale: Scale) -> list[int]:
+    """
+    :param Scale scale: Size of the fixtures.
+    :return list[int]: Seasons loaded by the benchmark.
+    """
+    return list(range(FINAL_SEASON - scale.seasons + 1, FINAL_SEASON + 1))
+
+
+def roster(scale: Scale, goalies: bool = False) -> pl.DataFrame:
+    """
+    Players on every team. Names are built from short lists, so some are shared by several
+    players, as happens in the real data.
+
+    :param Scale scale: Size of the fixtures.
+    :param bool goalies: Whether to list the goalies or the skaters.
+    :return pl.DataFrame: playerId, name, team and position of every player.
+    """
+    per_team = GOALIES_PER_TEAM if goalies else scale.players_per_team
+    offset = 8_480_000 if goalies else 8_470_000
+
+    rows = []
+    for t, team in enumerate(TEAMS):
+        for k in range(per_team):
+            i = t * per_team + k
+            # Names only repeat every few teams, so a name is never shared within a team.
+            # Goalies are named from further along the lists.
+            j = i + 5 if goalies else i
+            name = f'{FIRST_NAMES[j % len(FIRST_NAMES)]} ' \
+                   f'{LAST_NAMES[(j // len(FIRST_NAMES)) % len(LAST_NAMES)]}'
+            position = 'G' if goalies else ['C', 'L', 'R', 'D', 'D'][k % 5]
+            rows.append((offset + i, name, team, position))
+
+    return pl.DataFrame(rows, schema=['playerId', 'name', 'team', 'position'], orient='row')
+
+
+def schedule(season: int) -> pl.DataFrame:
+    """
+    Regular season schedule, with every team playing GAMES_PER_TEAM games.
+
+    :param int season: Season to schedule.
+    :return pl.DataFrame: gameID, gameDate, home and away team of every game, in order.
+    """
+    games = len(TEAMS) * GAMES_PER_TEAM // 2
+    start = date(season, 10, 8)
+
+    rows = []
+    for k in range(games):
+        home = k % len(TEAMS)
+        away = (home + 1 + (k // len(TEAMS)) % (len(TEAMS) - 1)) % len(TEAMS)
+        rows.append((season * 1_000_000 + 20_000 + k + 1, start + timedelta(days=k * 180 // games),
+                     TEAMS[home], TEAMS[away]))
+
+    return pl.DataFrame(rows, schema=['gameID', 'gameDate', 'home', 'away'], orient='row')
+
+
+def season_summaries(directory: str, scale: Scale, season: int) -> None:
+    """
+    Writes the skaters, goalies and teams CSVs of a season.
+
+    :param str directory: Root directory of the fixtures.
+    :param Scale scale: Size of the fixtures.
+    :param int season: Season to write.
+    """
+    path = os.path.join(directory, MONEYPUCK_DIR, 'seasonSummary', str(season), 'regular')
+
+    for goalies, metrics, filename in [(False, SKATER_METRICS, 'skaters.csv'),
+                                       (True, GOALIE_METRICS, 'goalies.csv')]:
+        players = roster(scale, goalies).join(pl.DataFrame({'situation': SITUATIONS}),
+                                             how='cross')
+        df = players.select(
+            'playerId', pl.lit(season).alias('season'), 'name', 'team', 'position', 'situation',
+            **metric_columns(len(players), metrics, season * 100 + goalies * 50,
+                             scale.extra_columns)
+        )
+        write_csv(df, os.path.join(path, filename))
+
+    # The real teams.csv has 'team' twice, with the full name in between
+    teams = pl.DataFrame({'team': TEAMS}).join(pl.DataFrame({'situation': SITUATIONS}),
+                                               how='cross')
+    df = teams.select(
+        'team', pl.lit(season).alias('season'), pl.col('team').alias('name'),
+        pl.col('team').alias('team_'), pl.lit('Team Level').alias('position'), 'situation',
+        **metric_columns(len(teams), TEAM_METRICS, season * 100 + 90, scale.extra_columns)
+    )
+    write_csv(df, os.path.join(path, 'teams.csv'),
+              header=['team' if column == 'team_' else column for column in df.columns])
+
+
+def all_teams(directory: str, scale: Scale) -> None:
+    """
+    Writes the multi-season all_teams CSV, with one row per team, game and situation for every
+    season (including the history seasons), and a few playoff games at the end of each season.
+
+    :param str directory: Root directory of the fixtures.
+    :param Scale scale: Size of the fixtures.
+    """
+    frames = []
+    for season in range(FINAL_SEASON - scale.seasons - scale.history_seasons + 1,
+                        FINAL_SEASON + 1):
+        games = schedule(season).with_columns(pl.lit(0).alias('playoffGame'))
+        playoffs = games.tail(PLAYOFF_GAMES).with_columns(
+            (pl.col('gameID') + 10_000).alias('gameID'),
+            (pl.col('gameDate') + timedelta(days=14)).alias('gameDate'),
+            pl.lit(1).alias('playoffGame')
+        )
+        games = pl.concat([games, playoffs])
+
+        sides = pl.concat([
+            games.select('gameID', 'gameDate', 'playoffGame', pl.col('home').alias('team'),
+                         pl.col('away').alias('opposingTeam'), pl.lit('HOME').alias('home_or_away')),
+            games.select('gameID', 'gameDate', 'playoffGame', pl.col('away').alias('team'),
+                         pl.col('home').alias('opposingTeam'), pl.lit('AWAY').alias('home_or_away'))
+        ]).join(pl.DataFrame({'situation': SITUATIONS}), how='cross').sort('gameID', 'team')
+
+        frames.append(sides.select(
+            'team', pl.lit(season).alias('season'), pl.col('team').alias('name'),
+            pl.col('gameID').alias('gameId'), pl.col('team').alias('playerTeam'), 'opposingTeam',
+            'home_or_away', pl.col('gameDate').dt.strftime('%Y%m%d').cast(pl.Int64),
+            pl.lit('Team Level').alias('position'), 'situation',
+            **metric_columns(len(sides), GAME_METRICS, season * 100 + 95, scale.extra_columns),
+            playoffGame=pl.col('playoffGame')
+        ))
+
+    write_csv(pl.concat(frames),
+              os.path.join(directory, MONEYPUCK_DIR, 'careers', 'gameByGame', 'all_teams.csv'))
+
+
+def nst_games(directory: str, scale: Scale) -> list[str]:
+    """
+    Writes the NST CSVs for the first games of the final season: for each team in a game, one
+    individual (st), on-ice (oi) and goalie CSV per state.
+
+    :param str directory: Root directory of the fixtures.
+    :param Scale scale: Size of the fixtures.
+    :return list[str]: IDs of the games written.
+    """
+    path = os.path.join(directory, NST_DIR)
+    os.makedirs(path, exist_ok=True)
+    skaters = roster(scale)
+    goalies = roster(scale, goalies=True)
+
+    games = schedule(FINAL_SEASON).head(scale.games)
+    for g, (game_id, game_date, home, away) in enumerate(games.iter_rows()):
+        for team in [home, away]:
+            # Rotate through the roster, so that players miss some games
+            team_skaters = skaters.filter(pl.col('team') == team)
+            start = g % (len(team_skaters) - DRESSED_SKATERS + 1)
+            dressed = team_skaters.slice(start, DRESSED_SKATERS).select(
+                # NST uses a non-breaking space in names
+                pl.col('name').str.replace(' ', '\xa0', literal=True)
+                .str.replace('J.T.', 'JT', literal=True).alias('Player'),
+                pl.col('position').alias('Position')
+            )
+            # The backup goalie comes in for part of some games
+            in_net = goalies.filter(pl.col('team') == team).head(1 + (g % 5 == 0))\
+                .select(pl.col('name').str.replace(' ', '\xa0', literal=True).alias('Player'))
+
+            for s, state in enumerate(NST_STATES):
+                seed = (g * 2 + (team == away)) * 10 + s
+                base = os.path.join(path, f'{game_date}_{game_id}_{NST_TEAMS.get(team, team)}_'
+                                          f'{state}')
+
+                # Only the players who got on the ice in a state are in its individual CSV
+                individual = dressed if state in ['all', '5v5'] else dressed.filter(
+                    noise(len(dressed), seed, 0, 2) > 0)
+                write_csv(individual.with_columns(
+                    **metric_columns(len(individual), NST_INDIVIDUAL_METRICS, seed * 100)
+                ), f'{base}_st.csv')
+
+                write_csv(dressed.with_columns(
+                    **metric_columns(len(dressed), NST_ONICE_METRICS, seed * 100 + 50)
+                ), f'{base}_oi.csv')
+
+                # NST sometimes leaves numeric goalie columns empty
+                goalie_df = in_net.with_columns(
+                    **metric_columns(len(in_net), NST_GOALIE_METRICS, seed * 100 + 80)
+                ).with_columns(pl.col('Goals Against').cast(pl.String))
+                if state == 'pk' and g % 4 == 0:
+                    goalie_df = goalie_df.with_columns(pl.lit('').alias('Goals Against'))
+                write_csv(goalie_df, f'{base}_goalies.csv')
+
+    return [str(game_id) for game_id in games['gameID']]
+
+
+def generate(directory: str, scale: Scale) -> dict:
+    """
+    Writes every fixture for a scale.
+
+    :param str directory: Root directory of the fixtures.
+    :param Scale scale: Size of the fixtures.
+    :return dict: The seasons and NST game IDs written.
+    """
+    print(f'Generating fixtures in {directory}...')
+    for season in seasons(scale):
+        season_summaries(directory, scale, season)
+    all_teams(directory, scale)
+    game_ids = nst_games(directory, scale)
+
+    return {'seasons': seasons(scale), 'game_ids': game_ids}
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument('-d', '--directory', type=str, default='bench_data',
+                        help='Directory to write the fixtures to.')
+    parser.add_argument('--profile', choices=list(PROFILES), default='default',
+                        help='Scale of the fixtures.')
+    args = parser.parse_args()
+
+    written = generate(args.directory, PROFILES[args.profile])
+    print(f"Wrote {len(written['seasons'])} seasons and {len(written['game_ids'])} NST games")
@@ -0,0 +1,329 @@
+"""
+Reference copy of the transforms as they were before the declarative specs (hockey/transforms.py)
+and the lazy multi-file scans of the NST CSVs, kept to check that the pipeline's output hasn't
+changed. Each function is the original eager code, reading from a local file rather than from
+MoneyPuck.
+
+This file should not be changed to follow the pipeline. If the output of a table is changed on
+purpose, update the matching function here in the same commit.
+"""
+import os
+import glob
+from datetime import datetime
+
+import polars as pl
+
+
+############## Constants ################
+
+SKATER_COLUMNS = ['playerId', 'season', 'name', 'team', 'position', 'situation', 'games_played',
+                  'icetime', 'I_F_points', 'I_F_goals', 'I_F_xGoals',
+                  'OnIce_F_flurryScoreVenueAdjustedxGoals',
+                  'OnIce_A_flurryScoreVenueAdjustedxGoals', 'OnIce_F_goals', 'OnIce_A_goals',
+                  'I_F_oZoneShiftStarts', 'I_F_dZoneShiftStarts', 'I_F_neutralZoneShiftStarts',
+                  'I_F_flyShiftStarts', 'faceoffsWon', 'faceoffsLost', 'shotsBlockedByPlayer',
+                  'penalties', 'penaltiesDrawn']
+
+GOALIE_COLUMNS = ['playerId', 'season', 'name', 'team', 'situation', 'games_played', 'icetime',
+                  'goals', 'xGoals', 'lowDangerGoals', 'lowDangerxGoals', 'lowDangerShots',
+                  'mediumDangerGoals', 'mediumDangerxGoals', 'mediumDangerShots',
+                  'highDangerGoals', 'highDangerxGoals', 'highDangerShots']
+
+TEAM_COLUMNS = ['season', 'team', 'situation', 'games_played', 'iceTime', 'goalsFor',
+                'goalsAgainst', 'flurryScoreVenueAdjustedxGoalsFor',
+                'flurryScoreVenueAdjustedxGoalsAgainst']
+
+GAME_COLUMNS = ['gameId', 'season', 'team', 'gameDate', 'home_or_away', 'situation', 'iceTime',
+                'xGoalsFor', 'xGoalsAgainst', 'xGoalsPercentage', 'penalityMinutesFor',
+                'penalityMinutesAgainst', 'corsiPercentage', 'goalsFor', 'goalsAgainst',
+                'playoffGame']
+
+########### End Constants ###############
+
+
+def skaters(filename: str) -> pl.DataFrame:
+    """
+    :param str filename: A season's skaters.csv.
+    :return pl.DataFrame: Rows of the skaters table.
+    """
+    df = pl.read_csv(filename, columns=SKATER_COLUMNS)
+
+    df = df.rename({
+        'OnIce_F_goals': 'goalsFor',
+        'OnIce_A_goals': 'goalsAgainst',
+        'OnIce_F_flurryScoreVenueAdjustedxGoals': 'xGoalsFor',
+        'OnIce_A_flurryScoreVenueAdjustedxGoals': 'xGoalsAgainst',
+        'I_F_points': 'points',
+        'I_F_goals': 'goals',
+        'I_F_xGoals': 'individualxGoals',
+        'I_F_oZoneShiftStarts': 'oZoneShifts',
+        'I_F_dZoneShiftStarts': 'dZoneShifts',
+        'I_F_neutralZoneShiftStarts': 'neutralZoneShifts',
+        'I_F_flyShiftStarts': 'flyShifts',
+        'penalties': 'penaltiesTaken',
+        'shotsBlockedByPlayer': 'shotsBlocked',
+        'playerId': 'playerID',
+        'games_played': 'gamesPlayed',
+        'icetime': 'iceTime'
+    })
+
+    df = df.with_columns(pl.col('iceTime') / 60.0)
+
+    for total_col, rate_col in zip(['goalsFor', 'goalsAgainst', 'xGoalsFor',
+                                    'xGoalsAgainst', 'points', 'goals'],
+                                   ['goalsForPerHour', 'goalsAgainstPerHour', 'xGoalsForPerHour',
+                                    'xGoalsAgainstPerHour', 'pointsPerHour', 'goalsPerHour']):
+        df = df.with_columns((pl.col(total_col) * (60.0 / pl.col('iceTime'))).alias(rate_col))
+
+    df = df.with_columns((pl.col('iceTime') / (pl.col('gamesPlayed'))).alias('averageIceTime'))
+
+    return df[['playerID', 'season', 'name', 'team', 'position', 'situation', 'gamesPlayed',
+               'iceTime', 'points', 'goals', 'individualxGoals', 'xGoalsFor', 'xGoalsAgainst',
+               'goalsFor', 'goalsAgainst', 'xGoalsForPerHour', 'xGoalsAgainstPerHour',
+               'goalsForPerHour', 'goalsAgainstPerHour', 'pointsPerHour', 'goalsPerHour',
+               'averageIceTime', 'penaltiesTaken', 'penaltiesDrawn', 'faceoffsWon', 'faceoffsLost',
+               'shotsBlocked', 'oZoneShifts', 'dZoneShifts', 'neutralZoneShifts', 'flyShifts']]
+
+
+def goalies(filename: str) -> pl.DataFrame:
+    """
+    :param str filename: A season's goalies.csv.
+    :return pl.DataFrame: Rows of the goalies table.
+    """
+    df = pl.read_csv(filename, columns=GOALIE_COLUMNS)
+
+    df = df.with_columns(pl.col('icetime') / 60.0)
+
+    return df.rename({
+        'playerId': 'playerID',
+        'games_played': 'gamesPlayed',
+        'icetime': 'iceTime'
+    })
+
+
+def teams(filename: str) -> pl.DataFrame:
+    """
+    :param str filename: A season's teams.csv.
+    :return pl.DataFrame: Rows of the teams table.
+    """
+    df = pl.read_csv(filename, columns=TEAM_COLUMNS)
+
+    df = df.with_columns(pl.col('iceTime') / 60.0)
+
+    df = df.rename({
+        'games_played': 'gamesPlayed',
+        'flurryScoreVenueAdjustedxGoalsFor': 'xGoalsFor',
+        'flurryScoreVenueAdjustedxGoalsAgainst': 'xGoalsAgainst'
+    })
+
+    for total_col, rate_col in zip(['goalsFor', 'goalsAgainst', 'xGoalsFor', 'xGoalsAgainst'],
+                                   ['goalsForPerHour', 'goalsAgainstPerHour',
+                                    'xGoalsForPerHour', 'xGoalsAgainstPerHour']):
+        df = df.with_columns((pl.col(total_col) * (60.0 / pl.col('iceTime'))).alias(rate_col))
+
+    return df[['team', 'season', 'situation', 'gamesPlayed', 'iceTime', 'xGoalsFor', 'goalsFor',
+               'xGoalsAgainst', 'goalsAgainst', 'goalsForPerHour', 'goalsAgainstPerHour',
+               'xGoalsForPerHour', 'xGoalsAgainstPerHour']]
+
+
+def team_games(filename: str, season: int) -> pl.DataFrame:
+    """
+    :param str filename: The all_teams.csv.
+    :param int season: Season to keep.
+    :return pl.DataFrame: Rows of the team_games table for the season.
+    """
+    df = pl.read_csv(filename, columns=GAME_COLUMNS)
+
+    df = df.filter((pl.col('season') == season) & (pl.col('playoffGame') == 0))
+    df = df.drop(['playoffGame'])
+
+    df = df.with_columns(
+        pl.col('gameDate').map_elements(
+            lambda date: datetime.strftime(datetime.strptime(str(date), '%Y%m%d'), '%Y-%m-%d'),
+            return_dtype=pl.String
+        ),
+        pl.col('home_or_away').map_elements(
+            lambda a: bool(a == 'HOME'),
+            return_dtype=pl.Boolean
+        ).alias('isHomeTeam'),
+        pl.col('iceTime') / 60.0
+    )
+
+    df = df.rename({
+        'gameId': 'gameID',
+        'xGoalsPercentage': 'xGoalsShare',
+        'corsiPercentage': 'corsiShare',
+        'penalityMinutesFor': 'penaltyMinutesFor',
+        'penalityMinutesAgainst': 'penaltyMinutesAgainst'
+    })
+
+    return df[['team', 'season', 'gameID', 'gameDate', 'isHomeTeam', 'iceTime', 'situation',
+               'xGoalsFor', 'xGoalsAgainst', 'xGoalsShare', 'corsiShare', 'goalsFor',
+               'goalsAgainst', 'penaltyMinutesFor', 'penaltyMinutesAgainst']]
+
+
+def nst_season(date: str) -> int:
+    """
+    :param str date: Game date, as YYYY-MM-DD.
+    :return int: The year the game's season started in.
+    """
+    if int(date.split('-')[1]) >= 9:
+        return int(date.split('-')[0])
+    return int(date.split('-')[0]) - 1
+
+
+def fix_team_names(df: pl.DataFrame) -> pl.DataFrame:
+    """
+    :param pl.DataFrame df: Rows with NST team codes.
+    :return pl.DataFrame: The rows, with MoneyPuck's team codes.
+    """
+    for bad, good in zip(['SJ', 'LA', 'TB', 'NJ'], ['SJS', 'LAK', 'TBL', 'NJD']):
+        df = df.with_columns(pl.col('team').str.replace_all(f'^{bad}$', good))
+    return df
+
+
+def skater_games(path: str, game_id: str) -> pl.DataFrame:
+    """
+    :param str path: Folder of NST CSVs.
+    :param str game_id: Game to process.
+    :return pl.DataFrame: Rows of the skater_games table for the game, without playerID.
+    """
+    indiv_df = pl.DataFrame()
+    for filename in glob.glob(os.path.join(path, f'*{game_id}*st.csv')):
+        date, _, team, state, _ = os.path.basename(filename).split('_')
+        season = nst_season(date)
+
+        df = pl.read_csv(filename)[['Player', 'Position', 'TOI', 'Goals', 'First Assists',
+                                    'Second Assists', 'Shots', 'ixG', 'Total Penalties',
+                                    'Penalties Drawn', 'Hits']]
+        df = df.with_columns(
+            pl.lit(state).alias('state'),
+            pl.lit(team).alias('team'),
+            pl.lit(game_id).alias('game_id'),
+            pl.lit(date).alias('game_date'),
+            pl.lit(season).alias('season')
+        ).cast({
+            'TOI': pl.Float64,
+            'Goals': pl.Int64,
+            'First Assists': pl.Int64,
+            'Second Assists': pl.Int64,
+            'Shots': pl.Int64,
+            'ixG': pl.Float64,
+            'Total Penalties': pl.Int64,
+            'Penalties Drawn': pl.Int64,
+            'Hits': pl.Int64
+        })
+        indiv_df = df if len(indiv_df) == 0 else pl.concat([indiv_df, df])
+
+    onice_df = pl.DataFrame()
+    for filename in glob.glob(os.path.join(path, f'*{game_id}*oi.csv')):
+        _, _, team, state, _ = os.path.basename(filename).split('_')
+
+        df = pl.read_csv(filename)[['Player', 'Position', 'CF', 'CA', 'GF', 'GA', 'xGF', 'xGA']]
+        df = df.with_columns(
+            pl.lit(state).alias('state'),
+            pl.lit(team).alias('team'),
+            ((pl.col('GF') / (pl.col('GF') + pl.col('GA'))) * 100).round(2).alias('goalsShare'),
+            ((pl.col('xGF') / (pl.col('xGF') + pl.col('xGA'))) * 100).round(2)
+            .alias('xGoalsShare'),
+            ((pl.col('CF') / (pl.col('CF') + pl.col('CA'))) * 100).round(2).alias('corsiShare'),
+        ).cast({'xGF': pl.Float64, 'xGA': pl.Float64})
+        onice_df = df if len(onice_df) == 0 else pl.concat([onice_df, df])
+
+    final_df = indiv_df.join(onice_df, on=['Player', 'team', 'state', 'Position'], how='right')
+    final_df = final_df.rename({
+        'Player': 'name',
+        'game_id': 'gameID',
+        'game_date': 'gameDate',
+        'Position': 'position',
+        'state': 'situation',
+        'TOI': 'iceTime',
+        'Goals': 'goals',
+        'First Assists': 'primaryAssists',
+        'Second Assists': 'secondaryAssists',
+        'Shots': 'shots',
+        'ixG': 'individualxGoals',
+        'GF': 'goalsFor',
+        'GA': 'goalsAgainst',
+        'xGF': 'xGoalsFor',
+        'xGA': 'xGoalsAgainst',
+        'CF': 'corsiFor',
+        'CA': 'corsiAgainst',
+        'Total Penalties': 'penaltiesTaken',
+        'Penalties Drawn': 'penaltiesDrawn',
+        'Hits': 'hits'
+    })
+
+    final_df = final_df.sort(by='name', descending=False)\
+        .with_columns(
+            pl.col('gameID').fill_null(game_id),
+            pl.col('gameDate').fill_null(date),
+            pl.col('season').fill_null(season)
+        ).fill_nan(0).fill_null(0)
+
+    final_df = final_df.with_columns(pl.col('name').str.replace_all('\xa0', ' ', literal=True))
+    final_df = fix_team_names(final_df)
+
+    return final_df[['name', 'gameID', 'gameDate', 'season', 'team', 'position', 'situation',
+                     'iceTime', 'goals', 'primaryAssists', 'secondaryAssists', 'shots',
+                     'individualxGoals', 'goalsFor', 'goalsAgainst', 'goalsShare', 'xGoalsFor',
+                     'xGoalsAgainst', 'xGoalsShare', 'corsiFor', 'corsiAgainst', 'corsiShare',
+                     'penaltiesTaken', 'penaltiesDrawn', 'hits']]
+
+
+def goalie_games(path: str, game_id: str) -> pl.DataFrame:
+    """
+    :param str path: Folder of NST CSVs.
+    :param str game_id: Game to process.
+    :return pl.DataFrame: Rows of the goalie_games table for the game, without playerID.
+    """
+    goalie_df = pl.DataFrame()
+    for filename in glob.glob(os.path.join(path, f'*{game_id}*goalies.csv')):
+        date, _, team, state, _ = os.path.basename(filename).split('_')
+        season = nst_season(date)
+
+        df = pl.read_csv(filename)[['Player', 'TOI', 'Shots Against', 'Goals Against',
+                                    'Expected Goals Against']]
+        df = df.with_columns(
+            pl.lit(team).alias('team'),
+            pl.lit(state).alias('state'),
+            pl.lit(game_id).alias('game_id'),
+            pl.lit(date).alias('game_date'),
+            pl.lit(season).alias('season'),
+        )
+
+        for column in ['Shots Against', 'Goals Against', 'Expected Goals Against']:
+            if df[column].dtype == pl.String:
+                df = df.with_columns(pl.col(column).replace('', '0'))
+
+        df = df.cast({
+            'TOI': pl.Float64,
+            'Shots Against': pl.Int64,
+            'Goals Against': pl.Int64,
+            'Expected Goals Against': pl.Float64,
+        })
+        goalie_df = df if len(goalie_df) == 0 else pl.concat([goalie_df, df])
+
+    goalie_df = goalie_df.rename({
+        'Player': 'name',
+        'TOI': 'iceTime',
+        'state': 'situation',
+        'Shots Against': 'shotsAgainst',
+        'Goals Against': 'goalsAgainst',
+        'Expected Goals Against': 'xGoalsAgainst',
+        'game_id': 'gameID',
+        'game_date': 'gameDate',
+    })
+
+    goalie_df = goalie_df.sort(by='name', descending=False)\
+        .with_columns(
+            pl.col('gameID').fill_null(game_id),
+            pl.col('gameDate').fill_null(date),
+            pl.col('season').fill_null(season)
+        ).fill_nan(0).fill_null(0)
+
+    goalie_df = goalie_df.with_columns(pl.col('name').str.replace_all('\xa0', ' ', literal=True))
+    goalie_df = fix_team_names(goalie_df)
+
+    return goalie_df[['name', 'gameID', 'gameDate', 'season', 'team', 'situation', 'iceTime',
+                      'shotsAgainst', 'goalsAgainst', 'xGoalsAgainst']]
@@ -0,0 +1,356 @@
+"""
+Offline end-to-end benchmark of the update pipeline.
+
+Generates synthetic fixtures (fixtures.py), serves them from a local stand-in for MoneyPuck
+(server.py) and loads them into a local DuckDB file, running each stage in its own process
+(stages.py) to measure its wall time, peak RSS and rows/sec. The measurements are compared against
+the baselines stored for the profile, and every table is checked against the output of the
+original transforms (reference.py), so a run fails on either a slowdown or a change in output.
+The consistency checks of the writes (checks.py) are then run against copies of the database.
+
+Baselines depend on the machine, so they aren't shared: record them once with --save-baseline,
+then run again after a change to compare.
+
+Usage:
+    python run.py --profile small --save-baseline
+    python run.py --profile small
+"""
+import os
+import sys
+import json
+import shutil
+import tempfile
+import subprocess
+from argparse import ArgumentParser
+
+import duckdb
+import polars as pl
+
+import fixtures
+import reference
+import server
+
+# The modules in hockey/ import each other by name, so that directory needs to be on the path
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'hockey'))
+
+import dimensions
+
+
+############## Constants ################
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+
+DEFAULT_BASELINE_PATH = os.path.join(BENCHMARK_DIR, 'baselines.json')
+
+# Slowdown (or growth in peak RSS) allowed over the baseline before a run counts as a regression
+DEFAULT_TOLERANCE = 0.25
+
+# Stages in the order they run
+STAGES = ['update_tables', 'update_player_game_tables']
+
+# Measurements compared against the baseline, lower is better for each of them
+COMPARED_METRICS = ['seconds', 'peak_rss_mb']
+
+# Columns left out of the equivalence check, because the original transforms didn't have them
+UNCHECKED_COLUMNS = {
+    'skater_games': ['playerID'],
+    'goalie_games': ['playerID']
+}
+
+########### End Constants ###############
+
+
+def create_database(db_path: str) -> None:
+    """
+    Creates an empty benchmark database with the pipeline's tables.
+
+    :param str db_path: DuckDB file to create, replaced if it exists.
+    """
+    if os.path.exists(db_path):
+        os.remove(db_path)
+
+    conn = duckdb.connect(db_path)
+    dimensions.create_types(conn)
+    with open(os.path.join(BENCHMARK_DIR, 'schema.sql')) as f:
+        conn.execute(f.read())
+    conn.close()
+
+
+def run_stage(stage: str, workdir: str, env: dict, seasons: list[int], nst_path: str) -> dict:
+    """
+    Runs a stage in its own process, with its output going to {stage}.log in the workdir.
+
+    :param str stage: One of STAGES.
+    :param str workdir: Directory holding the benchmark's files.
+    :param dict env: Environment of the process.
+    :param list[int] seasons: Seasons loaded by update_tables.
+    :param str nst_path: Folder of NST CSVs loaded by update_player_game_tables.
+    :raises RuntimeError: If the stage fails.
+    :return dict: The stage's measurements.
+    """
+    result_path = os.path.join(workdir, f'{stage}.json')
+    log_path = os.path.join(workdir, f'{stage}.log')
+
+    command = [sys.executable, os.path.join(BENCHMARK_DIR, 'stages.py'), stage,
+               '--result', result_path]
+    if stage == 'update_tables':
+        command += ['-s', *[str(season) for season in seasons]]
+    else:
+        command += ['--nst-path', nst_path]
+
+    print(f'Running {stage}...')
+    with open(log_path, 'w') as log:
+        process = subprocess.run(command, env=env, stdout=log, stderr=subprocess.STDOUT)
+
+    if process.returncode != 0:
+        with open(log_path) as log:
+            print(''.join(log.readlines()[-20:]))
+        raise RuntimeError(f'{stage} failed, see {log_path}, exiting...')
+
+    with open(result_path) as f:
+        return json.load(f)
+
+
+def expected_tables(fixture_dir: str, seasons: list[int], game_ids: list[str]) -> dict:
+    """
+    Runs the original transforms over the fixtures.
+
+    :param str fixture_dir: Root directory of the fixtures.
+    :param list[int] seasons: Seasons loaded by update_tables.
+    :param list[str] game_ids: NST games loaded by update_player_game_tables.
+    :return dict: Maps each table to the rows it should hold.
+    """
+    moneypuck_dir = os.path.join(fixture_dir, fixtures.MONEYPUCK_DIR)
+    all_teams = os.path.join(moneypuck_dir, 'careers', 'gameByGame', 'all_teams.csv')
+    nst_path = os.path.join(fixture_dir, fixtures.NST_DIR)
+
+    frames = {'skaters': [], 'goalies': [], 'teams': [], 'team_games': []}
+    for season in seasons:
+        season_dir = os.path.join(moneypuck_dir, 'seasonSummary', str(season), 'regular')
+        frames['skaters'].append(reference.skaters(os.path.join(season_dir, 'skaters.csv')))
+        frames['goalies'].append(reference.goalies(os.path.join(season_dir, 'goalies.csv')))
+        frames['teams'].append(reference.teams(os.path.join(season_dir, 'teams.csv')))
+        frames['team_games'].append(reference.team_games(all_teams, season))
+
+    frames['skater_games'] = [reference.skater_games(nst_path, game_id) for game_id in game_ids]
+    frames['goalie_games'] = [reference.goalie_games(nst_path, game_id) for game_id in game_ids]
+
+    return {table_name: pl.concat(dfs) for table_name, dfs in frames.items()}
+
+
+def count_differences(conn: duckdb.DuckDBPyConnection, table_name: str,
+                      expected_df: pl.DataFrame) -> int:
+    """
+    Compares a table with the rows it should hold. The expected rows are first cast to the table's
+    types, so that the comparison is on the values as stored.
+
+    :param duckdb.DuckDBPyConnection conn: Connection to the benchmark database.
+    :param str table_name: Table to check.
+    :param pl.DataFrame expected_df: Rows the table should hold.
+    :return int: Number of rows that are only in the table or only in the expected rows.
+    """
+    conn.execute(f'CREATE OR REPLACE TEMP TABLE expected AS SELECT * FROM {table_name} LIMIT 0')
+    conn.execute('INSERT INTO expected BY NAME SELECT * FROM expected_df')
+
+    unchecked = UNCHECKED_COLUMNS.get(table_name)
+    columns = f"* EXCLUDE ({', '.join(unchecked)})" if unchecked else '*'
+
+    return conn.execute(f"""
+        SELECT count(*) FROM (
+            (SELECT {columns} FROM {table_name} EXCEPT ALL SELECT {columns} FROM expected)
+            UNION ALL
+            (SELECT {columns} FROM expected EXCEPT ALL SELECT {columns} FROM {table_name})
+        )
+    """).fetchone()[0]
+
+
+def check_equivalence(db_path: str, fixture_dir: str, seasons: list[int],
+                      game_ids: list[str]) -> dict:
+    """
+    :param str db_path: The benchmark database, after every stage has run.
+    :param str fixture_dir: Root directory of the fixtures.
+    :param list[int] seasons: Seasons loaded by update_tables.
+    :param list[str] game_ids: NST games loaded by update_player_game_tables.
+    :return dict: Maps each table to the number of rows that differ from the original transforms.
+    """
+    print('Checking output against the original transforms...')
+    expected = expected_tables(fixture_dir, seasons, game_ids)
+
+    conn = duckdb.connect(db_path)
+    differences = {table_name: count_differences(conn, table_name, df)
+                   for table_name, df in expected.items()}
+    conn.close()
+
+    return differences
+
+
+def run_checks(workdir: str, env: dict, db_path: str, nst_path: str) -> dict:
+    """
+    Runs the consistency checks in their own process, with their output going to checks.log in
+    the workdir.
+
+    :param str workdir: Directory holding the benchmark's files.
+    :param dict env: Environment of the process.
+    :param str db_path: The benchmark database, after every stage has run.
+    :param str nst_path: Folder of NST CSVs loaded by update_player_game_tables.
+    :raises RuntimeError: If the checks couldn't be run.
+    :return dict: Maps each check to 'ok' or the reason it failed.
+    """
+    result_path = os.path.join(workdir, 'checks.json')
+    log_path = os.path.join(workdir, 'checks.log')
+
+    command = [sys.executable, os.path.join(BENCHMARK_DIR, 'checks.py'), '--db', db_path,
+               '--nst-path', nst_path, '--result', result_path]
+
+    print('Running consistency checks...')
+    with open(log_path, 'w') as log:
+        subprocess.run(command, env=env, stdout=log, stderr=subprocess.STDOUT)
+
+    if not os.path.exists(result_path):
+        with open(log_path) as log:
+            print(''.join(log.readlines()[-20:]))
+        raise RuntimeError(f'Consistency checks failed to run, see {log_path}, exiting...')
+
+    with open(result_path) as f:
+        return json.load(f)
+
+
+def find_regressions(results: dict, baseline: dict | None, tolerance: float) -> list[str]:
+    """
+    :param dict results: Measurements of each stage.
+    :param dict baseline: Baseline measurements of each stage, if any were saved.
+    :param float tolerance: Growth allowed over the baseline, as a fraction of it.
+    :return list[str]: A description of each regression.
+    """
+    regressions = []
+    for stage, result in results.items():
+        if baseline is None or stage not in baseline:
+            continue
+        for metric in COMPARED_METRICS:
+            limit = baseline[stage][metric] * (1 + tolerance)
+            if result[metric] > limit:
+                regressions.append(f'{stage} {metric}: {result[metric]} against a baseline of '
+                                   f'{baseline[stage][metric]}')
+        if result['rows'] != baseline[stage]['rows']:
+            regressions.append(f"{stage} rows: {result['rows']} against a baseline of "
+                               f"{baseline[stage]['rows']}")
+
+    return regressions
+
+
+def report(results: dict, baseline: dict | None, differences: dict) -> None:
+    """
+    :param dict results: Measurements of each stage.
+    :param dict baseline: Baseline measurements of each stage, if any were saved.
+    :param dict differences: Rows that differ from the original transforms, for each table.
+    """
+    print(f"\n{'stage':<28}{'seconds':>10}{'peak MB':>10}{'rows':>10}{'rows/sec':>12}"
+          f"{'baseline s':>12}")
+    for stage, result in results.items():
+        base = baseline[stage]['seconds'] if baseline and stage in baseline else '-'
+        print(f"{stage:<28}{result['seconds']:>10}{result['peak_rss_mb']:>10}"
+              f"{result['rows']:>10}{result['rows_per_sec']:>12}{base:>12}")
+
+    print(f"\n{'table':<28}{'differing rows':>16}")
+    for table_name, count in differences.items():
+        print(f'{table_name:<28}{count:>16}')
+    print()
+
+
+def main(profile: str, workdir: str | None = None, baseline_path: str = DEFAULT_BASELINE_PATH,
+         save_baseline: bool = False, tolerance: float = DEFAULT_TOLERANCE) -> bool:
+    """
+    Runs the benchmark.
+
+    :param str profile: One of fixtures.PROFILES.
+    :param str workdir: Directory for the fixtures, database and logs. If not provided, a
+                        temporary directory is used and removed afterwards.
+    :param str baseline_path: JSON file of baselines, keyed by profile.
+    :param bool save_baseline: If True, store this run's measurements as the profile's baseline.
+    :param float tolerance: Growth allowed over the baseline, as a fraction of it.
+    :return bool: True if the output matched and nothing regressed.
+    """
+    keep = workdir is not None
+    workdir = workdir or tempfile.mkdtemp(prefix='hockey-bench-')
+    os.makedirs(workdir, exist_ok=True)
+
+    fixture_dir = os.path.join(workdir, 'fixtures')
+    db_path = os.path.join(workdir, 'bench.duckdb')
+    nst_path = os.path.join(fixture_dir, fixtures.NST_DIR)
+
+    if os.path.exists(fixture_dir):
+        shutil.rmtree(fixture_dir)
+    written = fixtures.generate(fixture_dir, fixtures.PROFILES[profile])
+    create_database(db_path)
+
+    http_server, url = server.start(fixture_dir)
+    env = dict(os.environ,
+               MONEYPUCK_URL=url,
+               HOCKEY_DB_BACKEND='duckdb',
+               HOCKEY_DB_PATH=db_path,
+               HOCKEY_PLAYER_INDEX=os.path.join(workdir, 'player_index.parquet'),
+               HOCKEY_METRICS_PATH=os.path.join(workdir, 'metrics.jsonl'),
+               HOCKEY_HEADER_CACHE=os.path.join(workdir, 'headers.json'))
+
+    try:
+        results = {stage: run_stage(stage, workdir, env, written['seasons'], nst_path)
+                   for stage in STAGES}
+    finally:
+        http_server.shutdown()
+
+    differences = check_equivalence(db_path, fixture_dir, written['seasons'],
+                                    written['game_ids'])
+    checks = run_checks(workdir, env, db_path, nst_path)
+
+    baselines = {}
+    if os.path.exists(baseline_path):
+        with open(baseline_path) as f:
+            baselines = json.load(f)
+    baseline = baselines.get(profile)
+
+    report(results, baseline, differences)
+    regressions = find_regressions(results, baseline, tolerance)
+    mismatched = [table_name for table_name, count in differences.items() if count]
+
+    if baseline is None and not save_baseline:
+        print(f'No baseline for the {profile} profile, run with --save-baseline to record one')
+    for regression in regressions:
+        print(f'Regression: {regression}')
+    for table_name in mismatched:
+        print(f"Output of {table_name} doesn't match the original transforms")
+    failed = {name: result for name, result in checks.items() if result != 'ok'}
+    for name, result in failed.items():
+        print(f'Check {name} failed: {result}')
+
+    if save_baseline:
+        if mismatched:
+            print('Not saving a baseline for a run whose output doesn\'t match')
+        else:
+            baselines[profile] = results
+            with open(baseline_path, 'w') as f:
+                json.dump(baselines, f, indent=2)
+            print(f'Saved baseline for the {profile} profile to {baseline_path}')
+
+    if not keep:
+        shutil.rmtree(workdir)
+
+    return not regressions and not mismatched and not failed
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument('--profile', choices=list(fixtures.PROFILES), default='default',
+                        help='Scale of the fixtures.')
+    parser.add_argument('-w', '--workdir', type=str, default=None,
+                        help='Directory for the fixtures, database and logs, kept after the run. '
+                             'Defaults to a temporary directory.')
+    parser.add_argument('-b', '--baseline', type=str, default=DEFAULT_BASELINE_PATH,
+                        help='JSON file of baselines, keyed by profile.')
+    parser.add_argument('--save-baseline', action='store_true',
+                        help="Store this run's measurements as the profile's baseline.")
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE,
+                        help='Growth allowed over the baseline, as a fraction of it.')
+    args = parser.parse_args()
+
+    passed = main(args.profile, args.workdir, args.baseline, args.save_baseline, args.tolerance)
+    sys.exit(0 if passed else 1)
@@ -0,0 +1,136 @@
+-- Tables loaded by the benchmarks, matching the ones in the database. The ENUM types are created
+-- first by dimensions.create_types.
+
+CREATE TABLE skaters (
+    playerID INT,
+    season INT,
+    name VARCHAR,
+    team team_code,
+    position position_code,
+    situation situation_code,
+    gamesPlayed INT,
+    iceTime FLOAT,
+    points INT,
+    goals INT,
+    individualxGoals FLOAT,
+    xGoalsFor FLOAT,
+    xGoalsAgainst FLOAT,
+    goalsFor INT,
+    goalsAgainst INT,
+    xGoalsForPerHour FLOAT,
+    xGoalsAgainstPerHour FLOAT,
+    goalsForPerHour FLOAT,
+    goalsAgainstPerHour FLOAT,
+    pointsPerHour FLOAT,
+    goalsPerHour FLOAT,
+    averageIceTime FLOAT,
+    penaltiesTaken INT,
+    penaltiesDrawn INT,
+    faceoffsWon INT,
+    faceoffsLost INT,
+    shotsBlocked INT,
+    oZoneShifts INT,
+    dZoneShifts INT,
+    neutralZoneShifts INT,
+    flyShifts INT
+);
+
+CREATE TABLE goalies (
+    playerID INT,
+    season INT,
+    name VARCHAR,
+    team team_code,
+    situation situation_code,
+    gamesPlayed INT,
+    iceTime FLOAT,
+    xGoals FLOAT,
+    goals INT,
+    lowDangerShots INT,
+    mediumDangerShots INT,
+    highDangerShots INT,
+    lowDangerxGoals FLOAT,
+    mediumDangerxGoals FLOAT,
+    highDangerxGoals FLOAT,
+    lowDangerGoals INT,
+    mediumDangerGoals INT,
+    highDangerGoals INT
+);
+
+CREATE TABLE teams (
+    team team_code,
+    season INT,
+    situation situation_code,
+    gamesPlayed INT,
+    iceTime FLOAT,
+    xGoalsFor FLOAT,
+    goalsFor INT,
+    xGoalsAgainst FLOAT,
+    goalsAgainst INT,
+    goalsForPerHour FLOAT,
+    goalsAgainstPerHour FLOAT,
+    xGoalsForPerHour FLOAT,
+    xGoalsAgainstPerHour FLOAT
+);
+
+CREATE TABLE team_games (
+    team team_code,
+    season INT,
+    gameID INT,
+    gameDate DATE,
+    isHomeTeam BOOL,
+    iceTime FLOAT,
+    situation situation_code,
+    xGoalsFor FLOAT,
+    xGoalsAgainst FLOAT,
+    xGoalsShare FLOAT,
+    corsiShare FLOAT,
+    goalsFor INT,
+    goalsAgainst INT,
+    penaltyMinutesFor INT,
+    penaltyMinutesAgainst INT
+);
+
+CREATE TABLE skater_games (
+    name VARCHAR,
+    gameID INT,
+    gameDate DATE,
+    season INT,
+    team team_code,
+    position VARCHAR,
+    situation situation_code,
+    iceTime FLOAT,
+    goals INT,
+    primaryAssists INT,
+    secondaryAssists INT,
+    shots INT,
+    individualxGoals FLOAT,
+    goalsFor INT,
+    goalsAgainst INT,
+    goalsShare FLOAT,
+    xGoalsFor FLOAT,
+    xGoalsAgainst FLOAT,
+    xGoalsShare FLOAT,
+    corsiFor INT,
+    corsiAgainst INT,
+    corsiShare FLOAT,
+    penaltiesTaken INT,
+    penaltiesDrawn INT,
+    hits INT,
+    playerID INT,
+    PRIMARY KEY (gameID, name, team, situation)
+);
+
+CREATE TABLE goalie_games (
+    name VARCHAR,
+    gameID INT,
+    gameDate DATE,
+    season INT,
+    team team_code,
+    situation situation_code,
+    iceTime FLOAT,
+    shotsAgainst INT,
+    goalsAgainst INT,
+    xGoalsAgainst FLOAT,
+    playerID INT,
+    PRIMARY KEY (gameID, name, team, situation)
+);
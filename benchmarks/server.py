@@ -0,0 +1,54 @@
+"""
+Local stand-in for MoneyPuck, serving the fixtures over HTTP so that the pipeline downloads them
+exactly as it would the real files. Point the pipeline at it with the MONEYPUCK_URL env variable.
+
+Usage:
+    python server.py -d bench_data -p 8000
+    MONEYPUCK_URL=http://127.0.0.1:8000/moneypuck/playerData python ../hockey/update_tables.py
+"""
+import functools
+import threading
+from argparse import ArgumentParser
+from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler
+
+
+class QuietHandler(SimpleHTTPRequestHandler):
+    """
+    Serves files like SimpleHTTPRequestHandler (including Last-Modified and If-Modified-Since),
+    without logging every request.
+    """
+
+    def log_message(self, format: str, *args) -> None:
+        pass
+
+
+def start(directory: str, port: int = 0) -> tuple[ThreadingHTTPServer, str]:
+    """
+    Starts serving a directory from a background thread.
+
+    :param str directory: Root directory of the fixtures.
+    :param int port: Port to listen on, 0 picks a free one.
+    :return tuple[ThreadingHTTPServer, str]: The server (call shutdown() to stop it), and the
+                                             MONEYPUCK_URL for it.
+    """
+    handler = functools.partial(QuietHandler, directory=directory)
+    server = ThreadingHTTPServer(('127.0.0.1', port), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    return server, f'http://127.0.0.1:{server.server_address[1]}/moneypuck/playerData'
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument('-d', '--directory', type=str, default='bench_data',
+                        help='Root directory of the fixtures.')
+    parser.add_argument('-p', '--port', type=int, default=8000,
+                        help='Port to listen on.')
+    args = parser.parse_args()
+
+    server, url = start(args.directory, args.port)
+    print(f'Serving {args.directory} at {url}')
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
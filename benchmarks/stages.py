@@ -0,0 +1,109 @@
+"""
+Runs one stage of the benchmark, in its own process so that its peak RSS can be measured on its
+own. The stage writes its wall time, peak RSS and the number of rows it loaded to a JSON file.
+
+Normally started by run.py, which sets up the fixtures, the local HTTP stand-in and the local
+DuckDB file, and points the pipeline at them through the environment (MONEYPUCK_URL,
+HOCKEY_DB_BACKEND, HOCKEY_DB_PATH, HOCKEY_PLAYER_INDEX).
+
+Usage:
+    python stages.py update_tables -s 2023 2024 --result update_tables.json
+    python stages.py update_player_game_tables --nst-path bench_data/nst --result nst.json
+"""
+import os
+import sys
+import json
+import time
+import resource
+from argparse import ArgumentParser
+
+# The modules in hockey/ import each other by name, so that directory needs to be on the path
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'hockey'))
+
+import storage
+import update_tables
+import update_player_game_tables
+
+
+############## Constants ################
+
+# Tables written by each stage
+STAGE_TABLES = {
+    'update_tables': list(update_tables.SOURCES),
+    'update_player_game_tables': list(update_player_game_tables.TABLE_FILE_KINDS)
+}
+
+########### End Constants ###############
+
+
+def row_count(tables: list[str]) -> int:
+    """
+    :param list[str] tables: Tables to count.
+    :return int: Total number of rows in the tables.
+    """
+    conn = storage.get_connection()
+    return sum(conn.execute(f'SELECT count(*) FROM {table_name}').fetchone()[0]
+               for table_name in tables)
+
+
+def peak_rss_mb() -> float:
+    """
+    :return float: Peak resident set size of this process so far, in MB.
+    """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS, and in kilobytes everywhere else
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def run_stage(stage: str, seasons: list[int], nst_path: str | None) -> None:
+    """
+    :param str stage: One of STAGE_TABLES.
+    :param list[int] seasons: Seasons loaded by update_tables.
+    :param str nst_path: Folder of NST CSVs loaded by update_player_game_tables.
+    """
+    if stage == 'update_tables':
+        for season in seasons:
+            update_tables.main(season)
+    else:
+        update_player_game_tables.main(nst_path)
+
+
+def main(stage: str, seasons: list[int], nst_path: str | None, result_path: str) -> None:
+    """
+    Runs a stage and writes its measurements. Connecting to the database isn't timed.
+
+    :param str stage: One of STAGE_TABLES.
+    :param list[int] seasons: Seasons loaded by update_tables.
+    :param str nst_path: Folder of NST CSVs loaded by update_player_game_tables.
+    :param str result_path: JSON file to write the measurements to.
+    """
+    before = row_count(STAGE_TABLES[stage])
+
+    start = time.perf_counter()
+    run_stage(stage, seasons, nst_path)
+    seconds = time.perf_counter() - start
+
+    rows = row_count(STAGE_TABLES[stage]) - before
+    result = {
+        'seconds': round(seconds, 3),
+        'peak_rss_mb': round(peak_rss_mb(), 1),
+        'rows': rows,
+        'rows_per_sec': round(rows / seconds, 1) if seconds > 0 else None
+    }
+    with open(result_path, 'w') as f:
+        json.dump(result, f, indent=2)
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument('stage', choices=list(STAGE_TABLES),
+                        help='Stage to run.')
+    parser.add_argument('-s', '--seasons', type=int, nargs='*', default=[],
+                        help='Seasons loaded by update_tables.')
+    parser.add_argument('--nst-path', type=str, default=None,
+                        help='Folder of NST CSVs loaded by update_player_game_tables.')
+    parser.add_argument('--result', type=str, required=True,
+                        help='JSON file to write the measurements to.')
+    args = parser.parse_args()
+
+    main(args.stage, args.seasons, args.nst_path, args.result)
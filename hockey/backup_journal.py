@@ -0,0 +1,365 @@
+"""
+Journal-based backups for the game-by-game tables. Instead of copying a whole table before every
+update, each batch of rows written to a table is recorded in the journal, along with a pre-image
+of any rows in the table for the same games. Any point in the journal can then be returned to,
+either by undoing the later entries, or by replaying entries on top of the last full snapshot
+made by backup_dbs.py. Either way, the season totals of the table (see season_aggregates.py) are
+recomputed and the rows changed are recorded in the change log (see change_log.py), in the same
+transaction as the table itself.
+
+The journal is kept in two kinds of tables:
+    - backup_journal: one row per entry (a batch written to a table, or a full snapshot)
+    - journal_{table}: the rows recorded for each entry, with 'pre'/'post' images
+
+Usage:
+    python backup_journal.py list -t skater_games
+    python backup_journal.py rollback -t skater_games --to 42
+    python backup_journal.py restore -t skater_games --to 42
+    python backup_journal.py prune -t skater_games
+"""
+from argparse import ArgumentParser
+
+import duckdb
+import polars as pl
+
+import storage
+import change_log
+import table_sync
+import season_aggregates
+
+
+############## Constants ################
+
+# Column used to find the rows in a table that belong to a batch
+BATCH_KEY = 'gameID'
+
+# Sequence journal IDs are drawn from, so that entries recorded at the same time from different
+# cursors never share an ID
+JOURNAL_SEQUENCE = 'backup_journal_id'
+
+########### End Constants ###############
+
+
+def is_journaled(conn: duckdb.DuckDBPyConnection, table_name: str) -> bool:
+    """
+    Only tables written to in per-game batches (i.e. that have a BATCH_KEY column) are journaled.
+
+    :param duckdb.DuckDBPyConnection conn: Connection to the database.
+    :param str table_name: Table to check.
+    :return bool: True if the table can be journaled.
+    """
+    columns = [row[0] for row in conn.execute(f'DESCRIBE {table_name}').fetchall()]
+    return BATCH_KEY in columns
+
+
+def ensure_journal(conn: duckdb.DuckDBPyConnection, table_name: str) -> None:
+    """
+    Creates the journal tables for a table if they don't exist yet. Entries recorded from several
+    cursors at once (e.g. by backup_dbs.py --parallel) would conflict creating them, so this is
+    called before they start.
+
+    :param duckdb.DuckDBPyConnection conn: Connection to the database.
+    :param str table_name: Table being journaled.
+    """
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS backup_journal (
+            journalID BIGINT,
+            tableName VARCHAR,
+            operation VARCHAR,
+            gameIDs INT[],
+            rowsBefore BIGINT,
+            rowsAfter BIGINT,
+            createdAt TIMESTAMP
+        );
+    """)
+    # A journal from before IDs came from the sequence carries on from its highest ID
+    if not conn.execute('SELECT count(*) FROM duckdb_sequences() WHERE sequence_name = ?',
+                        [JOURNAL_SEQUENCE]).fetchone()[0]:
+        start = conn.execute('SELECT coalesce(max(journalID), 0) + 1 FROM backup_journal')\
+            .fetchone()[0]
+        conn.execute(f'CREATE SEQUENCE IF NOT EXISTS {JOURNAL_SEQUENCE} START WITH {start}')
+    conn.execute(f"""
+        CREATE TABLE IF NOT EXISTS journal_{table_name} AS
+        SELECT NULL::BIGINT AS journalID, NULL::VARCHAR AS image, *
+        FROM {table_name} LIMIT 0;
+    """)
+
+
+def _next_journal_id(conn: duckdb.DuckDBPyConnection) -> int:
+    return conn.execute(f"SELECT nextval('{JOURNAL_SEQUENCE}')").fetchone()[0]
+
+
+def record_batch(conn: duckdb.DuckDBPyConnection, table_name: str, df: pl.DataFrame) -> int:
+    """
+    Records a batch that is about to be written to a table. Should be called before the write,
+    so that the pre-image holds the rows the write will replace (if any).
+
+    :param duckdb.DuckDBPyConnection conn: Connection to the database.
+    :param str table_name: Table the batch will be written to.
+    :param pl.DataFrame df: Rows in the batch, with the table's column names.
+    :return int: ID of the new journal entry.
+    """
+    ensure_journal(conn, table_name)
+    game_ids = sorted(df[BATCH_KEY].unique().to_list())
+
+    conn.execute('BEGIN TRANSACTION')
+    try:
+        journal_id = _next_journal_id(conn)
+
+        conn.execute(f"""
+            INSERT INTO journal_{table_name}
+            SELECT {journal_id}, 'pre', * FROM {table_name}
+            WHERE {BATCH_KEY} IN (SELECT unnest(?::INT[]))
+        """, [game_ids])
+        conn.execute(f"INSERT INTO journal_{table_name} BY NAME "
+                     f"SELECT {journal_id} AS journalID, 'post' AS image, * FROM df")
+
+        rows_before = conn.execute(f"""
+            SELECT count(*) FROM journal_{table_name}
+            WHERE journalID = {journal_id} AND image = 'pre'
+        """).fetchone()[0]
+
+        conn.execute("""
+            INSERT INTO backup_journal VALUES (?, ?, 'batch', ?, ?, ?, current_localtimestamp())
+        """, [journal_id, table_name, game_ids, rows_before, len(df)])
+        conn.execute('COMMIT')
+    except Exception:
+        conn.execute('ROLLBACK')
+        raise
+
+    return journal_id
+
+
+def record_snapshot(conn: duckdb.DuckDBPyConnection, table_name: str) -> int:
+    """
+    Records that a full snapshot of a table has just been taken into backup_{table}. Replays
+    start from the most recent snapshot.
+
+    :param duckdb.DuckDBPyConnection conn: Connection to the database.
+    :param str table_name: Table that was snapshotted.
+    :return int: ID of the new journal entry.
+    """
+    ensure_journal(conn, table_name)
+    journal_id = _next_journal_id(conn)
+    rows = conn.execute(f'SELECT count(*) FROM backup_{table_name}').fetchone()[0]
+
+    conn.execute("""
+        INSERT INTO backup_journal VALUES (?, ?, 'snapshot', [], NULL, ?, current_localtimestamp())
+    """, [journal_id, table_name, rows])
+
+    return journal_id
+
+
+def discard(conn: duckdb.DuckDBPyConnection, journal_id: int) -> None:
+    """
+    Removes a journal entry and its rows, e.g. when the write it was recorded for failed.
+
+    :param duckdb.DuckDBPyConnection conn: Connection to the database.
+    :param int journal_id: Entry to remove.
+    """
+    table_name = conn.execute('SELECT tableName FROM backup_journal WHERE journalID = ?',
+                              [journal_id]).fetchone()[0]
+    conn.execute(f'DELETE FROM journal_{table_name} WHERE journalID = {journal_id}')
+    conn.execute(f'DELETE FROM backup_journal WHERE journalID = {journal_id}')
+
+
+def _apply_image(conn: duckdb.DuckDBPyConnection, table_name: str, journal_id: int,
+                 image: str) -> None:
+    """
+    Replaces the rows of the games an entry touched with its pre or post image. A batch replaces
+    every row of its games, so undoing it puts back every row of its games from before it, and
+    replaying it leaves only the rows it wrote.
+    """
+    conn.execute(f"""
+        DELETE FROM {table_name}
+        WHERE {BATCH_KEY} IN (SELECT {BATCH_KEY} FROM journal_{table_name}
+                              WHERE journalID = {journal_id})
+    """)
+    conn.execute(f"""
+        INSERT INTO {table_name}
+        SELECT * EXCLUDE (journalID, image) FROM journal_{table_name}
+        WHERE journalID = {journal_id} AND image = '{image}'
+    """)
+
+
+def _begin_revert(conn: duckdb.DuckDBPyConnection, table_name: str,
+                  scope: str | None) -> pl.DataFrame | None:
+    """
+    Prepares for rolling back or restoring a table: makes sure its totals tables exist (creating
+    them fills them in a transaction of their own), and reads the keys of the rows about to be
+    changed, so they can be compared with what is there afterwards.
+
+    :param duckdb.DuckDBPyConnection conn: Connection to the database.
+    :param str table_name: Table about to be changed.
+    :param str scope: SQL predicate for the rows about to be changed, or None for the whole table.
+    :return pl.DataFrame: Keys of the rows in the scope, or None if the table has no change log.
+    """
+    if table_name in season_aggregates.TOTALS_TABLES:
+        season_aggregates.ensure_tables(conn, table_name)
+
+    if table_name not in table_sync.NATURAL_KEYS:
+        return None
+
+    return conn.execute(f"""
+        SELECT DISTINCT {', '.join(table_sync.NATURAL_KEYS[table_name])} FROM {table_name}
+        {f'WHERE {scope}' if scope is not None else ''}
+    """).pl()
+
+
+def _finish_revert(conn: duckdb.DuckDBPyConnection, table_name: str, previous: pl.DataFrame | None,
+                   scope: str | None, seasons: list[int] | None) -> None:
+    """
+    Brings the totals and change log in line with a table that has just been rolled back or
+    restored. Must be called inside the same transaction, so they are committed together.
+
+    :param duckdb.DuckDBPyConnection conn: Connection to the database.
+    :param str table_name: Table that was changed.
+    :param pl.DataFrame previous: Output of `_begin_revert`, from before the change.
+    :param str scope: SQL predicate for the rows that were changed, or None for the whole table.
+    :param list[int] seasons: Seasons whose totals are recomputed, or None for every season.
+    """
+    if previous is not None:
+        change_log.record(conn, table_name, change_log.compare(conn, table_name, previous, scope))
+
+    if table_name in season_aggregates.TOTALS_TABLES:
+        season_aggregates.recompute(conn, table_name, seasons)
+
+
+def rollback(conn: duckdb.DuckDBPyConnection, table_name: str, to_journal_id: int) -> None:
+    """
+    Returns a table to the state it was in right after the given journal entry, by undoing every
+    later batch in reverse order. The undone entries are removed from the journal, and the totals
+    of the seasons they touched are recomputed.
+
+    :param duckdb.DuckDBPyConnection conn: Connection to the database.
+    :param str table_name: Table to roll back.
+    :param int to_journal_id: Last entry to keep, 0 to undo every journaled batch.
+    """
+    entries = [row[0] for row in conn.execute("""
+        SELECT journalID FROM backup_journal
+        WHERE tableName = ? AND operation = 'batch' AND journalID > ?
+        ORDER BY journalID DESC
+    """, [table_name, to_journal_id]).fetchall()]
+
+    if not entries:
+        return
+
+    # Both images of every entry, since an undone batch may have moved games between seasons
+    journaled = f"""
+        FROM journal_{table_name}
+        WHERE journalID IN ({', '.join(str(journal_id) for journal_id in entries)})
+    """
+    game_ids, seasons = conn.execute(f'SELECT list(DISTINCT {BATCH_KEY}), list(DISTINCT season) '
+                                     f'{journaled}').fetchone()
+    scope = f"{BATCH_KEY} IN ({', '.join(str(game_id) for game_id in game_ids)})"
+
+    previous = _begin_revert(conn, table_name, scope)
+
+    conn.execute('BEGIN TRANSACTION')
+    try:
+        for journal_id in entries:
+            print(f'Undoing journal entry {journal_id}...')
+            _apply_image(conn, table_name, journal_id, 'pre')
+            discard(conn, journal_id)
+        _finish_revert(conn, table_name, previous, scope, seasons)
+        conn.execute('COMMIT')
+    except Exception:
+        conn.execute('ROLLBACK')
+        raise
+
+
+def restore(conn: duckdb.DuckDBPyConnection, table_name: str, to_journal_id: int) -> None:
+    """
+    Rebuilds a table as it was right after the given journal entry, by restoring the most recent
+    full snapshot and replaying every batch recorded after it, up to and including that entry.
+    Every season's totals are recomputed, since the snapshot may differ from the table anywhere.
+
+    :param duckdb.DuckDBPyConnection conn: Connection to the database.
+    :param str table_name: Table to restore.
+    :param int to_journal_id: Last entry to replay.
+    :raises ValueError: If there is no snapshot taken at or before the entry.
+    """
+    snapshot = conn.execute("""
+        SELECT max(journalID) FROM backup_journal
+        WHERE tableName = ? AND operation = 'snapshot'
+    """, [table_name]).fetchone()[0]
+
+    if snapshot is None or snapshot > to_journal_id:
+        raise ValueError(f'No snapshot of {table_name} at or before journal entry '
+                         f'{to_journal_id}, use rollback instead.')
+
+    entries = [row[0] for row in conn.execute("""
+        SELECT journalID FROM backup_journal
+        WHERE tableName = ? AND operation = 'batch' AND journalID > ? AND journalID <= ?
+        ORDER BY journalID
+    """, [table_name, snapshot, to_journal_id]).fetchall()]
+
+    previous = _begin_revert(conn, table_name, None)
+
+    conn.execute('BEGIN TRANSACTION')
+    try:
+        print(f'Restoring {table_name} from snapshot {snapshot}...')
+        conn.execute(f'DELETE FROM {table_name}')
+        conn.execute(f'INSERT INTO {table_name} SELECT * FROM backup_{table_name}')
+
+        for journal_id in entries:
+            print(f'Replaying journal entry {journal_id}...')
+            _apply_image(conn, table_name, journal_id, 'post')
+        _finish_revert(conn, table_name, previous, None, None)
+        conn.execute('COMMIT')
+    except Exception:
+        conn.execute('ROLLBACK')
+        raise
+
+
+def prune(conn: duckdb.DuckDBPyConnection, table_name: str) -> None:
+    """
+    Removes every journal entry for a table from before its most recent snapshot, since those can
+    no longer be replayed.
+
+    :param duckdb.DuckDBPyConnection conn: Connection to the database.
+    :param str table_name: Table whose journal is pruned.
+    """
+    snapshot = conn.execute("""
+        SELECT max(journalID) FROM backup_journal
+        WHERE tableName = ? AND operation = 'snapshot'
+    """, [table_name]).fetchone()[0]
+
+    if snapshot is None:
+        return
+
+    conn.execute(f'DELETE FROM journal_{table_name} WHERE journalID < {snapshot}')
+    conn.execute('DELETE FROM backup_journal WHERE tableName = ? AND journalID < ?',
+                 [table_name, snapshot])
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument('command', choices=['list', 'rollback', 'restore', 'prune'],
+                        help='Action to take on the journal.')
+    parser.add_argument('-t', '--table', required=True, type=str,
+                        help='Journaled table to act on.')
+    parser.add_argument('--to', type=int, default=None,
+                        help='Journal entry to roll back or restore to.')
+    args = parser.parse_args()
+
+    conn = storage.get_connection()
+
+    if args.command == 'list':
+        conn.sql(f"""
+            SELECT * FROM backup_journal WHERE tableName = '{args.table}' ORDER BY journalID
+        """).show(max_rows=100)
+    elif args.command == 'prune':
+        prune(conn, args.table)
+    else:
+        if args.to is None:
+            parser.error(f'--to is required for {args.command}')
+        if args.command == 'rollback':
+            rollback(conn, args.table, args.to)
+        else:
+            restore(conn, args.table, args.to)
+
+    if args.command in ['rollback', 'restore']:
+        change_log.export(conn)
+    if args.command != 'list':
+        storage.persist()
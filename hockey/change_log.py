@@ -0,0 +1,201 @@
+"""
+Change log of the rows touched by each load, so that whatever is built from the tables (plots,
+reports) can be rebuilt for the affected teams and players only, rather than for everything.
+
+Every write made by update_tables.py and update_player_game_tables.py adds one row to the
+change_log table for each row it inserted, updated or deleted, in the same transaction as the
+write, so the log never holds changes that were rolled back or misses ones that went through:
+    runID: ID of the run that made the change, shared with its timing spans (see metrics.py)
+    tableName: Table that was changed
+    key: The row's natural key (see table_sync.NATURAL_KEYS), as a JSON object
+    operation: 'insert', 'update' or 'delete'
+    recordedAt: When the change was recorded
+
+In the 'diff' write mode only the rows whose contents changed are logged. Writes that replace a
+whole season or batch of games log every row they replace as an update, since the rows aren't
+compared first.
+
+The changes of each run can also be written to an Arrow IPC file, by setting the
+HOCKEY_CHANGE_LOG_IPC env variable. '{run_id}' in the path is replaced with the run's ID.
+
+Finding the teams that played in the latest run's games:
+    SELECT DISTINCT key->>'team' FROM change_log
+    WHERE tableName = 'team_games' AND runID = (SELECT max_by(runID, recordedAt) FROM change_log)
+
+Usage:
+    python change_log.py list
+    python change_log.py list -r 3f2a9c1b7d4e
+"""
+import os
+from argparse import ArgumentParser
+
+import duckdb
+import polars as pl
+
+import metrics
+import storage
+import table_sync
+
+
+############## Constants ################
+
+CHANGE_LOG_TABLE = 'change_log'
+
+# Arrow IPC file each run's changes are written to, only written if set
+DEFAULT_IPC_PATH = os.environ.get('HOCKEY_CHANGE_LOG_IPC')
+
+########### End Constants ###############
+
+
+def ensure_table(conn: duckdb.DuckDBPyConnection) -> None:
+    """
+    Creates the change log table if it doesn't exist yet.
+
+    :param duckdb.DuckDBPyConnection conn: Connection to the database.
+    """
+    conn.execute(f"""
+        CREATE TABLE IF NOT EXISTS {CHANGE_LOG_TABLE} (
+            runID VARCHAR,
+            tableName VARCHAR,
+            key JSON,
+            operation VARCHAR,
+            recordedAt TIMESTAMP
+        );
+    """)
+
+
+def capture(conn: duckdb.DuckDBPyConnection, table_name: str, df: pl.DataFrame,
+            scope: str | None = None) -> pl.DataFrame:
+    """
+    Works out the changes a write that replaces every row in a scope will make, by matching the
+    incoming rows to the existing ones on the table's natural key. Must be called before the
+    write, and the result passed to `record` inside the write's transaction.
+
+    :param duckdb.DuckDBPyConnection conn: Connection to the database.
+    :param str table_name: Table about to be written, must be one of table_sync.NATURAL_KEYS.
+    :param pl.DataFrame df: Rows about to be written.
+    :param str scope: SQL predicate for the rows being replaced, or None for the whole table.
+    :return pl.DataFrame: The key of every row inserted, replaced or deleted, with its operation.
+    """
+    keys = table_sync.NATURAL_KEYS[table_name]
+    existing = f"SELECT * FROM {table_name} {f'WHERE {scope}' if scope is not None else ''}"
+
+    return _classify(conn, keys, 'SELECT * FROM rows', existing, df)
+
+
+def compare(conn: duckdb.DuckDBPyConnection, table_name: str, previous: pl.DataFrame,
+            scope: str | None = None) -> pl.DataFrame:
+    """
+    Works out the changes made to every row in a scope since `previous` was read, for changes
+    that aren't known until they have been made (e.g. a rollback from the backup journal). The
+    result is passed to `record` like that of `capture`.
+
+    :param duckdb.DuckDBPyConnection conn: Connection to the database.
+    :param str table_name: Table that was changed, must be one of table_sync.NATURAL_KEYS.
+    :param pl.DataFrame previous: Keys of the rows that were in the scope before the change.
+    :param str scope: SQL predicate for the rows that were changed, or None for the whole table.
+    :return pl.DataFrame: The key of every row in the scope, or removed from it, with its operation.
+    """
+    keys = table_sync.NATURAL_KEYS[table_name]
+    current = f"SELECT * FROM {table_name} {f'WHERE {scope}' if scope is not None else ''}"
+
+    return _classify(conn, keys, current, 'SELECT * FROM rows', previous)
+
+
+def _classify(conn: duckdb.DuckDBPyConnection, keys: list[str], new: str, old: str,
+              rows: pl.DataFrame) -> pl.DataFrame:
+    # The queries read the DataFrame as `rows`, the name it has in this function
+    match = ' AND '.join(f'n.{key} IS NOT DISTINCT FROM t.{key}' for key in keys)
+
+    return conn.execute(f"""
+        SELECT
+            {', '.join(f'COALESCE(n.{key}, t.{key}) AS {key}' for key in keys)},
+            CASE
+                WHEN t.present IS NULL THEN 'insert'
+                WHEN n.present IS NULL THEN 'delete'
+                ELSE 'update'
+            END AS operation
+        FROM (SELECT DISTINCT {', '.join(keys)}, true AS present FROM ({new})) n
+        FULL OUTER JOIN (
+            SELECT DISTINCT {', '.join(keys)}, true AS present FROM ({old})
+        ) t ON {match}
+    """).pl()
+
+
+def record(conn: duckdb.DuckDBPyConnection, table_name: str,
+           captured: pl.DataFrame | None = None) -> int:
+    """
+    Adds the changes of a write to the change log. Must be called inside the write's transaction,
+    after the write, so that both are committed together.
+
+    :param duckdb.DuckDBPyConnection conn: Connection to the database.
+    :param str table_name: Table that was written, must be one of table_sync.NATURAL_KEYS.
+    :param pl.DataFrame captured: Output of `capture` (or `compare`) for the write. If not
+                                  provided, the changes are read from the `changes` temp table
+                                  left by table_sync.
+    :return int: Number of changes recorded.
+    """
+    ensure_table(conn)
+    keys = table_sync.NATURAL_KEYS[table_name]
+    source = 'changes' if captured is None else 'captured'
+
+    return conn.execute(f"""
+        INSERT INTO {CHANGE_LOG_TABLE}
+        SELECT ?, ?, json_object({', '.join(f"'{key}', {key}" for key in keys)}), operation,
+               current_localtimestamp()
+        FROM {source}
+    """, [metrics.RUN_ID, table_name]).fetchone()[0]
+
+
+def read_changes(conn: duckdb.DuckDBPyConnection, run_id: str | None = None) -> pl.DataFrame:
+    """
+    :param duckdb.DuckDBPyConnection conn: Connection to the database.
+    :param str run_id: Run to read. If not provided, the latest run in the change log.
+    :return pl.DataFrame: The run's changes, with their keys as JSON text.
+    """
+    ensure_table(conn)
+    if run_id is None:
+        run_id = conn.execute(f'SELECT max_by(runID, recordedAt) FROM {CHANGE_LOG_TABLE}')\
+            .fetchone()[0]
+
+    return conn.execute(f"""
+        SELECT runID, tableName, key::VARCHAR AS key, operation, recordedAt
+        FROM {CHANGE_LOG_TABLE}
+        WHERE runID = ?
+        ORDER BY recordedAt, tableName
+    """, [run_id]).pl()
+
+
+def export(conn: duckdb.DuckDBPyConnection, path: str | None = DEFAULT_IPC_PATH) -> None:
+    """
+    Writes this run's changes to an Arrow IPC file, if one is configured. The file is replaced in
+    one step, so a consumer never reads a partial one.
+
+    :param duckdb.DuckDBPyConnection conn: Connection to the database.
+    :param str path: Arrow IPC file to write, with '{run_id}' replaced by the run's ID.
+    """
+    if path is None:
+        return
+
+    path = path.replace('{run_id}', metrics.RUN_ID)
+    print(f'Writing changes to {path}...')
+    read_changes(conn, metrics.RUN_ID).write_ipc(f'{path}.tmp')
+    os.replace(f'{path}.tmp', path)
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument('command', choices=['list'],
+                        help='list: count the changes made by a run.')
+    parser.add_argument('-r', '--run-id', type=str, default=None,
+                        help='Run to list, defaults to the latest one.')
+    args = parser.parse_args()
+
+    changes = read_changes(storage.get_connection(), args.run_id)
+    if changes.is_empty():
+        raise ValueError('No changes found in the change log, exiting...')
+
+    print(f"Run {changes['runID'][0]}:")
+    for (table_name, operation), rows in changes.group_by('tableName', 'operation',
+                                                          maintain_order=True):
+        print(f'{table_name:<20}{operation:<8}{len(rows):>10,}')
@@ -0,0 +1,213 @@
+"""
+Reader for the MoneyPuck CSVs that repairs a missing or shifted header row as it parses.
+
+Every now and then MoneyPuck publishes a file without its header row (e.g. the 2022 teams.csv,
+as of Oct. 15 2025), or with a header that doesn't line up with the data rows. The first two
+lines of the file are enough to tell: the header row should contain the columns being read, and
+have as many fields as the first data row.
+
+Headers of intact files are kept in a small JSON cache, one per source file. A broken file is then
+parsed directly by polars' CSV reader with has_header=False and the cached names, so a repair is
+no slower than a normal parse and never needs another download.
+"""
+import os
+import io
+import csv
+import json
+import threading
+
+import polars as pl
+
+from response_cache import DEFAULT_CACHE_DIR
+
+
+############## Constants ################
+
+# JSON file of known-good headers, can be overridden with the HOCKEY_HEADER_CACHE env variable
+DEFAULT_HEADER_CACHE_PATH = os.environ.get('HOCKEY_HEADER_CACHE',
+                                           os.path.join(DEFAULT_CACHE_DIR, 'headers.json'))
+
+# Name given to the leading fields of data rows that have more fields than their header row
+UNNAMED_COLUMN = 'unnamed_{}'
+
+########### End Constants ###############
+
+
+_lock = threading.Lock()
+
+
+def known_headers(path: str = DEFAULT_HEADER_CACHE_PATH) -> dict[str, list[str]]:
+    """
+    :param str path: JSON file of known-good headers.
+    :return dict[str, list[str]]: Source name -> its header row, split into fields.
+    """
+    if not os.path.exists(path):
+        return {}
+
+    with open(path) as f:
+        return json.load(f)
+
+
+def remember_header(source: str, header: list[str],
+                    path: str = DEFAULT_HEADER_CACHE_PATH) -> None:
+    """
+    Stores the header of an intact file, if it isn't already the one cached for its source.
+
+    :param str source: Name of the source file, e.g. 'teams'.
+    :param list[str] header: The file's header row, split into fields.
+    :param str path: JSON file of known-good headers.
+    """
+    with _lock:
+        headers = known_headers(path)
+        if headers.get(source) == header:
+            return
+
+        headers[source] = header
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(f'{path}.tmp', 'w') as f:
+            json.dump(headers, f, indent=2)
+        os.replace(f'{path}.tmp', path)
+
+
+def first_lines(content: bytes, count: int = 2) -> list[bytes]:
+    """
+    :param bytes content: Start of a CSV.
+    :param int count: Number of lines to return.
+    :return list[bytes]: Its first lines (fewer if it's shorter), without line endings.
+    """
+    lines = []
+    start = 0
+    while len(lines) < count and start < len(content):
+        end = content.find(b'\n', start)
+        end = len(content) if end == -1 else end
+        lines.append(content[start:end].rstrip(b'\r'))
+        start = end + 1
+
+    return lines
+
+
+def split_fields(line: bytes) -> list[str]:
+    """
+    :param bytes line: One line of a CSV.
+    :return list[str]: Its fields.
+    """
+    return next(csv.reader(io.StringIO(line.decode('utf-8'))), [])
+
+
+def dedupe(names: list[str]) -> list[str]:
+    """
+    Renames repeated column names the same way polars does when reading a header row, e.g. the
+    second 'team' in teams.csv becomes 'team_duplicated_0'.
+
+    :param list[str] names: Column names, possibly repeated.
+    :return list[str]: Unique column names.
+    """
+    seen = {}
+    unique = []
+    for name in names:
+        if name in seen:
+            unique.append(f'{name}_duplicated_{seen[name]}')
+            seen[name] += 1
+        else:
+            unique.append(name)
+            seen[name] = 0
+
+    return unique
+
+
+def resolve_header(content: bytes, source: str, columns: list[str],
+                   path: str = DEFAULT_HEADER_CACHE_PATH) -> tuple[list[str] | None, bool]:
+    """
+    Works out the column names of a CSV from its first two lines.
+
+    :param bytes content: Start of the CSV, including at least its first two lines.
+    :param str source: Name of the source file, used as its key in the header cache.
+    :param list[str] columns: Columns that will be read from the file.
+    :param str path: JSON file of known-good headers.
+    :raises ValueError: If the header is broken and no cached header fits the data rows.
+    :return tuple[list[str] | None, bool]: The names of every field of the data rows, or None if
+                                           the header is intact, and whether the first line is a
+                                           header row to skip.
+    """
+    lines = first_lines(content)
+    first = split_fields(lines[0]) if lines else []
+    width = len(split_fields(lines[1])) if len(lines) > 1 and lines[1] else len(first)
+
+    has_header = all(column in first for column in columns)
+    if has_header and len(first) == width:
+        remember_header(source, first, path)
+        return None, True
+
+    # A cached header that fits the data rows is the best guess at their names
+    cached = known_headers(path).get(source)
+    if cached is not None and len(cached) == width:
+        return cached, has_header
+
+    # Otherwise, data rows with extra fields are taken to have them at the start (e.g. an unnamed
+    # index column), with the header lined up against the rest
+    if has_header and width > len(first):
+        return [UNNAMED_COLUMN.format(i) for i in range(width - len(first))] + first, True
+
+    raise ValueError(f'The header of the {source} CSV is missing or shifted and no cached header '
+                     f'has {width} columns to replace it with, exiting...')
+
+
+def split_header(content: bytes, source: str, columns: list[str],
+                 path: str = DEFAULT_HEADER_CACHE_PATH) -> tuple[bytes, bytes]:
+    """
+    Splits the start of a CSV into a header line that can be prepended to each block of the rest
+    of it, and the rest. Used when a file is parsed in blocks as it streams in.
+
+    :param bytes content: Start of the CSV, including at least its first two lines.
+    :param str source: Name of the source file, used as its key in the header cache.
+    :param list[str] columns: Columns that will be read from the file.
+    :param str path: JSON file of known-good headers.
+    :return tuple[bytes, bytes]: The header line (ending in a newline), and the content after it.
+    """
+    names, has_header = resolve_header(content, source, columns, path)
+    first, rest = content.split(b'\n', 1) if has_header else (b'', content)
+
+    if names is None:
+        return first + b'\n', rest
+
+    print(f'Repairing the header of the {source} CSV...')
+    header = io.StringIO()
+    csv.writer(header, lineterminator='\n').writerow(dedupe(names))
+    return header.getvalue().encode('utf-8'), rest
+
+
+def read_csv(content: bytes, source: str, columns: list[str],
+             schema_overrides: dict | None = None, keep_all: bool = False,
+             path: str = DEFAULT_HEADER_CACHE_PATH) -> pl.DataFrame:
+    """
+    Reads the given columns of a CSV, repairing its header if it's missing or shifted.
+
+    :param bytes content: The whole CSV.
+    :param str source: Name of the source file, used as its key in the header cache.
+    :param list[str] columns: Columns to read.
+    :param dict schema_overrides: Optional types for some of the columns.
+    :param bool keep_all: If True, read every column of the file, with types inferred from every
+                          row. The given columns are then only used to check the header.
+    :param str path: JSON file of known-good headers.
+    :raises ValueError: If the header is broken and no cached header has the columns.
+    :return pl.DataFrame: The columns, in the order they appear in the file.
+    """
+    names, has_header = resolve_header(content, source, columns, path)
+    infer_schema_length = None if keep_all else 100
+    if names is None:
+        return pl.read_csv(content, columns=None if keep_all else columns,
+                           schema_overrides=schema_overrides,
+                           infer_schema_length=infer_schema_length)
+
+    print(f'Repairing the header of the {source} CSV...')
+    names = dedupe(names)
+    missing = [column for column in columns if column not in names]
+    if missing:
+        raise ValueError(f"The header used to repair the {source} CSV has no "
+                         f"{', '.join(missing)} column(s), exiting...")
+
+    indices = list(range(len(names))) if keep_all \
+        else sorted(names.index(column) for column in columns)
+    return pl.read_csv(content, has_header=False, skip_rows=1 if has_header else 0,
+                       columns=indices, new_columns=[names[i] for i in indices],
+                       schema_overrides=schema_overrides, infer_schema_length=infer_schema_length)
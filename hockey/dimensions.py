@@ -0,0 +1,80 @@
+"""
+Canonical values for the low-cardinality columns shared by every table: teams, situations and
+positions. Each has a fixed set of values, stored as a Polars Enum in DataFrames and as a DuckDB
+ENUM in the tables, so every value is kept as a small integer code rather than a string.
+
+A value outside of these sets (e.g. a new team) will fail the cast rather than be stored. Adding
+one means updating the list here, and recreating the DuckDB type with the new value (see
+scripts/convert_dimension_columns_to_enums.py).
+"""
+import duckdb
+import polars as pl
+
+
+############## Constants ################
+
+# MoneyPuck team codes, for the 32 current teams and the relocated ones still in older seasons
+TEAMS = ['ANA', 'BOS', 'BUF', 'CAR', 'CBJ', 'CGY', 'CHI', 'COL', 'DAL', 'DET', 'EDM', 'FLA',
+         'LAK', 'MIN', 'MTL', 'NJD', 'NSH', 'NYI', 'NYR', 'OTT', 'PHI', 'PIT', 'SEA', 'SJS',
+         'STL', 'TBL', 'TOR', 'UTA', 'VAN', 'VGK', 'WPG', 'WSH',
+         'ARI', 'ATL', 'PHX']
+
+# Game states, as named by MoneyPuck for the season tables and by NST for the game tables
+SITUATIONS = ['all', '5on5', '5on4', '4on5', 'other',
+              '5v5', 'pp', 'pk']
+
+# MoneyPuck skater positions. NST gives players listed at several positions as one string (e.g.
+# 'D, C'), so position is left as a string in the game tables.
+POSITIONS = ['C', 'L', 'R', 'D']
+
+# NST team codes that differ from MoneyPuck's, MoneyPuck's codes are the canonical ones
+NST_TEAM_CODES = {
+    'SJ': 'SJS',
+    'S.J': 'SJS',
+    'LA': 'LAK',
+    'L.A': 'LAK',
+    'TB': 'TBL',
+    'T.B': 'TBL',
+    'NJ': 'NJD',
+    'N.J': 'NJD'
+}
+
+TEAM = pl.Enum(TEAMS)
+SITUATION = pl.Enum(SITUATIONS)
+POSITION = pl.Enum(POSITIONS)
+
+# Name of the DuckDB ENUM type for each set of values
+DUCKDB_TYPES = {
+    'team_code': TEAMS,
+    'situation_code': SITUATIONS,
+    'position_code': POSITIONS
+}
+
+########### End Constants ###############
+
+
+def team_code(column: str | pl.Expr) -> pl.Expr:
+    """
+    Maps any NST team codes to MoneyPuck's with a single lookup, and casts the result to TEAM.
+    Safe to apply to columns that already hold MoneyPuck codes.
+
+    :param str | pl.Expr column: Column (or expression) holding team codes.
+    :return pl.Expr: The normalised team column.
+    """
+    if isinstance(column, str):
+        column = pl.col(column)
+
+    return column.replace(NST_TEAM_CODES).cast(TEAM)
+
+
+def create_types(conn: duckdb.DuckDBPyConnection) -> None:
+    """
+    Creates the DuckDB ENUM types used by the tables, if they don't exist yet.
+
+    :param duckdb.DuckDBPyConnection conn: Connection to the database.
+    """
+    for type_name, values in DUCKDB_TYPES.items():
+        conn.execute(f"""
+            CREATE TYPE IF NOT EXISTS {type_name} AS
+            ENUM ({', '.join(f"'{value}'" for value in values)})
+        """)
@@ -0,0 +1,259 @@
+"""
+Shared helpers for downloading source data over HTTP, used by the process_* modules.
+
+Every download asks for gzip and is streamed to a temporary file as it arrives, still compressed.
+A transfer that drops part way through is resumed from where it stopped with a Range request
+(guarded by If-Range, so a file that changed in the meantime is downloaded again in full), after
+a jittered exponential backoff. The body is only decompressed once it's complete.
+"""
+import os
+import time
+import zlib
+import random
+import tempfile
+from collections.abc import Iterator
+from typing import BinaryIO
+
+import urllib3
+import requests
+from requests.adapters import HTTPAdapter
+
+import metrics
+from response_cache import ResponseCache
+
+
+############## Constants ################
+
+# Base URL for all MoneyPuck downloads. Can be pointed at a local stand-in server with the
+# MONEYPUCK_URL env variable.
+MONEYPUCK_URL = os.environ.get('MONEYPUCK_URL', 'https://moneypuck.com/moneypuck/playerData')
+
+# Number of connections kept open per host by a pooled session. The daily update pulls four
+# files from the same host, so this lets all of them download at once.
+DEFAULT_POOL_SIZE = 4
+
+# Size of the blocks yielded when streaming a download, in bytes
+DEFAULT_CHUNK_SIZE = 8 * 1024 * 1024
+
+# Number of times a failed download is retried (resuming it where possible) before giving up
+DEFAULT_RETRIES = 5
+
+# Backoff before retry n is a random delay of up to min(BACKOFF_MAX, BACKOFF_BASE * 2 ** n)
+# seconds, so that several failed downloads don't all retry at the same moment
+BACKOFF_BASE = 1.0
+BACKOFF_MAX = 30.0
+
+# Responses that are worth retrying, rather than failing straight away
+RETRY_STATUSES = [429, 500, 502, 503, 504]
+
+# Errors raised by a connection that drops or stalls
+TRANSFER_ERRORS = (requests.ConnectionError, requests.Timeout, urllib3.exceptions.HTTPError)
+
+# Seconds to wait for the server to connect, and then between bytes of the response
+TIMEOUT = (10, 60)
+
+########### End Constants ###############
+
+
+class IncompleteDownload(Exception):
+    """
+    Raised when a response ends before the number of bytes it announced.
+    """
+
+    def __init__(self, url: str, received: int, expected: int) -> None:
+        super().__init__(f'{url} ended after {received} of {expected} bytes')
+
+
+class NotModified(Exception):
+    """
+    Raised when a conditional request finds the source file unchanged since it was last processed.
+    """
+
+    def __init__(self, url: str) -> None:
+        super().__init__(f'{url} has not been modified since the last run')
+        self.url = url
+
+
+def create_session(pool_size: int = DEFAULT_POOL_SIZE) -> requests.Session:
+    """
+    Creates a requests Session with a connection pool large enough that `pool_size` downloads
+    can run concurrently without waiting on each other for a connection.
+
+    The session can be shared across threads, and should be closed (or used as a context manager)
+    when no longer needed.
+
+    :param int pool_size: Number of connections to keep per host.
+    :return requests.Session: The pooled session.
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+
+    # Matches the verify=False that was used for every MoneyPuck download
+    session.verify = False
+
+    return session
+
+
+def backoff_delay(attempt: int) -> float:
+    """
+    :param int attempt: Number of the retry, starting from 0.
+    :return float: Seconds to wait before it, with full jitter.
+    """
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+
+
+def _request(url: str, session: requests.Session | None,
+             headers: dict[str, str]) -> requests.Response:
+    """
+    Sends one streamed GET request, over the session if one is given.
+    """
+    if session is None:
+        return requests.get(url, headers=headers, stream=True, verify=False, timeout=TIMEOUT)
+    return session.get(url, headers=headers, stream=True, timeout=TIMEOUT)
+
+
+def _expected_size(r: requests.Response) -> int | None:
+    """
+    :return int: Full size of the (still encoded) body, if the response gives it.
+    """
+    if r.status_code == 206:
+        total = r.headers.get('Content-Range', '').rpartition('/')[2]
+        return int(total) if total.isdigit() else None
+
+    length = r.headers.get('Content-Length')
+    return int(length) if length is not None and length.isdigit() else None
+
+
+def _download(url: str, session: requests.Session | None, cache: ResponseCache | None,
+              f: BinaryIO, retries: int = DEFAULT_RETRIES) -> str | None:
+    """
+    Downloads the body of a URL into a file, without decoding it. The first request is
+    conditional on the cached validators if a cache is given. After a failure, the download
+    resumes from the bytes already written if the server sent a validator to resume against, and
+    starts over otherwise.
+
+    :param str url: URL to download.
+    :param requests.Session session: Optional session to reuse pooled connections from.
+    :param ResponseCache cache: Optional cache of validators to make the request conditional on.
+    :param BinaryIO f: Empty file to write the body to.
+    :param int retries: Number of times a failed transfer is retried.
+    :raises NotModified: If the server reports the file unchanged.
+    :return str: The Content-Encoding of the body, if any.
+    """
+    received = 0
+    validator = None
+    encoding = None
+
+    for attempt in range(retries + 1):
+        headers = {'Accept-Encoding': 'gzip'}
+        if received and validator is not None:
+            headers.update({'Range': f'bytes={received}-', 'If-Range': validator})
+        elif cache is not None:
+            headers.update(cache.headers(url))
+
+        try:
+            with _request(url, session, headers) as r:
+                if r.status_code == 304:
+                    raise NotModified(url)
+                if r.status_code in RETRY_STATUSES:
+                    raise requests.HTTPError(f'{r.status_code} response for {url}', response=r)
+                r.raise_for_status()
+
+                # Anything but a partial response holds the whole body
+                if r.status_code != 206:
+                    f.seek(0)
+                    f.truncate()
+                    received = 0
+                    encoding = r.headers.get('Content-Encoding')
+                validator = r.headers.get('ETag', r.headers.get('Last-Modified'))
+                if cache is not None:
+                    cache.remember(url, r)
+
+                expected = _expected_size(r)
+                for chunk in r.raw.stream(DEFAULT_CHUNK_SIZE, decode_content=False):
+                    f.write(chunk)
+                    received += len(chunk)
+                    metrics.add_bytes(len(chunk))
+
+                if expected is not None and received < expected:
+                    raise IncompleteDownload(url, received, expected)
+
+                return encoding
+        except (*TRANSFER_ERRORS, requests.HTTPError, IncompleteDownload) as e:
+            status = e.response.status_code if isinstance(e, requests.HTTPError) \
+                and e.response is not None else None
+            if attempt == retries or (status is not None and status not in RETRY_STATUSES):
+                raise
+
+            delay = backoff_delay(attempt)
+            resume = f' from byte {received}' if received and validator is not None else ''
+            print(f'Download of {url} failed ({e}), retrying{resume} in {delay:.1f}s...')
+            time.sleep(delay)
+
+
+def _read_body(f: BinaryIO, encoding: str | None,
+               chunk_size: int = DEFAULT_CHUNK_SIZE) -> Iterator[bytes]:
+    """
+    Reads a downloaded body back from its file, decompressing it if needed.
+
+    :param BinaryIO f: File the body was downloaded to.
+    :param str encoding: Content-Encoding of the body.
+    :param int chunk_size: Maximum size of each yielded block, in bytes.
+    :raises ValueError: If the body is compressed with anything but gzip.
+    :return Iterator[bytes]: Blocks of the decoded body, in order.
+    """
+    f.seek(0)
+    if encoding is None or encoding == 'identity':
+        while block := f.read(chunk_size):
+            yield block
+        return
+    if encoding != 'gzip':
+        raise ValueError(f'Unsupported Content-Encoding {encoding}, exiting...')
+
+    decoder = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    while block := f.read(chunk_size):
+        # Decompress at most chunk_size bytes at a time, keeping the rest for the next block
+        while block:
+            decoded = decoder.decompress(block, chunk_size)
+            if decoded:
+                yield decoded
+            block = decoder.unconsumed_tail
+    if tail := decoder.flush():
+        yield tail
+
+
+def fetch(url: str, session: requests.Session | None = None,
+          cache: ResponseCache | None = None) -> bytes:
+    """
+    Downloads the given URL and returns the body of the response.
+
+    :param str url: URL to download.
+    :param requests.Session session: Optional session to reuse pooled connections from. If not
+                                     provided, a one-off request is made.
+    :param ResponseCache cache: Optional cache of validators to make the request conditional on.
+    :raises NotModified: If a cache was given and the file hasn't changed since it was committed.
+    :return bytes: The body of the response, decompressed.
+    """
+    with metrics.span('download'), tempfile.TemporaryFile() as f:
+        encoding = _download(url, session, cache, f)
+        return b''.join(_read_body(f, encoding))
+
+
+def stream(url: str, session: requests.Session | None = None, cache: ResponseCache | None = None,
+           chunk_size: int = DEFAULT_CHUNK_SIZE) -> Iterator[bytes]:
+    """
+    Downloads the given URL to a temporary file, then yields the body in blocks rather than
+    holding the whole response in memory.
+
+    :param str url: URL to download.
+    :param requests.Session session: Optional session to reuse pooled connections from.
+    :param ResponseCache cache: Optional cache of validators to make the request conditional on.
+    :param int chunk_size: Maximum size of each yielded block, in bytes.
+    :raises NotModified: If a cache was given and the file hasn't changed since it was committed.
+    :return Iterator[bytes]: Blocks of the response body, in order.
+    """
+    with tempfile.TemporaryFile() as f:
+        encoding = _download(url, session, cache, f)
+        yield from _read_body(f, encoding, chunk_size)
@@ -1,12 +1,7 @@
 import argparse
-import duckdb
 
-
-############## Constants ################
-
-DB_NAME = 'md:'
-
-########### End Constants ###############
+import dimensions
+import storage
 
 """
 Script meant to only be run once, to initialize the tables used to store game-by-game
@@ -19,8 +14,9 @@ if __name__ == '__main__':
                         help='Enable flag to create tables for preseason data.')
     args = parser.parse_args()
 
-    print('Connecting to database...')
-    conn = duckdb.connect(database=DB_NAME, read_only=False)
+    conn = storage.get_connection()
+
+    dimensions.create_types(conn)
 
     skater_table = 'skater_games_2'
     goalie_table = 'goalie_games_2'
@@ -34,9 +30,9 @@ if __name__ == '__main__':
                     gameID INT,
                     gameDate DATE,
                     season INT,
-                    team VARCHAR,
+                    team team_code,
                     position VARCHAR,
-                    situation VARCHAR,
+                    situation situation_code,
                     iceTime FLOAT,
                     goals INT,
                     primaryAssists INT,
@@ -54,7 +50,9 @@ if __name__ == '__main__':
                     corsiShare FLOAT,
                     penaltiesTaken INT,
                     penaltiesDrawn INT,
-                    hits INT
+                    hits INT,
+                    playerID INT,
+                    PRIMARY KEY (gameID, name, team, situation)
                  );
                  """)
 
@@ -66,15 +64,18 @@ if __name__ == '__main__':
                     gameID INT,
                     gameDate DATE,
                     season INT,
-                    team VARCHAR,
-                    situation VARCHAR,
+                    team team_code,
+                    situation situation_code,
                     iceTime FLOAT,
                     shotsAgainst INT,
                     goalsAgainst INT,
-                    xGoalsAgainst FLOAT
+                    xGoalsAgainst FLOAT,
+                    playerID INT,
+                    PRIMARY KEY (gameID, name, team, situation)
                  );
                 """)
 
     print(f'{goalie_table} table initialized!')
 
+    storage.persist()
     print('Table initialization complete!')
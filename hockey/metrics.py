@@ -0,0 +1,268 @@
+"""
+Timing spans around the stages of the loaders, so that a slow run can be traced to the download,
+parse, transform or write that caused it.
+
+Each span records its duration, the bytes downloaded while it was open, the rows that went in and
+came out, and the process' peak memory by the time it closed. Finished spans can be appended to
+a JSON lines file, one object per span, and exported as a Prometheus text file for the
+node_exporter textfile collector. Neither is written unless configured, with environment
+variables:
+    HOCKEY_METRICS_PATH: JSON lines file, only written if set
+    HOCKEY_PROMETHEUS_PATH: Prometheus text file, only written if set
+    HOCKEY_RUN_ID: ID shared by every span of a run, defaults to a random one per process
+
+Spans nest: a span opened inside another one records it as its parent, inherits its labels, and
+adds the bytes it downloads to it. Work handed to a thread pool only nests under the current span
+if it is wrapped with `propagate`.
+
+Usage:
+    with metrics.span('gather_df', table='skaters', season=season) as span:
+        ...
+        span.rows_out = len(df)
+
+Print the spans of the latest run:
+    HOCKEY_METRICS_PATH=hockey_metrics.jsonl python metrics.py
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import threading
+import functools
+import contextvars
+from datetime import datetime, timezone
+from argparse import ArgumentParser
+from collections.abc import Callable, Iterator
+from contextlib import contextmanager
+
+# Not available on Windows, where peak memory isn't recorded
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+############## Constants ################
+
+DEFAULT_METRICS_PATH = os.environ.get('HOCKEY_METRICS_PATH')
+
+DEFAULT_PROMETHEUS_PATH = os.environ.get('HOCKEY_PROMETHEUS_PATH')
+
+RUN_ID = os.environ.get('HOCKEY_RUN_ID') or uuid.uuid4().hex[:12]
+
+# Values of a span exported to Prometheus, mapped to the help text of their gauge
+PROMETHEUS_GAUGES = {
+    'duration_seconds': 'Duration of the span',
+    'bytes': 'Bytes downloaded during the span',
+    'rows_in': 'Rows that went into the span',
+    'rows_out': 'Rows that came out of the span',
+    'peak_rss_bytes': 'Peak resident memory of the process when the span finished'
+}
+
+########### End Constants ###############
+
+
+_settings = {'path': DEFAULT_METRICS_PATH, 'prometheus_path': DEFAULT_PROMETHEUS_PATH}
+_current = contextvars.ContextVar('current_span', default=None)
+_finished = {}
+_lock = threading.Lock()
+
+
+class Span:
+    """
+    One timed stage. rows_in and rows_out are set by the code being timed, bytes are added by the
+    downloads made while the span is open.
+    """
+
+    def __init__(self, name: str, labels: dict[str, str], parent: 'Span | None') -> None:
+        self.name = name
+        self.labels = labels
+        self.parent = parent
+        self.started_at = datetime.now(timezone.utc)
+        self.start = time.perf_counter()
+        self.bytes = 0
+        self.rows_in = None
+        self.rows_out = None
+
+    def record(self, status: str) -> dict:
+        """
+        :param str status: 'ok', or the name of the exception that ended the span.
+        :return dict: The finished span, as written to the JSON lines file.
+        """
+        return {
+            'run_id': RUN_ID,
+            'span': self.name,
+            'parent': self.parent.name if self.parent is not None else None,
+            'labels': self.labels,
+            'started_at': self.started_at.isoformat(),
+            'duration_seconds': round(time.perf_counter() - self.start, 4),
+            'bytes': self.bytes,
+            'rows_in': self.rows_in,
+            'rows_out': self.rows_out,
+            'peak_rss_bytes': peak_rss_bytes(),
+            'status': status
+        }
+
+
+def configure(path: str | None = None, prometheus_path: str | None = None) -> None:
+    """
+    Overrides the files set by the environment.
+
+    :param str path: JSON lines file to append finished spans to.
+    :param str prometheus_path: Prometheus text file to export finished spans to.
+    """
+    if path is not None:
+        _settings['path'] = path
+    if prometheus_path is not None:
+        _settings['prometheus_path'] = prometheus_path
+
+
+def peak_rss_bytes() -> int | None:
+    """
+    :return int: Peak resident memory of the process so far, or None where it can't be read.
+    """
+    if resource is None:
+        return None
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS, and in kilobytes everywhere else
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+@contextmanager
+def span(name: str, **labels) -> Iterator[Span]:
+    """
+    Times the block inside it, and writes the span out once the block finishes, whether or not it
+    raised.
+
+    :param str name: Name of the stage.
+    :param labels: Labels identifying the span, e.g. table and season. Added to the parent's.
+    :return Iterator[Span]: The open span, to set its rows on.
+    """
+    parent = _current.get()
+    inherited = parent.labels if parent is not None else {}
+    current = Span(name, {**inherited, **{key: str(value) for key, value in labels.items()}},
+                   parent)
+
+    token = _current.set(current)
+    status = 'ok'
+    try:
+        yield current
+    except BaseException as e:
+        status = type(e).__name__
+        raise
+    finally:
+        _current.reset(token)
+        emit(current.record(status))
+
+
+def add_bytes(count: int) -> None:
+    """
+    Adds downloaded bytes to the current span and every span it's nested in.
+
+    :param int count: Number of bytes downloaded.
+    """
+    with _lock:
+        current = _current.get()
+        while current is not None:
+            current.bytes += count
+            current = current.parent
+
+
+def propagate(fn: Callable) -> Callable:
+    """
+    Binds a function to a copy of the caller's context, so that spans it opens from a worker
+    thread nest under the caller's current span. Wrap each task separately, since one copy can't
+    be entered by two threads at once.
+
+    :param Callable fn: Function to run in another thread.
+    :return Callable: The function, running in the copied context.
+    """
+    return functools.partial(contextvars.copy_context().run, fn)
+
+
+def emit(record: dict) -> None:
+    """
+    Appends a finished span to the JSON lines file, and exports the run's spans to the Prometheus
+    text file, for whichever of them are configured.
+
+    :param dict record: The finished span.
+    """
+    with _lock:
+        if _settings['path'] is not None:
+            with open(_settings['path'], 'a') as f:
+                f.write(json.dumps(record) + '\n')
+
+        if _settings['prometheus_path'] is not None:
+            # The latest span with each name and labels is the one exported
+            _finished[(record['span'], tuple(sorted(record['labels'].items())))] = record
+            write_prometheus(_settings['prometheus_path'])
+
+
+def prometheus_labels(record: dict) -> str:
+    """
+    :param dict record: A finished span.
+    :return str: Its name and labels, in Prometheus' label syntax.
+    """
+    labels = {'span': record['span'], **record['labels']}
+    escaped = {key: value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+               for key, value in labels.items()}
+    return ','.join(f'{key}="{value}"' for key, value in escaped.items())
+
+
+def write_prometheus(path: str) -> None:
+    """
+    Writes every span finished by this process to a Prometheus text file. The file is replaced in
+    one step, so the collector never reads a partial one.
+
+    :param str path: Text file to write.
+    """
+    lines = []
+    for value, help_text in PROMETHEUS_GAUGES.items():
+        metric = f'hockey_span_{value}'
+        lines += [f'# HELP {metric} {help_text}', f'# TYPE {metric} gauge']
+        lines += [f'{metric}{{{prometheus_labels(record)}}} {record[value]}'
+                  for record in _finished.values() if record[value] is not None]
+
+    with open(f'{path}.tmp', 'w') as f:
+        f.write('\n'.join(lines) + '\n')
+    os.replace(f'{path}.tmp', path)
+
+
+def read_spans(path: str, run_id: str | None = None) -> list[dict]:
+    """
+    :param str path: JSON lines file of spans.
+    :param str run_id: Run to read. If not provided, the latest run in the file.
+    :return list[dict]: The run's spans, in the order they finished.
+    """
+    with open(path) as f:
+        records = [json.loads(line) for line in f if line.strip()]
+    if not records:
+        return []
+
+    run_id = run_id if run_id is not None else records[-1]['run_id']
+    return [record for record in records if record['run_id'] == run_id]
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument('-p', '--path', type=str, default=DEFAULT_METRICS_PATH,
+                        help='JSON lines file of spans, defaults to HOCKEY_METRICS_PATH.')
+    parser.add_argument('-r', '--run-id', type=str, default=None,
+                        help='Run to print, defaults to the latest one.')
+    args = parser.parse_args()
+
+    if args.path is None:
+        parser.error('--path is required when HOCKEY_METRICS_PATH is not set')
+
+    spans = read_spans(args.path, args.run_id)
+    if not spans:
+        raise ValueError(f'No spans found in {args.path}, exiting...')
+
+    print(f"Run {spans[0]['run_id']}:")
+    for record in sorted(spans, key=lambda r: r['started_at']):
+        labels = ' '.join(f'{key}={value}' for key, value in record['labels'].items())
+        print(f"{record['span']:<28}{record['duration_seconds']:>10.3f}s"
+              f"{record['bytes']:>14,} B  in={record['rows_in']} out={record['rows_out']}  "
+              f"{record['status']}  {labels}")
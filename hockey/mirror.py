@@ -0,0 +1,270 @@
+"""
+Local read mirror of the tables in the database, kept in a DuckDB file so that analytics jobs can
+read them from local disk rather than scanning the remote tables on every query.
+
+Each sync only pulls what the mirror is missing. The row count and sum of row hashes of every
+season are compared on both sides, and only what differs is copied again:
+    - season tables are rewritten a season at a time, so the seasons that differ are copied again
+    - game tables are then compared game by game, only within the seasons that differ, and the
+      games that differ are copied again. New games are picked up wherever they fall (e.g. an
+      older season loaded late), as are games reloaded in place (e.g. with --force), while a sync
+      with nothing new only reads one checksum per season from the source
+A table can also be copied again in full with --full.
+
+The source defaults to the configured database (see storage.py), but can be any DuckDB
+database, e.g. a local file standing in for MotherDuck:
+    python mirror.py sync
+    python mirror.py sync --source hockey-stats.db -t skaters team_games
+    python mirror.py status
+"""
+import os
+from argparse import ArgumentParser
+
+import duckdb
+
+import storage
+import rolling_tables
+import season_aggregates
+
+
+############## Constants ################
+
+# Default location of the mirror, can be overridden with the HOCKEY_MIRROR_PATH env variable
+DEFAULT_MIRROR_PATH = os.environ.get('HOCKEY_MIRROR_PATH', 'hockey_mirror.duckdb')
+
+# Name the mirror is attached under on the source connection
+MIRROR_ALIAS = 'mirror'
+
+# Tables synced by comparing each game, and the column identifying a game
+GAME_TABLES = {
+    'team_games': 'gameID',
+    'skater_games': 'gameID',
+    'goalie_games': 'gameID'
+}
+
+# Tables synced by comparing each season. The rolling table has a gameID, but loading a game
+# rewrites the rows of the games after it, so it's compared by season too.
+SEASON_TABLES = ['skaters', 'goalies', 'teams', rolling_tables.ROLLING_TABLE,
+                 *season_aggregates.TOTALS_TABLES.values()]
+
+PARTITION_KEY = 'season'
+
+########### End Constants ###############
+
+
+def connect(path: str = DEFAULT_MIRROR_PATH) -> duckdb.DuckDBPyConnection:
+    """
+    Opens the mirror for reading.
+
+    :param str path: Location of the mirror.
+    :return duckdb.DuckDBPyConnection: Read-only connection to the mirror.
+    """
+    return duckdb.connect(database=path, read_only=True)
+
+
+def table_exists(conn: duckdb.DuckDBPyConnection, table_name: str) -> bool:
+    """
+    :param duckdb.DuckDBPyConnection conn: Connection to a database.
+    :param str table_name: Table to look for.
+    :return bool: Whether the table exists in the connection's own database (not an attached one).
+    """
+    return conn.execute("""
+        SELECT count(*) FROM duckdb_tables()
+        WHERE database_name = current_database() AND table_name = ?
+    """, [table_name]).fetchone()[0] > 0
+
+
+def season_checksums(conn: duckdb.DuckDBPyConnection, table_name: str,
+                     column: str = PARTITION_KEY, scope: str | None = None) -> dict[int, tuple]:
+    """
+    :param duckdb.DuckDBPyConnection conn: Connection to the source.
+    :param str table_name: Table to checksum, qualified with its database if it's the mirror's.
+    :param str column: Column to partition the table by, defaults to the season.
+    :param str scope: SQL predicate for the rows to checksum, or None for the whole table.
+    :return dict[int, tuple]: Partition (e.g. season) -> (row count, sum of row hashes).
+    """
+    rows = conn.execute(f"""
+        SELECT {column}, count(*), sum(hash(t)) FROM {table_name} t
+        {f'WHERE {scope}' if scope is not None else ''}
+        GROUP BY {column}
+    """).fetchall()
+
+    return {row[0]: (row[1], int(row[2])) for row in rows}
+
+
+def stale_partitions(source: dict[int, tuple], local: dict[int, tuple]) -> list[int]:
+    """
+    :param dict[int, tuple] source: Checksums of the source's partitions.
+    :param dict[int, tuple] local: Checksums of the mirror's partitions.
+    :return list[int]: Partitions whose checksums differ, or that are only on one side, in order.
+    """
+    return sorted(partition for partition in source.keys() | local.keys()
+                  if source.get(partition) != local.get(partition))
+
+
+def sync_game_table(conn: duckdb.DuckDBPyConnection, table_name: str) -> int:
+    """
+    Copies the games of a game table whose row count or hash differ from the mirror's, and drops
+    the games no longer in the source. Seasons are compared first, and games only within the
+    seasons that differ, so the source isn't checksummed game by game on every sync.
+
+    :param duckdb.DuckDBPyConnection conn: Connection to the source, with the mirror attached.
+    :param str table_name: Game table to sync.
+    :return int: Number of rows copied.
+    """
+    column = GAME_TABLES[table_name]
+    mirrored = f'{MIRROR_ALIAS}.main.{table_name}'
+    seasons = stale_partitions(season_checksums(conn, table_name),
+                               season_checksums(conn, mirrored))
+    if not seasons:
+        return 0
+
+    scope = f"{PARTITION_KEY} IN ({', '.join(str(season) for season in seasons)})"
+    stale = stale_partitions(season_checksums(conn, table_name, column, scope),
+                             season_checksums(conn, mirrored, column, scope))
+
+    print(f"{table_name}: {len(stale)} game(s) out of date in season(s) "
+          f"{', '.join(str(season) for season in seasons)}")
+    conn.execute(f'DELETE FROM {mirrored} WHERE {column} IN (SELECT unnest(?::BIGINT[]))',
+                 [stale])
+
+    return conn.execute(f"""
+        INSERT INTO {mirrored} SELECT * FROM {table_name}
+        WHERE {column} IN (SELECT unnest(?::BIGINT[]))
+    """, [stale]).fetchone()[0]
+
+
+def sync_season_table(conn: duckdb.DuckDBPyConnection, table_name: str) -> int:
+    """
+    Copies the seasons of a season table whose row count or hash differ from the mirror's, and
+    drops the seasons no longer in the source.
+
+    :param duckdb.DuckDBPyConnection conn: Connection to the source, with the mirror attached.
+    :param str table_name: Season table to sync.
+    :return int: Number of rows copied.
+    """
+    mirrored = f'{MIRROR_ALIAS}.main.{table_name}'
+    stale = stale_partitions(season_checksums(conn, table_name),
+                             season_checksums(conn, mirrored))
+    if not stale:
+        return 0
+
+    print(f"{table_name} seasons out of date: {', '.join(str(season) for season in stale)}")
+    seasons = ', '.join(str(season) for season in stale)
+    conn.execute(f'DELETE FROM {mirrored} WHERE {PARTITION_KEY} IN ({seasons})')
+
+    return conn.execute(f"""
+        INSERT INTO {mirrored} SELECT * FROM {table_name} WHERE {PARTITION_KEY} IN ({seasons})
+    """).fetchone()[0]
+
+
+def sync_table(conn: duckdb.DuckDBPyConnection, table_name: str, full: bool = False) -> int:
+    """
+    Brings one table of the mirror up to date with the source. The table is created in the
+    mirror with the source's column types on the first sync, and each sync is applied in one
+    transaction, so readers of the mirror never see half of one.
+
+    :param duckdb.DuckDBPyConnection conn: Connection to the source, with the mirror attached.
+    :param str table_name: Table to sync, one of GAME_TABLES or SEASON_TABLES.
+    :param bool full: If True, copy the whole table again.
+    :return int: Number of rows copied.
+    """
+    mirrored = f'{MIRROR_ALIAS}.main.{table_name}'
+
+    conn.execute('BEGIN TRANSACTION')
+    try:
+        if full:
+            conn.execute(f'DROP TABLE IF EXISTS {mirrored}')
+        conn.execute(f'CREATE TABLE IF NOT EXISTS {mirrored} AS '
+                     f'SELECT * FROM {table_name} LIMIT 0')
+
+        if table_name in GAME_TABLES:
+            rows = sync_game_table(conn, table_name)
+        else:
+            rows = sync_season_table(conn, table_name)
+
+        conn.execute('COMMIT')
+    except Exception:
+        conn.execute('ROLLBACK')
+        raise
+
+    return rows
+
+
+def main(tables: list[str] | None = None, source: str | None = None,
+         path: str = DEFAULT_MIRROR_PATH, full: bool = False) -> None:
+    """
+    Syncs the mirror with the source.
+
+    :param list[str] tables: Tables to sync, defaults to every table in the source.
+    :param str source: Database to mirror, defaults to the one configured in storage.py.
+    :param str path: Location of the mirror.
+    :param bool full: If True, copy every table again rather than only what changed.
+    """
+    tables = tables if tables else [*GAME_TABLES, *SEASON_TABLES]
+    unknown = [table_name for table_name in tables
+               if table_name not in GAME_TABLES and table_name not in SEASON_TABLES]
+    if unknown:
+        raise ValueError(f"Unknown table(s) {', '.join(unknown)}, exiting...")
+
+    conn = duckdb.connect(database=source, read_only=True) if source is not None \
+        else storage.get_connection()
+    conn.execute(f"ATTACH '{path}' AS {MIRROR_ALIAS} (READ_WRITE)")
+
+    for table_name in tables:
+        if not table_exists(conn, table_name):
+            print(f'{table_name} not found in source, skipping...')
+            continue
+
+        print(f'Syncing {table_name}...')
+        rows = sync_table(conn, table_name, full)
+        print(f'{rows} rows copied to {table_name}')
+
+    conn.execute(f'DETACH {MIRROR_ALIAS}')
+    print('Mirror sync complete!')
+
+
+def status(path: str = DEFAULT_MIRROR_PATH) -> None:
+    """
+    Prints the number of games in every game table and the seasons of every season table in the
+    mirror.
+
+    :param str path: Location of the mirror.
+    """
+    if not os.path.exists(path):
+        print(f'No mirror at {path}')
+        return
+
+    conn = connect(path)
+    for table_name, column in GAME_TABLES.items():
+        if table_exists(conn, table_name):
+            rows, games, latest = conn.execute(
+                f'SELECT count(*), count(DISTINCT {column}), max({column}) FROM {table_name}'
+            ).fetchone()
+            print(f'{table_name}: {rows} rows, {games} games, latest {column} {latest}')
+    for table_name in SEASON_TABLES:
+        if table_exists(conn, table_name):
+            seasons = sorted(season_checksums(conn, table_name))
+            rows = conn.execute(f'SELECT count(*) FROM {table_name}').fetchone()[0]
+            print(f"{table_name}: {rows} rows, seasons {', '.join(str(s) for s in seasons)}")
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument('command', choices=['sync', 'status'],
+                        help='Action to take on the mirror.')
+    parser.add_argument('-t', '--tables', type=str, nargs='*', default=None,
+                        help='Tables to sync, defaults to all of them.')
+    parser.add_argument('--source', type=str, default=None,
+                        help='Database to mirror, e.g. a local DuckDB file instead of MotherDuck. '
+                             'Defaults to the database configured in storage.py.')
+    parser.add_argument('--path', type=str, default=DEFAULT_MIRROR_PATH,
+                        help='Location of the mirror.')
+    parser.add_argument('--full', action='store_true', default=False,
+                        help='Copy the tables again in full rather than only what changed.')
+    args = parser.parse_args()
+
+    if args.command == 'sync':
+        main(args.tables, args.source, args.path, args.full)
+    else:
+        status(args.path)
@@ -0,0 +1,219 @@
+"""
+Player identity index, used to give the NST game rows (which only have a player's name) the
+MoneyPuck playerID used by the skaters and goalies tables.
+
+The index maps a normalised form of each player's name to their playerID, for every season and
+team they played for, and is built from the MoneyPuck season summaries. It is kept locally as a
+Parquet file and updated incrementally: a season is only downloaded if it's missing from the
+index, or if it's the current season and MoneyPuck has published a new version of it.
+
+Usage:
+    python player_index.py -s 2023 2024
+"""
+import os
+from datetime import datetime
+from argparse import ArgumentParser
+
+import polars as pl
+import requests
+
+import download
+import csv_reader
+import process_skater_data
+import process_goalie_data
+from response_cache import ResponseCache, DEFAULT_CACHE_DIR
+
+
+############## Constants ################
+
+# Default location of the index, can be overridden with the HOCKEY_PLAYER_INDEX env variable
+DEFAULT_INDEX_PATH = os.environ.get('HOCKEY_PLAYER_INDEX',
+                                    os.path.join(DEFAULT_CACHE_DIR, 'player_index.parquet'))
+
+# Source of the players in the index, and whether they are goalies
+SOURCES = {
+    process_skater_data.DATA_URL: False,
+    process_goalie_data.DATA_URL: True
+}
+
+INDEX_SCHEMA = {
+    'nameKey': pl.String,
+    'playerID': pl.Int32,
+    'season': pl.Int32,
+    'team': pl.String,
+    'isGoalie': pl.Boolean
+}
+
+# Columns a name is matched to the index on, from most to least specific
+MATCH_LEVELS = [
+    ['nameKey', 'season', 'team'],
+    ['nameKey', 'season'],
+    ['nameKey']
+]
+
+########### End Constants ###############
+
+
+def current_season() -> int:
+    """
+    :return int: The season currently being played, i.e. the year it started in.
+    """
+    return datetime.now().year - 1 if datetime.now().month < 10 else datetime.now().year
+
+
+def name_key(column: str | pl.Expr) -> pl.Expr:
+    """
+    Normalises player names so that the variants used by different sources compare equal, e.g.
+    'J.T.\\xa0Miller' and 'JT Miller', or 'Tim Stützle' and 'Tim Stutzle'. Accents, periods and
+    apostrophes are dropped, hyphens and runs of whitespace become single spaces, and the result
+    is lower-cased.
+
+    :param str | pl.Expr column: Column (or expression) holding player names.
+    :return pl.Expr: The normalised names.
+    """
+    if isinstance(column, str):
+        column = pl.col(column)
+
+    return column.str.normalize('NFKD')\
+        .str.replace_all(r'\p{M}', '')\
+        .str.replace_all(r"[.'’]", '')\
+        .str.replace_all(r'[\s\-]+', ' ')\
+        .str.strip_chars()\
+        .str.to_lowercase()
+
+
+def fetch_season(season: int, cache: ResponseCache | None = None) -> pl.DataFrame:
+    """
+    Downloads the players of a season from MoneyPuck, as rows of the index.
+
+    :param int season: Season to download.
+    :param ResponseCache cache: Optional response cache to make the downloads conditional on.
+    :raises download.NotModified: If a cache was given and every source file is unchanged.
+    :return pl.DataFrame: Rows of the index for the season.
+    """
+    dfs = []
+    unchanged = 0
+    for url, is_goalie in SOURCES.items():
+        try:
+            content = download.fetch(url.format(season), cache=cache)
+        except download.NotModified:
+            unchanged += 1
+            continue
+
+        df = csv_reader.read_csv(content, 'goalies' if is_goalie else 'skaters',
+                                 ['playerId', 'season', 'name', 'team'])
+        dfs.append(df.select(
+            name_key('name').alias('nameKey'),
+            pl.col('playerId').cast(pl.Int32).alias('playerID'),
+            pl.col('season').cast(pl.Int32),
+            pl.col('team').cast(pl.String),
+            pl.lit(is_goalie).alias('isGoalie')
+        ).unique())
+
+    if unchanged == len(SOURCES):
+        raise download.NotModified(process_skater_data.DATA_URL.format(season))
+
+    return pl.concat(dfs)
+
+
+def update_index(seasons: list[int], path: str = DEFAULT_INDEX_PATH) -> pl.DataFrame:
+    """
+    Makes sure the index covers the given seasons, downloading only the ones it's missing. The
+    current season is also re-downloaded if MoneyPuck has published a new version of it, since
+    new players appear in it through the season. A season that fails to download or read is left
+    as it was.
+
+    :param list[int] seasons: Seasons the index needs to cover.
+    :param str path: Location of the index.
+    :return pl.DataFrame: The up-to-date index.
+    """
+    index = pl.read_parquet(path) if os.path.exists(path) else pl.DataFrame(schema=INDEX_SCHEMA)
+    indexed = set(index['season'].unique().to_list())
+    # Kept apart from the cache used by the table updates, since the validators stored for a
+    # file must be for the version the index was built from
+    cache = ResponseCache(os.path.join(os.path.dirname(path) or '.', 'player_index_cache'))
+
+    updated = {}
+    for season in sorted(set(seasons)):
+        if season in indexed and season != current_season():
+            continue
+
+        print(f'Updating player index for {season}...')
+        try:
+            # Past seasons don't change, so those are only downloaded when missing
+            updated[season] = fetch_season(season, cache if season in indexed else None)
+        except download.NotModified:
+            print(f'Players for {season} are unchanged, skipping...')
+        except (requests.RequestException, download.IncompleteDownload, ValueError) as e:
+            # Not being able to update the index (a failed or cut off download, or a file whose
+            # header can't be read) shouldn't stop a load. The season is left as it was in the
+            # cached index, and the rows it can't match are just left without a playerID
+            print(f'Failed to update player index for {season}: {e}')
+
+    if updated:
+        # Replace the players of each source that was downloaded again
+        new = pl.concat(updated.values())
+        index = pl.concat([index.join(new.select('season', 'isGoalie').unique(),
+                                      on=['season', 'isGoalie'], how='anti'),
+                           new]).sort('season', 'nameKey')
+
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        index.write_parquet(f'{path}.tmp')
+        os.replace(f'{path}.tmp', path)
+
+        for season in updated:
+            for url in SOURCES:
+                cache.commit(url.format(season))
+
+    return index
+
+
+def assign_player_ids(df: pl.DataFrame, index: pl.DataFrame,
+                      goalies: bool = False) -> pl.DataFrame:
+    """
+    Adds a playerID column to the end of a DataFrame of game rows, by matching each row's name to
+    the index. Where several players share a name, the match is narrowed down to the players on
+    the row's team in the row's season, then to players in the row's season. A row whose name is
+    unknown, or still matches more than one player, is given a null playerID.
+
+    :param pl.DataFrame df: Game rows, with name, season and team columns.
+    :param pl.DataFrame index: The player index.
+    :param bool goalies: Whether the rows are for goalies or skaters.
+    :return pl.DataFrame: The rows, with their playerID as the last column.
+    """
+    index = index.filter(pl.col('isGoalie') == goalies)
+    keys = df.select(name_key('name').alias('nameKey'),
+                     pl.col('season').cast(pl.Int32),
+                     pl.col('team').cast(pl.String))
+
+    for i, level in enumerate(MATCH_LEVELS):
+        # Only keep the names that identify exactly one player at this level
+        lookup = index.group_by(level).agg(pl.col('playerID').unique())\
+            .filter(pl.col('playerID').list.len() == 1)\
+            .select(*level, pl.col('playerID').list.first().alias(f'playerID{i}'))
+        keys = keys.join(lookup, on=level, how='left', maintain_order='left')
+
+    player_ids = keys.select(
+        pl.coalesce(f'playerID{i}' for i in range(len(MATCH_LEVELS))).alias('playerID')
+    ).to_series()
+
+    unmatched = df.filter(player_ids.is_null())['name'].unique().to_list()
+    if unmatched:
+        more = ', ...' if len(unmatched) > 10 else ''
+        print(f"No playerID found for {len(unmatched)} player(s): "
+              f"{', '.join(sorted(unmatched)[:10])}{more}")
+
+    return df.with_columns(player_ids)
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument('-s', '--season', type=int, nargs='+', default=[current_season()],
+                        help='Season(s) the index should cover.')
+    parser.add_argument('--path', type=str, default=DEFAULT_INDEX_PATH,
+                        help='Location of the index.')
+    args = parser.parse_args()
+
+    index = update_index(args.season, args.path)
+    print(f"Player index has {index['playerID'].n_unique()} players over "
+          f"{index['season'].n_unique()} seasons")
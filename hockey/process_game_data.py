@@ -1,13 +1,20 @@
-from datetime import datetime
 import polars as pl
 import requests
 
+import dimensions
+import download
+import csv_reader
+import metrics
+import raw_lake
+import transforms
+from response_cache import ResponseCache
+
 
 
 ############## Constants ################
 
 # URL used to download CSV data from MoneyPuck
-DATA_URL = 'https://moneypuck.com/moneypuck/playerData/careers/gameByGame/all_teams.csv'
+DATA_URL = download.MONEYPUCK_URL + '/careers/gameByGame/all_teams.csv'
 
 # Columns that will be used from base CSV
 USED_COLUMNS = ['gameId', 'season', 'team', 'gameDate', 'home_or_away', 'situation', 'iceTime',
@@ -16,10 +23,145 @@ USED_COLUMNS = ['gameId', 'season', 'team', 'gameDate', 'home_or_away', 'situati
                 'corsiPercentage', 'goalsFor', 'goalsAgainst', 
                 'playoffGame']
 
+# Types for the used columns, so that every block of a streamed download parses to the same schema
+SCHEMA_OVERRIDES = {
+    'gameId': pl.Int64,
+    'season': pl.Int64,
+    'team': pl.String,
+    'gameDate': pl.Int64,
+    'home_or_away': pl.String,
+    'situation': pl.String,
+    'iceTime': pl.Float64,
+    'xGoalsFor': pl.Float64,
+    'xGoalsAgainst': pl.Float64,
+    'xGoalsPercentage': pl.Float64,
+    'penalityMinutesFor': pl.Float64,
+    'penalityMinutesAgainst': pl.Float64,
+    'corsiPercentage': pl.Float64,
+    'goalsFor': pl.Float64,
+    'goalsAgainst': pl.Float64,
+    'playoffGame': pl.Int64
+}
+
+# Transform from the raw CSV to the rows of the team_games table. The filter on the season being
+# processed is added when the plan is built.
+SPEC = transforms.TableSpec(
+    source_columns=USED_COLUMNS,
+    # Exclude playoff games
+    filters=[pl.col('playoffGame') == 0],
+    # Rename a few columns to better align with the rest of the tables in the DB
+    renames={
+        'gameId': 'gameID',
+        'xGoalsPercentage': 'xGoalsShare',
+        'corsiPercentage': 'corsiShare',
+        'penalityMinutesFor': 'penaltyMinutesFor',
+        'penalityMinutesAgainst': 'penaltyMinutesAgainst'
+    },
+    # Convert iceTime from seconds into minutes
+    seconds_to_minutes=['iceTime'],
+    conversions={
+        # Convert gameDate from a YYYYMMDD format to a YYYY-MM-DD format
+        'gameDate': pl.col('gameDate').cast(pl.String).str.to_date('%Y%m%d')
+                    .dt.to_string('%Y-%m-%d'),
+        # Also convert 'home_or_away' into a boolean column
+        'isHomeTeam': pl.col('home_or_away') == 'HOME',
+        # Store the low-cardinality columns as enums
+        'team': dimensions.team_code('team'),
+        'situation': pl.col('situation').cast(dimensions.SITUATION)
+    },
+    # Have columns in correct order
+    columns=['team', 'season', 'gameID', 'gameDate', 'isHomeTeam', 'iceTime', 'situation',
+             'xGoalsFor', 'xGoalsAgainst', 'xGoalsShare', 'corsiShare', 'goalsFor',
+             'goalsAgainst', 'penaltyMinutesFor', 'penaltyMinutesAgainst']
+)
+
 ########### End Constants ###############
 
 
-def gather_df(season: int) -> pl.DataFrame:
+def parse_block(data: bytes, season: int | list[int]) -> pl.DataFrame:
+    """
+    Parses one block of the all_teams CSV (including the header row) and keeps only the
+    regular season rows for the given season(s).
+
+    :param bytes data: CSV content, starting with the header row.
+    :param int | list[int] season: The season(s) we'll be working with.
+    :return pl.DataFrame: The matching rows, with the used columns only.
+    """
+    df = pl.read_csv(data, columns=USED_COLUMNS, schema_overrides=SCHEMA_OVERRIDES)
+    seasons = season if isinstance(season, list) else [season]
+
+    return df.filter(pl.all_horizontal([*SPEC.filters, pl.col('season').is_in(seasons)]))
+
+
+def stream_season_rows(season: int | list[int], session: requests.Session | None = None,
+                       cache: ResponseCache | None = None) -> pl.DataFrame:
+    """
+    Streams the all_teams CSV and parses it one block at a time, dropping rows from other seasons
+    and playoff games as it goes. Peak memory then grows with the size of one season rather than
+    with the whole multi-season file.
+
+    Blocks are always cut on a line boundary, with the header row prepended to each one. If the
+    file's header row is missing or shifted, a repaired one is prepended instead (see
+    csv_reader.py).
+
+    :param int | list[int] season: The season(s) we'll be working with.
+    :param requests.Session session: Optional pooled session to download with.
+    :param ResponseCache cache: Optional cache of validators to make the download conditional on.
+    :return pl.DataFrame: Regular season rows for the season(s), with the used columns only.
+    """
+    header = None
+    remainder = b''
+    frames = []
+
+    for chunk in download.stream(DATA_URL, session, cache):
+        remainder += chunk
+
+        if header is None:
+            # The header row is checked against the first data row, so wait for both
+            if remainder.count(b'\n') < 2:
+                continue
+            header, remainder = csv_reader.split_header(remainder, 'all_teams', USED_COLUMNS)
+
+        # Parse up to the last complete line, and carry the partial line over to the next block
+        cut = remainder.rfind(b'\n')
+        if cut == -1:
+            continue
+        block, remainder = remainder[:cut + 1], remainder[cut + 1:]
+        frames.append(parse_block(header + block, season))
+
+    if header is not None and remainder.strip():
+        frames.append(parse_block(header + remainder, season))
+
+    if not frames:
+        return pl.DataFrame(schema=SCHEMA_OVERRIDES)
+
+    return pl.concat(frames)
+
+
+def fetch_rows(session: requests.Session | None = None, cache: ResponseCache | None = None,
+               lake_dir: str | None = None) -> pl.DataFrame:
+    """
+    Downloads and parses the whole all_teams CSV, storing it in the raw-data lake if one is given.
+
+    :param requests.Session session: Optional pooled session to download with.
+    :param ResponseCache cache: Optional cache of validators to make the download conditional on.
+    :param str lake_dir: Optional raw-data lake to store every season of the file in.
+    :return pl.DataFrame: Every row of the file, with the used columns only.
+    """
+    content = download.fetch(DATA_URL, session, cache)
+    with metrics.span('parse'):
+        df = csv_reader.read_csv(content, 'all_teams', USED_COLUMNS)
+
+    if lake_dir is not None:
+        with metrics.span('lake'):
+            raw_lake.store_source(lake_dir, 'all_teams', content, USED_COLUMNS)
+
+    return df
+
+
+def gather_df(season: int, session: requests.Session | None = None,
+              cache: ResponseCache | None = None, streaming: bool = True,
+              lake_dir: str | None = None) -> pl.DataFrame:
     """
     Script used to update tables containing game-by-game data for each team.
 
@@ -29,49 +171,60 @@ def gather_df(season: int) -> pl.DataFrame:
         - xG% rolling average plot
 
     :param int season: The season we'll be working with.
+    :param requests.Session session: Optional pooled session to download with, so that several
+                                     downloads can share connections.
+    :param ResponseCache cache: Optional cache of validators, to skip files that haven't changed
+                                since the last run.
+    :param bool streaming: If True, parse the download in blocks and drop unneeded rows as they
+                           arrive. Otherwise, download and parse the whole file before filtering.
+    :param str lake_dir: Optional raw-data lake to store every season of the file in (see
+                         raw_lake.py). The whole file is needed for that, so it isn't streamed.
+    :raises download.NotModified: If a cache was given and the source file is unchanged.
     :return pl.DataFrame: Cleaned and proccessed DataFrame that will be used to update the DB.
     """
 
-    #df = pl.read_csv(DATA_URL, columns=USED_COLUMNS)
-    r = requests.get(DATA_URL, verify=False)
-    df = pl.read_csv(r.content, columns=USED_COLUMNS)
+    with metrics.span('gather_df', table='team_games', season=season) as span:
+        if streaming and lake_dir is None:
+            # Downloading and parsing are interleaved, so they're timed together
+            with metrics.span('stream'):
+                df = stream_season_rows(season, session, cache)
+        else:
+            df = fetch_rows(session, cache, lake_dir)
+        span.rows_in = len(df)
 
-    # Filter to just this season and exclude playoff games
-    df = df.filter((pl.col('season') == season) & (pl.col('playoffGame') == 0))
-
-    # Don't need to keep this column after the filter call
-    df = df.drop(['playoffGame'])
-
-    df = df.with_columns(
-        # Convert gameDate from a YYYYMMDD format to a YYYY-MM-DD format using datetime
-        pl.col('gameDate').map_elements(
-            lambda date: datetime.strftime(datetime.strptime(str(date), '%Y%m%d'), '%Y-%m-%d'),
-            return_dtype=pl.String
-        ),
-        # Also convert 'home_or_away' into a boolean column
-        pl.col('home_or_away').map_elements(
-            lambda a: bool(a == 'HOME'),
-            return_dtype=pl.Boolean
-        ).alias('isHomeTeam'),
-        # And convert iceTime from seconds into minutes
-        pl.col('iceTime') / 60.0
-    )
+        with metrics.span('transform'):
+            df = transforms.transform(SPEC, df, predicates=[pl.col('season') == season])
+        span.rows_out = len(df)
 
-    # Rename a few columns to better align with the rest of the tables in the DB
-    df = df.rename({
-        'gameId': 'gameID',
-        'xGoalsPercentage': 'xGoalsShare',
-        'corsiPercentage': 'corsiShare',
-        'penalityMinutesFor': 'penaltyMinutesFor',
-        'penalityMinutesAgainst': 'penaltyMinutesAgainst'
-    })
+    return df
 
-    # Have columns in correct order
-    df = df[['team', 'season', 'gameID', 'gameDate', 'isHomeTeam', 'iceTime', 'situation',
-             'xGoalsFor', 'xGoalsAgainst', 'xGoalsShare', 'corsiShare', 'goalsFor',
-             'goalsAgainst', 'penaltyMinutesFor', 'penaltyMinutesAgainst']]
 
-    return df
+def gather_seasons(seasons: list[int], session: requests.Session | None = None,
+                   lake_dir: str | None = None) -> dict[int, pl.DataFrame]:
+    """
+    Builds the rows for several seasons from one download of the all_teams CSV. The file holds
+    every season, so a backfill uses this rather than downloading it again for each season.
+
+    :param list[int] seasons: The seasons we'll be working with.
+    :param requests.Session session: Optional pooled session to download with.
+    :param str lake_dir: Optional raw-data lake to store every season of the downloaded file in.
+    :return dict[int, pl.DataFrame]: Cleaned and processed DataFrame for each season that has
+                                     rows in the file.
+    """
+    with metrics.span('gather_seasons', table='team_games') as span:
+        if lake_dir is None:
+            with metrics.span('stream'):
+                df = stream_season_rows(seasons, session)
+        else:
+            df = fetch_rows(session, lake_dir=lake_dir)
+        span.rows_in = len(df)
+
+        with metrics.span('transform'):
+            df = transforms.transform(SPEC, df, predicates=[pl.col('season').is_in(seasons)])
+        span.rows_out = len(df)
+
+    return {season: df.filter(pl.col('season') == season)
+            for season in df['season'].unique().sort()}
 
 
 if __name__ == '__main__':
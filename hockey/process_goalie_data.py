@@ -1,14 +1,19 @@
 import polars as pl
-from urllib.error import HTTPError
 import requests
 
-from process_team_data import get_data_with_retries
+import dimensions
+import download
+import csv_reader
+import metrics
+import raw_lake
+import transforms
+from response_cache import ResponseCache
 
 
 ############## Constants ################
 
 # URL used to download CSV data from MoneyPuck
-DATA_URL = 'https://moneypuck.com/moneypuck/playerData/seasonSummary/{}/regular/goalies.csv'
+DATA_URL = download.MONEYPUCK_URL + '/seasonSummary/{}/regular/goalies.csv'
 
 # Columns that will be used from base CSV
 USED_COLUMNS = ['playerId', 'season', 'name', 'team', 'situation', 'games_played', 'icetime',
@@ -17,10 +22,35 @@ USED_COLUMNS = ['playerId', 'season', 'name', 'team', 'situation', 'games_played
                 'mediumDangerGoals', 'mediumDangerxGoals', 'mediumDangerShots',
                 'highDangerGoals', 'highDangerxGoals', 'highDangerShots']
 
+# Transform from the raw CSV to the rows of the goalies table
+SPEC = transforms.TableSpec(
+    source_columns=USED_COLUMNS,
+    # Rename a few columns to match DB schema
+    renames={
+        'playerId': 'playerID',
+        'games_played': 'gamesPlayed',
+        'icetime': 'iceTime'
+    },
+    # Icetime is in seconds by default, convert to minutes
+    seconds_to_minutes=['iceTime'],
+    # Store the low-cardinality columns as enums
+    conversions={
+        'team': dimensions.team_code('team'),
+        'situation': pl.col('situation').cast(dimensions.SITUATION)
+    },
+    # Order of columns in the goalies table, which follows the source CSV rather than
+    # USED_COLUMNS
+    columns=['playerID', 'season', 'name', 'team', 'situation', 'gamesPlayed', 'iceTime', 'xGoals',
+             'goals', 'lowDangerShots', 'mediumDangerShots', 'highDangerShots', 'lowDangerxGoals',
+             'mediumDangerxGoals', 'highDangerxGoals', 'lowDangerGoals', 'mediumDangerGoals',
+             'highDangerGoals']
+)
+
 ########### End Constants ###############
 
 
-def gather_df(season: int) -> pl.DataFrame:
+def gather_df(season: int, session: requests.Session | None = None,
+              cache: ResponseCache | None = None, lake_dir: str | None = None) -> pl.DataFrame:
     """
     Script used to update tables containing goalie season-level data.
 
@@ -30,27 +60,28 @@ def gather_df(season: int) -> pl.DataFrame:
     Designed to be called by a larger DB update script (e.g. update_tables.py in this directory).
 
     :param int season: The season for which to gather data.
+    :param requests.Session session: Optional pooled session to download with, so that several
+                                     downloads can share connections.
+    :param ResponseCache cache: Optional cache of validators, to skip files that haven't changed
+                                since the last run.
+    :param str lake_dir: Optional raw-data lake to store the downloaded file in (see raw_lake.py).
+    :raises download.NotModified: If a cache was given and the source file is unchanged.
     :return pl.DataFrame: Cleaned and processed DataFrame that will be used to update the DB.
     """
+    with metrics.span('gather_df', table='goalies', season=season) as span:
+        content = download.fetch(DATA_URL.format(season), session, cache)
 
-    #try:
-    #    df = pl.read_csv(DATA_URL.format(season), columns=USED_COLUMNS)
-    #except HTTPError as e:
-    #    print(e)
-    #    df = get_data_with_retries(data_url=DATA_URL, season=season, columns=USED_COLUMNS)
+        with metrics.span('parse'):
+            df = csv_reader.read_csv(content, 'goalies', USED_COLUMNS)
+        span.rows_in = len(df)
 
-    r = requests.get(DATA_URL.format(season), verify=False)
-    df = pl.read_csv(r.content, columns=USED_COLUMNS)
+        if lake_dir is not None:
+            with metrics.span('lake'):
+                raw_lake.store_source(lake_dir, 'goalies', content, USED_COLUMNS, season)
 
-    # Icetime is in seconds by default, convert to minutes
-    df = df.with_columns(pl.col('icetime') / 60.0)
-
-    # Rename a few columns to match DB schema
-    df = df.rename({
-        'playerId': 'playerID',
-        'games_played': 'gamesPlayed',
-        'icetime': 'iceTime'
-    })
+        with metrics.span('transform'):
+            df = transforms.transform(SPEC, df)
+        span.rows_out = len(df)
 
     return df
 
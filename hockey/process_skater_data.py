@@ -1,14 +1,19 @@
 import polars as pl
-from urllib.error import HTTPError
 import requests
 
-from process_team_data import get_data_with_retries
+import dimensions
+import download
+import csv_reader
+import metrics
+import raw_lake
+import transforms
+from response_cache import ResponseCache
 
 
 ############## Constants ################
 
 # URL used to download CSV data from MoneyPuck
-DATA_URL = 'https://moneypuck.com/moneypuck/playerData/seasonSummary/{}/regular/skaters.csv'
+DATA_URL = download.MONEYPUCK_URL + '/seasonSummary/{}/regular/skaters.csv'
 
 # Columns that will be used from base CSV
 USED_COLUMNS = ['playerId', 'season', 'name', 'team', 'position', 'situation', 'games_played',
@@ -20,39 +25,11 @@ USED_COLUMNS = ['playerId', 'season', 'name', 'team', 'position', 'situation', '
                 'faceoffsWon', 'faceoffsLost', 'shotsBlockedByPlayer',
                 'penalties', 'penaltiesDrawn']
 
-########### End Constants ###############
-
-
-def gather_df(season: int) -> pl.DataFrame:
-    """
-    Script used to update tables containing skater-level data. 
-    
-    Pulls full data from MoneyPuck for a given season, saving only columns relevant to our plots,
-    and stores in a polars DF. Then computes a few additional columns before returning the
-    DataFrame. 
-
-    Designed to be called by a larger DB update script (e.g. update_tables.py in this directory).
-
-    As of August 25, 2025, the plots which use this table are:
-        - Skater ratio scatter plots (i.e. xGF vs xGA)
-        - Skater points-per-hour plot
-
-    :param int season: The season we'll be working with.
-    :return pl.DataFrame: Cleaned and proccessed DataFrame that will be used to update the DB.
-    """
-
-    #try:
-    #    df = pl.read_csv(DATA_URL.format(season), columns=USED_COLUMNS)
-    #except HTTPError as e:
-    #    print(e)
-    #    df = get_data_with_retries(data_url=DATA_URL, season=season, columns=USED_COLUMNS)
-
-    r = requests.get(DATA_URL.format(season), verify=False)
-    df = pl.read_csv(r.content, columns=USED_COLUMNS)
-
-
+# Transform from the raw CSV to the rows of the skaters table
+SPEC = transforms.TableSpec(
+    source_columns=USED_COLUMNS,
     # Rename some columns to be nicer to work with
-    df = df.rename({
+    renames={
         'OnIce_F_goals': 'goalsFor',
         'OnIce_A_goals': 'goalsAgainst',
         'OnIce_F_flurryScoreVenueAdjustedxGoals': 'xGoalsFor',
@@ -69,29 +46,79 @@ def gather_df(season: int) -> pl.DataFrame:
         'playerId': 'playerID',
         'games_played': 'gamesPlayed',
         'icetime': 'iceTime'
-    })
-
+    },
     # Icetime is in seconds by default, convert to minutes
-    df = df.with_columns(pl.col('iceTime') / 60.0)
-
-    # Compute rate metrics from each column containing a total metric value,
+    seconds_to_minutes=['iceTime'],
+    # Store the low-cardinality columns as enums
+    conversions={
+        'team': dimensions.team_code('team'),
+        'position': pl.col('position').cast(dimensions.POSITION),
+        'situation': pl.col('situation').cast(dimensions.SITUATION)
+    },
+    # Rate metrics from each column containing a total metric value,
     # i.e. goalsFor -> goalsForPerHour (GFph)
-    for total_col, rate_col in zip(['goalsFor', 'goalsAgainst', 'xGoalsFor',
-                                    'xGoalsAgainst', 'points', 'goals'],
-                                    ['goalsForPerHour', 'goalsAgainstPerHour', 'xGoalsForPerHour',
-                                        'xGoalsAgainstPerHour', 'pointsPerHour', 'goalsPerHour']):
-        df = df.with_columns((pl.col(total_col) * (60.0 / pl.col('iceTime'))).alias(rate_col))
-
+    per_hour={
+        'goalsForPerHour': 'goalsFor',
+        'goalsAgainstPerHour': 'goalsAgainst',
+        'xGoalsForPerHour': 'xGoalsFor',
+        'xGoalsAgainstPerHour': 'xGoalsAgainst',
+        'pointsPerHour': 'points',
+        'goalsPerHour': 'goals'
+    },
     # Also compute a players average icetime per game
-    df = df.with_columns((pl.col('iceTime') / (pl.col('gamesPlayed'))).alias('averageIceTime'))
-
+    derived={
+        'averageIceTime': pl.col('iceTime') / pl.col('gamesPlayed')
+    },
     # Have columns in correct order
-    df = df[['playerID', 'season', 'name', 'team', 'position', 'situation', 'gamesPlayed',
+    columns=['playerID', 'season', 'name', 'team', 'position', 'situation', 'gamesPlayed',
              'iceTime', 'points', 'goals', 'individualxGoals', 'xGoalsFor', 'xGoalsAgainst',
              'goalsFor', 'goalsAgainst', 'xGoalsForPerHour', 'xGoalsAgainstPerHour',
              'goalsForPerHour', 'goalsAgainstPerHour', 'pointsPerHour', 'goalsPerHour',
              'averageIceTime', 'penaltiesTaken', 'penaltiesDrawn', 'faceoffsWon', 'faceoffsLost',
-             'shotsBlocked', 'oZoneShifts', 'dZoneShifts', 'neutralZoneShifts', 'flyShifts']]
+             'shotsBlocked', 'oZoneShifts', 'dZoneShifts', 'neutralZoneShifts', 'flyShifts']
+)
+
+########### End Constants ###############
+
+
+def gather_df(season: int, session: requests.Session | None = None,
+              cache: ResponseCache | None = None, lake_dir: str | None = None) -> pl.DataFrame:
+    """
+    Script used to update tables containing skater-level data. 
+    
+    Pulls full data from MoneyPuck for a given season, saving only columns relevant to our plots,
+    and stores in a polars DF. Then computes a few additional columns before returning the
+    DataFrame. 
+
+    Designed to be called by a larger DB update script (e.g. update_tables.py in this directory).
+
+    As of August 25, 2025, the plots which use this table are:
+        - Skater ratio scatter plots (i.e. xGF vs xGA)
+        - Skater points-per-hour plot
+
+    :param int season: The season we'll be working with.
+    :param requests.Session session: Optional pooled session to download with, so that several
+                                     downloads can share connections.
+    :param ResponseCache cache: Optional cache of validators, to skip files that haven't changed
+                                since the last run.
+    :param str lake_dir: Optional raw-data lake to store the downloaded file in (see raw_lake.py).
+    :raises download.NotModified: If a cache was given and the source file is unchanged.
+    :return pl.DataFrame: Cleaned and proccessed DataFrame that will be used to update the DB.
+    """
+    with metrics.span('gather_df', table='skaters', season=season) as span:
+        content = download.fetch(DATA_URL.format(season), session, cache)
+
+        with metrics.span('parse'):
+            df = csv_reader.read_csv(content, 'skaters', USED_COLUMNS)
+        span.rows_in = len(df)
+
+        if lake_dir is not None:
+            with metrics.span('lake'):
+                raw_lake.store_source(lake_dir, 'skaters', content, USED_COLUMNS, season)
+
+        with metrics.span('transform'):
+            df = transforms.transform(SPEC, df)
+        span.rows_out = len(df)
 
     return df
 
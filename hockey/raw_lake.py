@@ -0,0 +1,260 @@
+"""
+Local lake of the raw source data, so that the tables can be rebuilt after a transform changes
+without downloading anything again. Each MoneyPuck file and each set of NST game CSVs is stored as
+it was fetched, as zstd-compressed Parquet:
+    {lake}/moneypuck/{source}/season={season}/{hash}.parquet
+    {lake}/nst/{kind}/gameID={gameID}/{hash}.parquet
+
+The hash is of the content, so a file that hasn't changed since it was last stored isn't written
+again, and the newest snapshot of each season or game is the one read back. Which one is newest
+is kept in a small manifest file next to the snapshots, rather than taken from their modification
+times, which don't survive copying the lake or restoring it from a cache. The multi-season
+all_teams file is split by season as it's stored, so each season of it is kept on its own.
+
+MoneyPuck files keep every column, with the header repaired if needed (see csv_reader.py). NST
+files keep every column as text, with empty fields as nulls, along with the name of the file each
+row came from.
+
+The lake is filled by passing --lake-dir to update_tables.py or update_player_game_tables.py,
+and read back by running either of them with --from-lake.
+
+Usage:
+    python raw_lake.py list -d raw_lake
+"""
+import os
+import glob
+import hashlib
+from argparse import ArgumentParser
+
+import polars as pl
+
+import csv_reader
+
+
+############## Constants ################
+
+DEFAULT_LAKE_DIR = os.environ.get('HOCKEY_LAKE_DIR', 'raw_lake')
+
+COMPRESSION = 'zstd'
+
+# Number of hex digits of the content hash kept in each snapshot's filename
+HASH_LENGTH = 16
+
+# File in each partition holding the filename of its newest snapshot
+MANIFEST = 'latest'
+
+# Kinds of NST CSV that make up a game
+NST_KINDS = ['st', 'oi', 'goalies']
+
+########### End Constants ###############
+
+
+def content_hash(*blocks: bytes) -> str:
+    """
+    :param bytes blocks: Content to hash.
+    :return str: Hash of the content, as used in snapshot filenames.
+    """
+    digest = hashlib.sha256()
+    for block in blocks:
+        digest.update(block)
+    return digest.hexdigest()[:HASH_LENGTH]
+
+
+def source_dir(lake_dir: str, source: str, season: int) -> str:
+    """
+    :return str: Directory of the snapshots of a season of a MoneyPuck source.
+    """
+    return os.path.join(lake_dir, 'moneypuck', source, f'season={season}')
+
+
+def game_dir(lake_dir: str, kind: str, game_id: str) -> str:
+    """
+    :return str: Directory of the snapshots of one kind of NST CSV for a game.
+    """
+    return os.path.join(lake_dir, 'nst', kind, f'gameID={game_id}')
+
+
+def write_snapshot(directory: str, df: pl.DataFrame, digest: str) -> bool:
+    """
+    Writes a snapshot, unless one with the same content is already stored, and marks it as the
+    newest in the partition's manifest.
+
+    :param str directory: Directory of the partition.
+    :param pl.DataFrame df: Content of the snapshot.
+    :param str digest: Hash of the content.
+    :return bool: True if a new snapshot was written.
+    """
+    path = os.path.join(directory, f'{digest}.parquet')
+    written = not os.path.exists(path)
+
+    # Both are written under another name first, so neither is ever read half written
+    if written:
+        os.makedirs(directory, exist_ok=True)
+        df.write_parquet(f'{path}.tmp', compression=COMPRESSION)
+        os.replace(f'{path}.tmp', path)
+
+    manifest = os.path.join(directory, MANIFEST)
+    with open(f'{manifest}.tmp', 'w') as f:
+        f.write(os.path.basename(path))
+    os.replace(f'{manifest}.tmp', manifest)
+
+    return written
+
+
+def latest_snapshot(directory: str) -> str:
+    """
+    :param str directory: Directory of the partition.
+    :raises ValueError: If nothing is stored in it.
+    :return str: Path of the newest snapshot, as recorded in the partition's manifest.
+    """
+    manifest = os.path.join(directory, MANIFEST)
+    if os.path.exists(manifest):
+        with open(manifest) as f:
+            path = os.path.join(directory, f.read().strip())
+        if os.path.exists(path):
+            return path
+
+    snapshots = glob.glob(os.path.join(directory, '*.parquet'))
+    if not snapshots:
+        raise ValueError(f'Nothing stored in {directory}, exiting...')
+
+    # Partitions stored before the manifest was kept only have modification times to go by
+    return max(snapshots, key=os.path.getmtime)
+
+
+def partitions(directory: str) -> list[str]:
+    """
+    :param str directory: Directory holding key=value partitions.
+    :return list[str]: Values of the partitions that have a snapshot, in order.
+    """
+    return sorted(os.path.basename(os.path.dirname(snapshot)).split('=', 1)[1]
+                  for snapshot in set(glob.glob(os.path.join(directory, '*=*', '*.parquet'))))
+
+
+def store_source(lake_dir: str, source: str, content: bytes, columns: list[str],
+                 season: int | None = None) -> int:
+    """
+    Stores a MoneyPuck CSV as it was downloaded.
+
+    :param str lake_dir: Root directory of the lake.
+    :param str source: Name of the source file, e.g. 'skaters' or 'all_teams'.
+    :param bytes content: The downloaded CSV.
+    :param list[str] columns: Columns the loader reads from it, used to check its header.
+    :param int season: Season the file is for. If not provided, the file holds every season and
+                       is split by its season column.
+    :return int: Number of snapshots written.
+    """
+    df = csv_reader.read_csv(content, source, columns, keep_all=True)
+
+    if season is not None:
+        return int(write_snapshot(source_dir(lake_dir, source, season), df,
+                                  content_hash(content)))
+
+    written = 0
+    for (file_season,), part in df.partition_by('season', as_dict=True).items():
+        written += write_snapshot(source_dir(lake_dir, source, file_season), part,
+                                  content_hash(part.write_csv().encode('utf-8')))
+    return written
+
+
+def read_source(lake_dir: str, source: str, season: int,
+                columns: list[str] | None = None) -> pl.DataFrame:
+    """
+    :param str lake_dir: Root directory of the lake.
+    :param str source: Name of the source file.
+    :param int season: Season to read.
+    :param list[str] columns: Columns to read, defaults to all of them.
+    :raises ValueError: If the season isn't stored.
+    :return pl.DataFrame: The newest snapshot of the season.
+    """
+    return pl.read_parquet(latest_snapshot(source_dir(lake_dir, source, season)),
+                           columns=columns)
+
+
+def source_seasons(lake_dir: str, source: str) -> list[int]:
+    """
+    :return list[int]: Every season stored for a MoneyPuck source, in order.
+    """
+    return sorted(int(season) for season in
+                  partitions(os.path.join(lake_dir, 'moneypuck', source)))
+
+
+def store_game(lake_dir: str, path: str, game_id: str) -> int:
+    """
+    Stores the NST CSVs of a game, one snapshot for each kind of CSV.
+
+    :param str lake_dir: Root directory of the lake.
+    :param str path: Folder containing the raw CSVs.
+    :param str game_id: Game to store.
+    :return int: Number of snapshots written.
+    """
+    written = 0
+    for kind in NST_KINDS:
+        filenames = sorted(glob.glob(os.path.join(path, f'*{game_id}*{kind}.csv')))
+        if not filenames:
+            continue
+
+        blocks = []
+        for filename in filenames:
+            with open(filename, 'rb') as f:
+                blocks += [os.path.basename(filename).encode('utf-8'), f.read()]
+
+        # Only the filename is kept, since the team, state and date are read from it
+        df = pl.scan_csv(filenames, infer_schema=False, null_values=[''],
+                         include_file_paths='file')\
+            .with_columns(pl.col('file').str.replace(r'^.*[/\\]', ''))\
+            .collect()
+        written += write_snapshot(game_dir(lake_dir, kind, game_id), df, content_hash(*blocks))
+
+    return written
+
+
+def scan_game(lake_dir: str, game_id: str, kind: str) -> pl.LazyFrame:
+    """
+    :param str lake_dir: Root directory of the lake.
+    :param str game_id: Game to read.
+    :param str kind: One of NST_KINDS.
+    :raises ValueError: If the game isn't stored.
+    :return pl.LazyFrame: Rows of the game's CSVs of that kind, as text with empty fields as nulls,
+                          and the name of the file each came from in the 'file' column.
+    """
+    return pl.scan_parquet(latest_snapshot(game_dir(lake_dir, kind, game_id)))
+
+
+def game_files(lake_dir: str, kind: str, game_ids: list[str]) -> list[str]:
+    """
+    :param str lake_dir: Root directory of the lake.
+    :param str kind: One of NST_KINDS.
+    :param list[str] game_ids: Games to list.
+    :return list[str]: Names of the CSVs stored for those games, for the games that are stored.
+    """
+    filenames = []
+    for game_id in game_ids:
+        if os.path.isdir(game_dir(lake_dir, kind, game_id)):
+            filenames += scan_game(lake_dir, game_id, kind).select(pl.col('file').unique())\
+                .collect()['file'].to_list()
+    return filenames
+
+
+def game_ids(lake_dir: str) -> list[str]:
+    """
+    :return list[str]: IDs of every game stored, in order.
+    """
+    return partitions(os.path.join(lake_dir, 'nst', 'st'))
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument('command', choices=['list'],
+                        help='list: show what is stored in the lake.')
+    parser.add_argument('-d', '--lake-dir', type=str, default=DEFAULT_LAKE_DIR,
+                        help='Root directory of the lake.')
+    args = parser.parse_args()
+
+    for source in sorted(os.listdir(os.path.join(args.lake_dir, 'moneypuck'))) \
+            if os.path.isdir(os.path.join(args.lake_dir, 'moneypuck')) else []:
+        seasons = source_seasons(args.lake_dir, source)
+        print(f"{source}: {len(seasons)} season(s) ({', '.join(map(str, seasons))})")
+
+    games = game_ids(args.lake_dir)
+    print(f'NST: {len(games)} game(s)' + (f' ({games[0]}-{games[-1]})' if games else ''))
@@ -0,0 +1,103 @@
+"""
+On-disk cache of HTTP validators (ETag/Last-Modified) for the source CSVs. Lets the downloads
+send conditional requests, so that a file that hasn't been republished since the last successful
+run isn't downloaded, parsed, or written to the DB again.
+"""
+import os
+import json
+import hashlib
+import threading
+
+import requests
+
+
+############## Constants ################
+
+# Default directory for the cache, can be overridden with the HOCKEY_CACHE_DIR env variable
+DEFAULT_CACHE_DIR = os.environ.get('HOCKEY_CACHE_DIR',
+                                   os.path.join(os.path.expanduser('~'), '.cache', 'hockey-stats'))
+
+# Response headers that are stored, mapped to the request header used to send them back
+VALIDATORS = {
+    'ETag': 'If-None-Match',
+    'Last-Modified': 'If-Modified-Since'
+}
+
+########### End Constants ###############
+
+
+class ResponseCache:
+    """
+    Stores the validators of the last response seen for each URL, one JSON file per URL.
+
+    Validators from a new response are only held in memory until `commit` is called for that URL,
+    which should be done once the data from the response has been written to the DB. That way a
+    run which fails part way through doesn't cause the next run to skip the file.
+
+    Safe to share between the threads of a pipelined update.
+    """
+
+    def __init__(self, directory: str = DEFAULT_CACHE_DIR) -> None:
+        """
+        :param str directory: Directory the cache files are stored in. Created if missing.
+        """
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def _path(self, url: str) -> str:
+        key = hashlib.sha256(url.encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, f'{key}.json')
+
+    def headers(self, url: str) -> dict[str, str]:
+        """
+        Builds the conditional request headers for a URL from the stored validators.
+
+        :param str url: URL about to be requested.
+        :return dict[str, str]: Headers to send, empty if nothing is stored for the URL.
+        """
+        path = self._path(url)
+        if not os.path.exists(path):
+            return {}
+
+        with open(path, 'r', encoding='utf-8') as f:
+            entry = json.load(f)
+
+        return {VALIDATORS[name]: value for name, value in entry['validators'].items()}
+
+    def remember(self, url: str, response: requests.Response) -> None:
+        """
+        Holds on to the validators of a fresh response until the URL is committed.
+
+        :param str url: URL that was requested.
+        :param requests.Response response: The (non-304) response received for it.
+        """
+        validators = {name: response.headers[name] for name in VALIDATORS
+                      if name in response.headers}
+
+        with self._lock:
+            self._pending[url] = validators
+
+    def commit(self, url: str) -> None:
+        """
+        Persists the validators remembered for a URL, so that the next run sends them.
+
+        :param str url: URL whose data has been successfully processed.
+        """
+        with self._lock:
+            if url not in self._pending:
+                return
+            validators = self._pending.pop(url)
+
+        path = self._path(url)
+
+        # The server stopped sending validators, so the old ones can't be trusted either
+        if not validators:
+            if os.path.exists(path):
+                os.remove(path)
+            return
+
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({'url': url, 'validators': validators}, f)
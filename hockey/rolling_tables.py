@@ -0,0 +1,118 @@
+"""
+Precomputed rolling averages over each team's recent games, kept up to date from team_games, so
+that the rolling xG% plot can read its series directly instead of computing windows over the
+whole season on every render.
+
+The rolling table is in long format, with one row per team, situation, game and window size.
+When games are written to team_games, only the teams and situations that played in them are
+recomputed, and only from the earliest of those games onwards. This is done in the same
+transaction as the write, so a failure leaves neither table changed.
+"""
+import duckdb
+
+
+############## Constants ################
+
+SOURCE_TABLE = 'team_games'
+ROLLING_TABLE = 'team_games_rolling'
+
+# Number of games in each window
+WINDOWS = [5, 10, 20]
+
+# Columns of team_games that are averaged over each window
+METRICS = ['xGoalsFor', 'xGoalsAgainst', 'xGoalsShare', 'corsiShare']
+
+########### End Constants ###############
+
+
+def ensure_table(conn: duckdb.DuckDBPyConnection) -> None:
+    """
+    Creates the rolling table if it doesn't exist yet, with the same column types as team_games.
+
+    :param duckdb.DuckDBPyConnection conn: Connection to the database.
+    """
+    conn.execute(f"""
+        CREATE TABLE IF NOT EXISTS {ROLLING_TABLE} AS
+        SELECT team, season, situation, gameID, gameDate,
+               NULL::INT AS windowSize, NULL::INT AS gamesInWindow, {', '.join(METRICS)}
+        FROM {SOURCE_TABLE} LIMIT 0
+    """)
+
+
+def rolling_query() -> str:
+    """
+    Builds the query computing every window for the teams and situations in the `affected` temp
+    table. The windows are computed over each team's whole season, and only then filtered to the
+    games being recomputed, so that the first of those still average over the games before them.
+
+    :return str: The query.
+    """
+    windows = []
+    for size in WINDOWS:
+        frame = (f'(PARTITION BY t.team, t.season, t.situation ORDER BY t.gameDate, t.gameID '
+                 f'ROWS BETWEEN {size - 1} PRECEDING AND CURRENT ROW)')
+        windows.append(f"""
+            SELECT t.team, t.season, t.situation, t.gameID, t.gameDate,
+                   {size} AS windowSize, count(*) OVER {frame} AS gamesInWindow,
+                   {', '.join(f'avg(t.{metric}) OVER {frame} AS {metric}' for metric in METRICS)},
+                   a.fromDate
+            FROM {SOURCE_TABLE} t
+            JOIN affected a
+              ON t.team = a.team AND t.season = a.season AND t.situation = a.situation
+        """)
+
+    return f"""
+        SELECT * EXCLUDE (fromDate) FROM ({' UNION ALL '.join(windows)})
+        WHERE gameDate >= fromDate
+    """
+
+
+def update_rolling(conn: duckdb.DuckDBPyConnection, season: int,
+                   game_ids: list[int] | None = None) -> int:
+    """
+    Brings the rolling table up to date with team_games for a season. If the games that were
+    written are given, only the teams and situations in those games are recomputed, from the
+    earliest of the games onwards. Otherwise the whole season is rebuilt.
+
+    Games that were deleted from team_games can be included in the IDs, their rows in the rolling
+    table are found by their ID and recomputed the same way.
+
+    Doesn't open a transaction of its own: it must be called inside the transaction that wrote
+    team_games, so that the rolling table is committed (or rolled back) along with it.
+
+    :param duckdb.DuckDBPyConnection conn: Connection to the database.
+    :param int season: Season that was written.
+    :param list[int] game_ids: IDs of the games that were inserted, updated or deleted.
+    :return int: Number of rows written to the rolling table.
+    """
+    ensure_table(conn)
+
+    if game_ids is None:
+        games = 'TRUE'
+    elif not game_ids:
+        return 0
+    else:
+        games = f"gameID IN ({', '.join(str(game_id) for game_id in game_ids)})"
+
+    conn.execute(f"""
+        CREATE OR REPLACE TEMP TABLE affected AS
+        SELECT team, season, situation, min(gameDate) AS fromDate FROM (
+            SELECT team, season, situation, gameDate FROM {SOURCE_TABLE}
+            WHERE season = {season} AND {games}
+            UNION ALL
+            SELECT team, season, situation, gameDate FROM {ROLLING_TABLE}
+            WHERE season = {season} AND {games}
+        ) GROUP BY ALL
+    """)
+
+    conn.execute(f"""
+        DELETE FROM {ROLLING_TABLE} r
+        WHERE EXISTS (SELECT 1 FROM affected a
+                      WHERE r.team = a.team AND r.season = a.season
+                        AND r.situation = a.situation AND r.gameDate >= a.fromDate)
+    """)
+
+    return conn.execute(f"""
+        INSERT INTO {ROLLING_TABLE}
+        {rolling_query()}
+    """).fetchone()[0]
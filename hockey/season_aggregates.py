@@ -0,0 +1,267 @@
+"""
+Season-to-date totals for every skater and goalie, kept up to date as games are written to the
+game tables, so that season stats can be read without aggregating every game again.
+
+The totals tables only hold additive sums (games, ice time, goals, shots, ...), keyed by season,
+name, team and situation. When a batch of games is written, its rows are added to the totals, and
+any rows it replaces are subtracted, so reloading a game to correct it leaves the totals exact.
+This is done in the same transaction as the write, so the totals can't drift from the game tables
+if a run fails in between.
+Rates and shares are computed from the sums by a view over each totals table.
+
+Rolling back or restoring a game table from the backup journal recomputes the totals of the
+seasons it touched in the same transaction (see backup_journal.py). After the game tables are
+changed any other way, the totals can be rebuilt from scratch:
+    python season_aggregates.py rebuild -s 2024
+"""
+from argparse import ArgumentParser
+
+import duckdb
+import polars as pl
+
+import dimensions
+import storage
+
+
+############## Constants ################
+
+# Game table -> totals table built from it
+TOTALS_TABLES = {
+    'skater_games': 'skater_season_totals',
+    'goalie_games': 'goalie_season_totals'
+}
+
+# Game table -> view computing rates and shares from its totals
+STATS_VIEWS = {
+    'skater_games': 'skater_season_stats',
+    'goalie_games': 'goalie_season_stats'
+}
+
+# Columns the totals are grouped by
+KEY = ['season', 'name', 'team', 'situation']
+
+# Columns summed in each totals table, and their types there
+SUMMED_COLUMNS = {
+    'skater_games': {
+        'iceTime': 'DOUBLE',
+        'goals': 'BIGINT',
+        'primaryAssists': 'BIGINT',
+        'secondaryAssists': 'BIGINT',
+        'shots': 'BIGINT',
+        'individualxGoals': 'DOUBLE',
+        'goalsFor': 'BIGINT',
+        'goalsAgainst': 'BIGINT',
+        'xGoalsFor': 'DOUBLE',
+        'xGoalsAgainst': 'DOUBLE',
+        'corsiFor': 'BIGINT',
+        'corsiAgainst': 'BIGINT',
+        'penaltiesTaken': 'BIGINT',
+        'penaltiesDrawn': 'BIGINT',
+        'hits': 'BIGINT'
+    },
+    'goalie_games': {
+        'iceTime': 'DOUBLE',
+        'shotsAgainst': 'BIGINT',
+        'goalsAgainst': 'BIGINT',
+        'xGoalsAgainst': 'DOUBLE'
+    }
+}
+
+# Rates and shares computed by each view. Ice time is in minutes.
+STATS = {
+    'skater_games': {
+        'points': 'goals + primaryAssists + secondaryAssists',
+        'averageIceTime': 'iceTime / games',
+        'goalsPerHour': 'goals * 60.0 / nullif(iceTime, 0)',
+        'pointsPerHour': '(goals + primaryAssists + secondaryAssists) * 60.0 / nullif(iceTime, 0)',
+        'individualxGoalsPerHour': 'individualxGoals * 60.0 / nullif(iceTime, 0)',
+        'goalsForPerHour': 'goalsFor * 60.0 / nullif(iceTime, 0)',
+        'goalsAgainstPerHour': 'goalsAgainst * 60.0 / nullif(iceTime, 0)',
+        'xGoalsForPerHour': 'xGoalsFor * 60.0 / nullif(iceTime, 0)',
+        'xGoalsAgainstPerHour': 'xGoalsAgainst * 60.0 / nullif(iceTime, 0)',
+        'goalsShare': 'round(goalsFor * 100.0 / nullif(goalsFor + goalsAgainst, 0), 2)',
+        'xGoalsShare': 'round(xGoalsFor * 100.0 / nullif(xGoalsFor + xGoalsAgainst, 0), 2)',
+        'corsiShare': 'round(corsiFor * 100.0 / nullif(corsiFor + corsiAgainst, 0), 2)'
+    },
+    'goalie_games': {
+        'savePercentage': '1 - goalsAgainst / nullif(shotsAgainst, 0)',
+        'goalsSavedAboveExpected': 'xGoalsAgainst - goalsAgainst',
+        'goalsAgainstPerHour': 'goalsAgainst * 60.0 / nullif(iceTime, 0)',
+        'xGoalsAgainstPerHour': 'xGoalsAgainst * 60.0 / nullif(iceTime, 0)'
+    }
+}
+
+########### End Constants ###############
+
+
+def ensure_tables(conn: duckdb.DuckDBPyConnection, table_name: str) -> None:
+    """
+    Creates the totals table and stats view for a game table if they don't exist yet. A newly
+    created totals table is filled from the game table's existing rows.
+
+    :param duckdb.DuckDBPyConnection conn: Connection to the database.
+    :param str table_name: Game table, one of TOTALS_TABLES.
+    """
+    totals = TOTALS_TABLES[table_name]
+    exists = conn.execute('SELECT count(*) FROM duckdb_tables() WHERE table_name = ?',
+                          [totals]).fetchone()[0]
+    if exists:
+        return
+
+    dimensions.create_types(conn)
+    summed = SUMMED_COLUMNS[table_name]
+    conn.execute(f"""
+        CREATE TABLE {totals} (
+            season INT,
+            name VARCHAR,
+            team team_code,
+            situation situation_code,
+            playerID INT,
+            games BIGINT,
+            {', '.join(f'{column} {column_type}' for column, column_type in summed.items())},
+            PRIMARY KEY ({', '.join(KEY)})
+        )
+    """)
+    conn.execute(f"""
+        CREATE OR REPLACE VIEW {STATS_VIEWS[table_name]} AS
+        SELECT *, {', '.join(f'{expr} AS {stat}' for stat, expr in STATS[table_name].items())}
+        FROM {totals}
+    """)
+
+    rebuild(conn, table_name)
+
+
+def batch_sums(conn: duckdb.DuckDBPyConnection, table_name: str, df: pl.DataFrame) -> pl.DataFrame:
+    """
+    Sums the rows of a game table that belong to a batch's games: the rows it is about to replace
+    if called before the batch is written, or the rows it wrote if called after. A batch replaces
+    every row of its games. Summing what is stored in the table (rather than the batch itself)
+    keeps the totals identical to a rebuild.
+
+    :param duckdb.DuckDBPyConnection conn: Connection to the database.
+    :param str table_name: Game table the batch is written to.
+    :param pl.DataFrame df: Rows in the batch.
+    :return pl.DataFrame: Sums of the rows, by KEY.
+    """
+    return conn.execute(f"""
+        SELECT {', '.join(KEY)}, max(playerID) AS playerID, count(*) AS games,
+               {', '.join(f'sum({column}) AS {column}' for column in SUMMED_COLUMNS[table_name])}
+        FROM {table_name} t
+        WHERE gameID IN (SELECT DISTINCT gameID FROM df)
+        GROUP BY ALL
+    """).pl()
+
+
+def capture(conn: duckdb.DuckDBPyConnection, table_name: str, df: pl.DataFrame) -> pl.DataFrame:
+    """
+    Sums the rows of a game table that a batch is about to replace, so that their contribution
+    can be taken back out of the totals once the batch is written. Must be called before the
+    write.
+
+    :param duckdb.DuckDBPyConnection conn: Connection to the database.
+    :param str table_name: Game table the batch will be written to.
+    :param pl.DataFrame df: Rows in the batch.
+    :return pl.DataFrame: Sums of the rows being replaced, by KEY.
+    """
+    ensure_tables(conn, table_name)
+
+    return batch_sums(conn, table_name, df)
+
+
+def apply(conn: duckdb.DuckDBPyConnection, table_name: str, df: pl.DataFrame,
+          replaced: pl.DataFrame) -> int:
+    """
+    Adds a batch that has just been written to a game table to the totals, and subtracts the rows
+    it replaced. Totals left with no games (e.g. a player removed from a corrected game) are
+    deleted. Must be called inside the write's transaction, after the write, so that both are
+    committed together.
+
+    :param duckdb.DuckDBPyConnection conn: Connection to the database.
+    :param str table_name: Game table the batch was written to.
+    :param pl.DataFrame df: Rows in the batch.
+    :param pl.DataFrame replaced: Output of `capture` for the batch, from before the write.
+    :return int: Number of totals rows changed.
+    """
+    totals = TOTALS_TABLES[table_name]
+    summed = list(SUMMED_COLUMNS[table_name])
+    written = batch_sums(conn, table_name, df)
+
+    rows = conn.execute(f"""
+        INSERT INTO {totals}
+        SELECT {', '.join(KEY)}, max(playerID), sum(games),
+               {', '.join(f'sum({column})' for column in summed)}
+        FROM (
+            SELECT * FROM written
+            UNION ALL
+            SELECT {', '.join(KEY)}, NULL, -games, {', '.join(f'-{c}' for c in summed)}
+            FROM replaced
+        )
+        GROUP BY ALL
+        ON CONFLICT DO UPDATE SET
+            playerID = coalesce(EXCLUDED.playerID, playerID),
+            games = games + EXCLUDED.games,
+            {', '.join(f'{column} = {column} + EXCLUDED.{column}' for column in summed)}
+    """).fetchone()[0]
+    conn.execute(f'DELETE FROM {totals} WHERE games <= 0')
+
+    return rows
+
+
+def recompute(conn: duckdb.DuckDBPyConnection, table_name: str,
+              seasons: list[int] | None = None) -> None:
+    """
+    Recomputes the totals for a game table from its rows. Doesn't open a transaction of its own,
+    so it can be committed along with the change to the game table that made it necessary.
+
+    :param duckdb.DuckDBPyConnection conn: Connection to the database.
+    :param str table_name: Game table, one of TOTALS_TABLES.
+    :param list[int] seasons: If provided, only recompute these seasons.
+    """
+    if seasons is not None and not seasons:
+        return
+
+    totals = TOTALS_TABLES[table_name]
+    scope = f"WHERE season IN ({', '.join(str(season) for season in seasons)})" \
+        if seasons is not None else ''
+
+    print(f'Rebuilding {totals}...')
+    conn.execute(f'DELETE FROM {totals} {scope}')
+    conn.execute(f"""
+        INSERT INTO {totals}
+        SELECT {', '.join(KEY)}, max(playerID), count(*),
+               {', '.join(f'sum({column})' for column in SUMMED_COLUMNS[table_name])}
+        FROM {table_name} {scope}
+        GROUP BY ALL
+    """)
+
+
+def rebuild(conn: duckdb.DuckDBPyConnection, table_name: str, season: int | None = None) -> None:
+    """
+    Recomputes the totals for a game table from scratch, in one transaction.
+
+    :param duckdb.DuckDBPyConnection conn: Connection to the database.
+    :param str table_name: Game table, one of TOTALS_TABLES.
+    :param int season: If provided, only rebuild this season.
+    """
+    conn.execute('BEGIN TRANSACTION')
+    try:
+        recompute(conn, table_name, [season] if season is not None else None)
+        conn.execute('COMMIT')
+    except Exception:
+        conn.execute('ROLLBACK')
+        raise
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument('command', choices=['rebuild'],
+                        help='Action to take on the totals tables.')
+    parser.add_argument('-s', '--season', type=int, default=None,
+                        help='Only rebuild this season.')
+    args = parser.parse_args()
+
+    conn = storage.get_connection()
+    for table_name in TOTALS_TABLES:
+        ensure_tables(conn, table_name)
+        rebuild(conn, table_name, args.season)
+    storage.persist()
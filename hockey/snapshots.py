@@ -0,0 +1,230 @@
+"""
+Season-partitioned Parquet snapshots of tables in the database. Each snapshot is written to a
+local directory as zstd-compressed Parquet files, one directory per season, along with a manifest
+recording the row count and checksum of every season.
+
+A snapshot can be restored for the whole table, or for a single season. Restoring a season only
+deletes and reloads that season's rows, straight from its Parquet files, so the rest of the table
+is never rewritten.
+
+Snapshot layout:
+    {directory}/{table}/{snapshot}/season={season}/data_0.parquet
+    {directory}/{table}/{snapshot}/manifest.json
+
+Usage:
+    python snapshots.py export -t skaters
+    python snapshots.py list -t skaters
+    python snapshots.py restore -t skaters -s 2024
+    python snapshots.py restore -t skaters --snapshot 20250101T120000
+"""
+import os
+import json
+from datetime import datetime
+from argparse import ArgumentParser
+
+import duckdb
+
+import storage
+
+
+############## Constants ################
+
+DEFAULT_SNAPSHOT_DIR = os.environ.get('HOCKEY_SNAPSHOT_DIR', 'snapshots')
+
+# Every table has a season column, which the snapshots are partitioned on
+PARTITION_KEY = 'season'
+
+COMPRESSION = 'zstd'
+
+MANIFEST_NAME = 'manifest.json'
+
+########### End Constants ###############
+
+
+def season_checksums(conn: duckdb.DuckDBPyConnection, table_name: str,
+                     season: int | None = None) -> dict[str, list[int]]:
+    """
+    Computes the row count and the sum of a hash of every row, for each season in a table.
+
+    :param duckdb.DuckDBPyConnection conn: Connection to the database.
+    :param str table_name: Table to checksum.
+    :param int season: If provided, only checksum this season.
+    :return dict[str, list[int]]: Season -> [row count, aggregate hash].
+    """
+    where = f'WHERE {PARTITION_KEY} = {season}' if season is not None else ''
+    rows = conn.execute(f"""
+        SELECT {PARTITION_KEY}, count(*), sum(hash(t)) FROM {table_name} t
+        {where} GROUP BY {PARTITION_KEY}
+    """).fetchall()
+
+    return {str(row[0]): [row[1], int(row[2])] for row in rows}
+
+
+def export_table(conn: duckdb.DuckDBPyConnection, table_name: str,
+                 directory: str = DEFAULT_SNAPSHOT_DIR) -> str:
+    """
+    Writes a snapshot of a table, partitioned by season. The copy and the checksums are taken in
+    one transaction, so they always describe the same rows. The manifest is written last, so a
+    snapshot that failed part way through is never listed or restored from.
+
+    :param duckdb.DuckDBPyConnection conn: Connection to the database.
+    :param str table_name: Table to snapshot.
+    :param str directory: Root directory for snapshots.
+    :return str: Path of the new snapshot.
+    """
+    snapshot = datetime.now().strftime('%Y%m%dT%H%M%S')
+    path = os.path.join(directory, table_name, snapshot)
+    os.makedirs(path)
+
+    print(f'Exporting {table_name} to {path}...')
+
+    conn.execute('BEGIN TRANSACTION')
+    try:
+        conn.execute(f"""
+            COPY (SELECT * FROM {table_name}) TO '{path}'
+            (FORMAT parquet, COMPRESSION {COMPRESSION}, PARTITION_BY ({PARTITION_KEY}),
+             WRITE_PARTITION_COLUMNS true, OVERWRITE_OR_IGNORE)
+        """)
+        checksums = season_checksums(conn, table_name)
+        columns = conn.execute(f'DESCRIBE {table_name}').fetchall()
+        conn.execute('COMMIT')
+    except Exception:
+        conn.execute('ROLLBACK')
+        raise
+
+    seasons = {}
+    for season, (rows, checksum) in checksums.items():
+        season_dir = os.path.join(path, f'{PARTITION_KEY}={season}')
+        seasons[season] = {
+            'rows': rows,
+            'checksum': checksum,
+            'bytes': sum(os.path.getsize(os.path.join(season_dir, file))
+                         for file in os.listdir(season_dir))
+        }
+
+    manifest = {
+        'table': table_name,
+        'snapshot': snapshot,
+        'created_at': datetime.now().isoformat(timespec='seconds'),
+        'compression': COMPRESSION,
+        'columns': [[column[0], column[1]] for column in columns],
+        'seasons': seasons
+    }
+    with open(os.path.join(path, MANIFEST_NAME), 'w') as f:
+        json.dump(manifest, f, indent=2)
+
+    print(f"Exported {sum(s['rows'] for s in seasons.values())} rows over {len(seasons)} "
+          f"seasons ({sum(s['bytes'] for s in seasons.values())} bytes)")
+
+    return path
+
+
+def list_snapshots(table_name: str, directory: str = DEFAULT_SNAPSHOT_DIR) -> list[dict]:
+    """
+    :param str table_name: Table whose snapshots to list.
+    :param str directory: Root directory for snapshots.
+    :return list[dict]: Manifests of every complete snapshot of the table, oldest first.
+    """
+    table_dir = os.path.join(directory, table_name)
+    if not os.path.isdir(table_dir):
+        return []
+
+    manifests = []
+    for snapshot in sorted(os.listdir(table_dir)):
+        manifest_path = os.path.join(table_dir, snapshot, MANIFEST_NAME)
+        if os.path.exists(manifest_path):
+            with open(manifest_path) as f:
+                manifests.append(json.load(f))
+
+    return manifests
+
+
+def restore_table(conn: duckdb.DuckDBPyConnection, table_name: str, snapshot: str | None = None,
+                  season: int | None = None, directory: str = DEFAULT_SNAPSHOT_DIR) -> None:
+    """
+    Restores a table, or one season of it, from a snapshot. The rows being restored are deleted
+    and bulk-loaded from the snapshot's Parquet files in one transaction, and the restored rows
+    are checked against the manifest before committing.
+
+    :param duckdb.DuckDBPyConnection conn: Connection to the database.
+    :param str table_name: Table to restore.
+    :param str snapshot: Snapshot to restore from, defaults to the most recent one.
+    :param int season: If provided, only restore this season. Otherwise restore the whole table.
+    :param str directory: Root directory for snapshots.
+    :raises ValueError: If the snapshot or season doesn't exist, or the restored rows don't match
+                        the manifest.
+    """
+    manifests = {manifest['snapshot']: manifest
+                 for manifest in list_snapshots(table_name, directory)}
+    if not manifests:
+        raise ValueError(f'No snapshots of {table_name} found in {directory}, exiting...')
+
+    snapshot = snapshot if snapshot is not None else max(manifests)
+    if snapshot not in manifests:
+        raise ValueError(f'Snapshot {snapshot} of {table_name} not found, exiting...')
+    manifest = manifests[snapshot]
+
+    path = os.path.join(directory, table_name, snapshot)
+    if season is not None:
+        if str(season) not in manifest['seasons']:
+            raise ValueError(f'Season {season} not in snapshot {snapshot} of {table_name}, '
+                             f'exiting...')
+        files = os.path.join(path, f'{PARTITION_KEY}={season}', '*.parquet')
+        scope = f'WHERE {PARTITION_KEY} = {season}'
+        expected = {str(season): manifest['seasons'][str(season)]}
+    else:
+        files = os.path.join(path, '*', '*.parquet')
+        scope = ''
+        expected = manifest['seasons']
+
+    print(f"Restoring {table_name}{f' season {season}' if season is not None else ''} "
+          f"from snapshot {snapshot}...")
+
+    conn.execute('BEGIN TRANSACTION')
+    try:
+        conn.execute(f'DELETE FROM {table_name} {scope}')
+        conn.execute(f"""
+            INSERT INTO {table_name} BY NAME
+            SELECT * FROM read_parquet('{files}', hive_partitioning = false)
+        """)
+
+        restored = season_checksums(conn, table_name, season)
+        expected = {s: [info['rows'], info['checksum']] for s, info in expected.items()}
+        if restored != expected:
+            raise ValueError(f'Restored rows of {table_name} do not match snapshot {snapshot}, '
+                             f'exiting...')
+
+        conn.execute('COMMIT')
+    except Exception:
+        conn.execute('ROLLBACK')
+        raise
+
+    print(f'Restored {sum(rows for rows, _ in restored.values())} rows')
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    parser.add_argument('command', choices=['export', 'list', 'restore'],
+                        help='Action to take.')
+    parser.add_argument('-t', '--table', required=True, type=str,
+                        help='Table to export, list snapshots of, or restore.')
+    parser.add_argument('-d', '--directory', type=str, default=DEFAULT_SNAPSHOT_DIR,
+                        help='Root directory for snapshots.')
+    parser.add_argument('-s', '--season', type=int, default=None,
+                        help='Only restore this season.')
+    parser.add_argument('--snapshot', type=str, default=None,
+                        help='Snapshot to restore from, defaults to the most recent one.')
+    args = parser.parse_args()
+
+    if args.command == 'list':
+        for manifest in list_snapshots(args.table, args.directory):
+            seasons = manifest['seasons']
+            print(f"{manifest['snapshot']}: {sum(s['rows'] for s in seasons.values())} rows, "
+                  f"{len(seasons)} seasons, {sum(s['bytes'] for s in seasons.values())} bytes")
+    else:
+        conn = storage.get_connection()
+        if args.command == 'export':
+            export_table(conn, args.table, args.directory)
+        else:
+            restore_table(conn, args.table, args.snapshot, args.season, args.directory)
+            storage.persist()
@@ -0,0 +1,104 @@
+"""
+Staged loading of several tables at once. Every frame is first bulk-copied into a staging table,
+the staged row counts are checked, and then all the tables are published together in a single
+transaction, so readers never see a table part way through an update.
+"""
+from collections.abc import Callable
+
+import duckdb
+import polars as pl
+
+
+def stage_frames(conn: duckdb.DuckDBPyConnection, frames: dict[str, pl.DataFrame]) -> None:
+    """
+    Copies each frame by column name into a temp table named stage_{table}, with the same
+    schema as its target table. The frames are handed to DuckDB as Arrow tables, and all the copies are sent as one
+    batch of statements.
+
+    :param duckdb.DuckDBPyConnection conn: Connection to the database.
+    :param dict[str, pl.DataFrame] frames: Target table name -> rows to load into it.
+    """
+    statements = []
+    for table_name, df in frames.items():
+        conn.register(f'arrow_{table_name}', df.to_arrow())
+        statements += [
+            f'CREATE OR REPLACE TEMP TABLE stage_{table_name} AS '
+            f'SELECT * FROM {table_name} LIMIT 0',
+            f'INSERT INTO stage_{table_name} BY NAME SELECT * FROM arrow_{table_name}'
+        ]
+
+    try:
+        conn.execute(';\n'.join(statements))
+    finally:
+        for table_name in frames:
+            conn.unregister(f'arrow_{table_name}')
+
+
+def validate_staged(conn: duckdb.DuckDBPyConnection, frames: dict[str, pl.DataFrame]) -> None:
+    """
+    Checks that every staging table holds exactly as many rows as the frame it was loaded from.
+
+    :param duckdb.DuckDBPyConnection conn: Connection to the database.
+    :param dict[str, pl.DataFrame] frames: Target table name -> rows that were staged for it.
+    :raises ValueError: If any of the counts don't match.
+    """
+    counts = dict(conn.execute(
+        ' UNION ALL '.join(f"SELECT '{table_name}', count(*) FROM stage_{table_name}"
+                           for table_name in frames)
+    ).fetchall())
+
+    for table_name, df in frames.items():
+        if counts[table_name] != len(df):
+            raise ValueError(f"Staged {counts[table_name]} rows for {table_name}, expected "
+                             f"{len(df)}, exiting...")
+
+
+def publish(conn: duckdb.DuckDBPyConnection, scopes: dict[str, str | None],
+            before_commit: Callable[[], None] | None = None) -> None:
+    """
+    Publishes every staging table to its target in one transaction.
+
+    The targets hold more than what is being loaded (e.g. every season), so rather than swapping
+    in whole new tables, the rows in each table's scope are replaced by the staged rows. Since
+    both happen in the same transaction, other connections see either the old rows or the new
+    ones, never an empty scope.
+
+    :param duckdb.DuckDBPyConnection conn: Connection to the database.
+    :param dict[str, str | None] scopes: Target table name -> SQL predicate for the rows the staged
+                                         data replaces, or None to only append.
+    :param Callable before_commit: Optional function run after every table is published, in the
+                                   same transaction.
+    """
+    statements = ['BEGIN TRANSACTION']
+    for table_name, scope in scopes.items():
+        if scope is not None:
+            statements.append(f'DELETE FROM {table_name} WHERE {scope}')
+        statements.append(f'INSERT INTO {table_name} SELECT * FROM stage_{table_name}')
+
+    try:
+        conn.execute(';\n'.join(statements))
+        if before_commit is not None:
+            before_commit()
+        conn.execute('COMMIT')
+    except Exception:
+        conn.execute('ROLLBACK')
+        raise
+
+
+def staged_load(conn: duckdb.DuckDBPyConnection, frames: dict[str, pl.DataFrame],
+                scopes: dict[str, str | None],
+                before_commit: Callable[[], None] | None = None) -> None:
+    """
+    Stages, validates and publishes a set of frames. Nothing is published if staging or
+    validation fails for any of them.
+
+    :param duckdb.DuckDBPyConnection conn: Connection to the database.
+    :param dict[str, pl.DataFrame] frames: Target table name -> rows to load into it.
+    :param dict[str, str | None] scopes: Target table name -> SQL predicate for the rows being
+                                         replaced, or None to only append.
+    :param Callable before_commit: Optional function run in the publishing transaction, see
+                                   `publish`.
+    """
+    stage_frames(conn, frames)
+    validate_staged(conn, frames)
+    publish(conn, scopes, before_commit)
@@ -0,0 +1,171 @@
+"""
+Storage backends for the database, and the one connection to it shared by everything in a
+process. The loaders, backups and maintenance scripts all get their connection from here rather
+than connecting on their own, so a process that backs up, updates and then verifies the tables
+only connects once.
+
+The backend is configured once, with environment variables:
+    HOCKEY_DB_BACKEND: one of BACKENDS, defaults to 'motherduck'
+    HOCKEY_DB_PATH: database to open, defaults to DEFAULT_PATHS[backend]
+
+Backends:
+    motherduck: the MotherDuck database, e.g. 'md:' or 'md:hockey'
+    duckdb: a local DuckDB file
+    parquet: a directory written by EXPORT DATABASE (one Parquet file per table, along with the
+             schema). It's imported into an in-memory database on connect, and only written back
+             when `persist` is called, so a run that fails part way leaves the directory as it was.
+
+Running the whole pipeline against a local file, with no remote service:
+    HOCKEY_DB_BACKEND=duckdb HOCKEY_DB_PATH=hockey-stats.db python update_tables.py -s 2024
+
+The shared connection must not be used from several threads at once, threads should each take
+a cursor from it with `get_connection().cursor()`.
+"""
+import os
+import atexit
+import shutil
+import threading
+
+import duckdb
+
+
+############## Constants ################
+
+BACKENDS = ['motherduck', 'duckdb', 'parquet']
+
+DEFAULT_PATHS = {
+    'motherduck': 'md:',
+    'duckdb': 'hockey-stats.db',
+    'parquet': 'hockey-stats'
+}
+
+DEFAULT_BACKEND = os.environ.get('HOCKEY_DB_BACKEND', 'motherduck')
+
+# None means the default path of whichever backend is configured
+DEFAULT_PATH = os.environ.get('HOCKEY_DB_PATH')
+
+PARQUET_COMPRESSION = 'zstd'
+
+########### End Constants ###############
+
+
+_settings = {'backend': DEFAULT_BACKEND, 'path': DEFAULT_PATH}
+_connection = None
+_lock = threading.Lock()
+
+
+def configure(backend: str | None = None, path: str | None = None) -> None:
+    """
+    Overrides the backend and database set by the environment. Closes the shared connection if
+    it's open to a different database, without persisting it.
+
+    :param str backend: One of BACKENDS.
+    :param str path: Database to open, defaults to the backend's default path.
+    :raises ValueError: If the backend is unknown.
+    """
+    backend = backend if backend is not None else _settings['backend']
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown storage backend {backend}, must be one of "
+                         f"{', '.join(BACKENDS)}, exiting...")
+
+    if (backend, path) != (_settings['backend'], _settings['path']):
+        close()
+        _settings['backend'] = backend
+        _settings['path'] = path
+
+
+def database_path() -> str:
+    """
+    :return str: The database the configured backend opens.
+    """
+    return _settings['path'] if _settings['path'] is not None \
+        else DEFAULT_PATHS[_settings['backend']]
+
+
+def get_connection() -> duckdb.DuckDBPyConnection:
+    """
+    Returns the process' shared connection, opening it on first use.
+
+    :raises ValueError: If the configured backend is unknown.
+    :return duckdb.DuckDBPyConnection: Connection to the database.
+    """
+    global _connection
+
+    with _lock:
+        if _connection is None:
+            backend = _settings['backend']
+            path = database_path()
+            if backend not in BACKENDS:
+                raise ValueError(f"Unknown storage backend {backend}, must be one of "
+                                 f"{', '.join(BACKENDS)}, exiting...")
+
+            print(f'Connecting to {backend} database {path}...')
+            if backend == 'parquet':
+                _recover_export(path)
+                _connection = duckdb.connect(database=':memory:')
+                if os.path.exists(os.path.join(path, 'schema.sql')):
+                    _connection.execute(f"IMPORT DATABASE '{path}'")
+            else:
+                _connection = duckdb.connect(database=path, read_only=False)
+
+        return _connection
+
+
+def _recover_export(path: str) -> None:
+    """
+    Puts the previous export of a parquet database back in place if a crash in `persist` left the
+    directory moved aside with nothing swapped in for it.
+
+    :param str path: Directory of the database.
+    """
+    if not os.path.exists(path) and os.path.exists(f'{path}.old'):
+        print(f'Restoring {path} from {path}.old, left by an interrupted export...')
+        os.replace(f'{path}.old', path)
+
+
+def persist() -> None:
+    """
+    Writes the database back to its directory for the parquet backend, a no-op for the others
+    since their writes are already durable. The export is written next to the directory and then
+    swapped in, so the directory is never left half written.
+
+    A directory can't be replaced by another in one rename, so the swap takes two: the current
+    directory is moved to {path}.old, then the export is moved into its place. A crash between
+    the two leaves only {path}.old, which is moved back the next time the database is opened. A
+    {path}.old left by an earlier crash is removed before the swap, since the first rename can't
+    replace it.
+    """
+    if _connection is None or _settings['backend'] != 'parquet':
+        return
+
+    path = database_path()
+    print(f'Exporting database to {path}...')
+    with _lock:
+        shutil.rmtree(f'{path}.tmp', ignore_errors=True)
+        _connection.execute(f"""
+            EXPORT DATABASE memory TO '{path}.tmp'
+            (FORMAT parquet, COMPRESSION {PARQUET_COMPRESSION})
+        """)
+
+        _recover_export(path)
+        if os.path.exists(path):
+            shutil.rmtree(f'{path}.old', ignore_errors=True)
+            os.replace(path, f'{path}.old')
+        os.replace(f'{path}.tmp', path)
+        shutil.rmtree(f'{path}.old', ignore_errors=True)
+
+
+def close() -> None:
+    """
+    Closes the shared connection, if it's open. Changes to a parquet database that weren't
+    persisted are discarded.
+    """
+    global _connection
+
+    with _lock:
+        if _connection is not None:
+            _connection.close()
+            _connection = None
+
+
+atexit.register(close)
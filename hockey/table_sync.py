@@ -0,0 +1,193 @@
+"""
+Row-level differential sync of a season's worth of data into a table. Rather than deleting the
+whole season and inserting it again, incoming rows are matched to existing ones on the table's
+natural key and compared by a hash of their contents, and only the rows that were inserted,
+changed or deleted are written.
+
+Also has a keyed upsert, for tables that are appended to a batch at a time (e.g. the game
+tables), so that loading the same rows twice never duplicates them. The upsert can also replace
+everything in a scope (e.g. the batch's games), so that rows dropped from a corrected batch are
+removed.
+"""
+from collections.abc import Callable
+
+import duckdb
+import polars as pl
+
+
+############## Constants ################
+
+# Columns which uniquely identify a row within each table
+NATURAL_KEYS = {
+    'skaters': ['playerID', 'season', 'situation'],
+    'goalies': ['playerID', 'season', 'situation'],
+    'teams': ['team', 'season', 'situation'],
+    'team_games': ['team', 'gameID', 'situation'],
+    'skater_games': ['gameID', 'name', 'team', 'situation'],
+    'goalie_games': ['gameID', 'name', 'team', 'situation']
+}
+
+########### End Constants ###############
+
+
+def get_columns(conn: duckdb.DuckDBPyConnection, table_name: str) -> list[str]:
+    """
+    :param duckdb.DuckDBPyConnection conn: Connection to the database.
+    :param str table_name: Table to describe.
+    :return list[str]: The table's column names, in order.
+    """
+    return [row[0] for row in conn.execute(f'DESCRIBE {table_name}').fetchall()]
+
+
+def sync_season(conn: duckdb.DuckDBPyConnection, df: pl.DataFrame, table_name: str,
+                season: int, before_commit: Callable[[], None] | None = None) -> dict[str, int]:
+    """
+    Makes the rows for a season in the table match the DataFrame, writing only what changed.
+
+    The incoming rows are first copied by name into a temp table with the same schema as the
+    target, so that both sides are hashed with identical column types (e.g. the table's FLOAT
+    columns rather than the DataFrame's Float64). Rows are then classified by a full join on the natural key:
+        - insert: key only in the incoming data
+        - update: key on both sides, but the row hashes differ
+        - delete: key only in the table
+    The classification is left in the `changes` temp table for the rest of the connection, and
+    applied in a single transaction.
+
+    :param duckdb.DuckDBPyConnection conn: Connection to the database.
+    :param pl.DataFrame df: Processed data for the season, with the table's column names.
+    :param str table_name: Table being updated, must be one of NATURAL_KEYS.
+    :param int season: Season being updated.
+    :param Callable before_commit: Optional function run after the write, in its transaction, for
+                                   anything that must be committed (or rolled back) along with it.
+    :return dict[str, int]: Number of rows inserted, updated and deleted.
+    """
+    keys = NATURAL_KEYS[table_name]
+    columns = get_columns(conn, table_name)
+
+    def row_hash(alias: str) -> str:
+        return f"hash({', '.join(f'{alias}.{column}' for column in columns)})"
+
+    def key_match(left: str, right: str) -> str:
+        return ' AND '.join(f'{left}.{key} IS NOT DISTINCT FROM {right}.{key}' for key in keys)
+
+    conn.execute('BEGIN TRANSACTION')
+    try:
+        conn.execute(f'CREATE OR REPLACE TEMP TABLE incoming AS '
+                     f'SELECT * FROM {table_name} LIMIT 0')
+        conn.execute('INSERT INTO incoming BY NAME SELECT * FROM df')
+
+        conn.execute(f"""
+            CREATE OR REPLACE TEMP TABLE changes AS
+            SELECT
+                {', '.join(f'COALESCE(i.{key}, c.{key}) AS {key}' for key in keys)},
+                CASE
+                    WHEN c.row_hash IS NULL THEN 'insert'
+                    WHEN i.row_hash IS NULL THEN 'delete'
+                    ELSE 'update'
+                END AS operation
+            FROM (SELECT {', '.join(keys)}, {row_hash('n')} AS row_hash FROM incoming n) i
+            FULL OUTER JOIN (
+                SELECT {', '.join(keys)}, {row_hash('t')} AS row_hash
+                FROM {table_name} t
+                WHERE t.season = {season}
+            ) c ON {key_match('i', 'c')}
+            WHERE i.row_hash IS DISTINCT FROM c.row_hash
+        """)
+
+        conn.execute(f"""
+            DELETE FROM {table_name} t
+            WHERE t.season = {season}
+              AND EXISTS (SELECT 1 FROM changes ch
+                          WHERE ch.operation IN ('update', 'delete') AND {key_match('ch', 't')})
+        """)
+
+        conn.execute(f"""
+            INSERT INTO {table_name}
+            SELECT n.* FROM incoming n
+            WHERE EXISTS (SELECT 1 FROM changes ch
+                          WHERE ch.operation IN ('insert', 'update') AND {key_match('ch', 'n')})
+        """)
+
+        if before_commit is not None:
+            before_commit()
+        conn.execute('COMMIT')
+    except Exception:
+        conn.execute('ROLLBACK')
+        raise
+
+    counts = dict(conn.execute('SELECT operation, count(*) FROM changes GROUP BY operation')
+                  .fetchall())
+
+    return {operation: counts.get(operation, 0) for operation in ['insert', 'update', 'delete']}
+
+
+def upsert(conn: duckdb.DuckDBPyConnection, df: pl.DataFrame, table_name: str,
+           scope: str | None = None,
+           before_commit: Callable[[], None] | None = None) -> dict[str, int]:
+    """
+    Inserts the DataFrame into the table, replacing any existing rows with the same natural key,
+    so that loading the same batch again leaves the table unchanged. If a scope is given, every
+    row in it is replaced too, so rows that are no longer in the batch are deleted.
+
+    DuckDB has no MERGE, so the existing rows are deleted and the new rows inserted in a single
+    transaction. As in sync_season, the keys written or deleted and whether each was an insert,
+    an update or a delete are left in the `changes` temp table.
+
+    :param duckdb.DuckDBPyConnection conn: Connection to the database.
+    :param pl.DataFrame df: Rows to write, with the table's column names.
+    :param str table_name: Table being written to, must be one of NATURAL_KEYS.
+    :param str scope: SQL predicate for the rows the batch replaces as a whole, e.g. its games.
+                      If not provided, only rows with the batch's keys are replaced.
+    :param Callable before_commit: Optional function run after the write, in its transaction, for
+                                   anything that must be committed (or rolled back) along with it.
+    :return dict[str, int]: Number of rows inserted, updated and deleted.
+    """
+    keys = NATURAL_KEYS[table_name]
+
+    def key_match(left: str, right: str) -> str:
+        return ' AND '.join(f'{left}.{key} IS NOT DISTINCT FROM {right}.{key}' for key in keys)
+
+    conn.execute('BEGIN TRANSACTION')
+    try:
+        conn.execute(f'CREATE OR REPLACE TEMP TABLE incoming AS '
+                     f'SELECT * FROM {table_name} LIMIT 0')
+        conn.execute('INSERT INTO incoming BY NAME SELECT * FROM df')
+
+        conn.execute(f"""
+            CREATE OR REPLACE TEMP TABLE changes AS
+            SELECT
+                {', '.join(f'n.{key}' for key in keys)},
+                CASE
+                    WHEN EXISTS (SELECT 1 FROM {table_name} t WHERE {key_match('t', 'n')})
+                    THEN 'update' ELSE 'insert'
+                END AS operation
+            FROM incoming n
+        """)
+
+        if scope is not None:
+            conn.execute(f"""
+                INSERT INTO changes
+                SELECT {', '.join(f't.{key}' for key in keys)}, 'delete'
+                FROM {table_name} t
+                WHERE ({scope})
+                  AND NOT EXISTS (SELECT 1 FROM incoming n WHERE {key_match('n', 't')})
+            """)
+
+        conn.execute(f"""
+            DELETE FROM {table_name} t
+            WHERE {f'({scope}) OR ' if scope is not None else ''}
+                  EXISTS (SELECT 1 FROM incoming n WHERE {key_match('n', 't')})
+        """)
+        conn.execute(f'INSERT INTO {table_name} SELECT * FROM incoming')
+
+        if before_commit is not None:
+            before_commit()
+        conn.execute('COMMIT')
+    except Exception:
+        conn.execute('ROLLBACK')
+        raise
+
+    counts = dict(conn.execute('SELECT operation, count(*) FROM changes GROUP BY operation')
+                  .fetchall())
+
+    return {operation: counts.get(operation, 0) for operation in ['insert', 'update', 'delete']}
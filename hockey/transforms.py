@@ -0,0 +1,96 @@
+"""
+Declarative description of how a source CSV is turned into the rows of a DB table, and the code
+that compiles that description into a single Polars lazy plan.
+
+Each process_* module defines a TableSpec for its table. Every step is a native Polars
+expression, so the whole transform runs in one pass without any Python callbacks.
+"""
+from dataclasses import dataclass, field
+from collections.abc import Sequence
+
+import polars as pl
+
+
+@dataclass(frozen=True)
+class TableSpec:
+    """
+    Describes the transform for one table. Steps are applied in the order of the fields below.
+
+    Every field after `renames` refers to columns by their renamed (i.e. DB) name.
+
+    :param list[str] source_columns: Columns read from the source CSV.
+    :param list[pl.Expr] filters: Row filters applied to the source columns.
+    :param dict[str, str] renames: Source column name -> DB column name.
+    :param list[str] seconds_to_minutes: Columns given in seconds, to be converted to minutes.
+    :param dict[str, pl.Expr] conversions: Other column-level conversions, e.g. date formats.
+                                           Computed alongside the unit conversions, so these
+                                           see the values as they were in the source.
+    :param dict[str, str] per_hour: Rate column -> total column, computed per 60 minutes of
+                                    iceTime (after conversion to minutes).
+    :param dict[str, tuple[str, str]] shares: Share column -> (for column, against column),
+                                              computed as a percentage rounded to 2 decimals.
+    :param dict[str, pl.Expr] derived: Any other metrics, computed after the conversions.
+    :param list[str] columns: Final columns, in the order of the DB table. If empty, all columns
+                              are kept in their current order.
+    """
+    source_columns: list[str]
+    filters: list[pl.Expr] = field(default_factory=list)
+    renames: dict[str, str] = field(default_factory=dict)
+    seconds_to_minutes: list[str] = field(default_factory=list)
+    conversions: dict[str, pl.Expr] = field(default_factory=dict)
+    per_hour: dict[str, str] = field(default_factory=dict)
+    shares: dict[str, tuple[str, str]] = field(default_factory=dict)
+    derived: dict[str, pl.Expr] = field(default_factory=dict)
+    columns: list[str] = field(default_factory=list)
+
+
+def build_plan(spec: TableSpec, source: pl.DataFrame | pl.LazyFrame,
+               predicates: Sequence[pl.Expr] = ()) -> pl.LazyFrame:
+    """
+    Compiles a TableSpec into a lazy plan over the given source data.
+
+    :param TableSpec spec: Spec for the table being built.
+    :param pl.DataFrame | pl.LazyFrame source: Raw data containing the spec's source columns.
+    :param Sequence[pl.Expr] predicates: Extra row filters on top of the spec's own, e.g. a
+                                         filter on the season being processed.
+    :return pl.LazyFrame: Plan producing the table's rows.
+    """
+    lf = source.lazy().select(spec.source_columns)
+
+    filters = [*spec.filters, *predicates]
+    if filters:
+        lf = lf.filter(pl.all_horizontal(filters))
+
+    lf = lf.rename(spec.renames)
+
+    conversions = [pl.col(column) / 60.0 for column in spec.seconds_to_minutes]
+    conversions += [expr.alias(name) for name, expr in spec.conversions.items()]
+    if conversions:
+        lf = lf.with_columns(conversions)
+
+    metrics = [(pl.col(total_col) * (60.0 / pl.col('iceTime'))).alias(rate_col)
+               for rate_col, total_col in spec.per_hour.items()]
+    metrics += [((pl.col(for_col) / (pl.col(for_col) + pl.col(against_col))) * 100)
+                .round(2).alias(share_col)
+                for share_col, (for_col, against_col) in spec.shares.items()]
+    metrics += [expr.alias(name) for name, expr in spec.derived.items()]
+    if metrics:
+        lf = lf.with_columns(metrics)
+
+    if spec.columns:
+        lf = lf.select(spec.columns)
+
+    return lf
+
+
+def transform(spec: TableSpec, source: pl.DataFrame | pl.LazyFrame,
+              predicates: Sequence[pl.Expr] = ()) -> pl.DataFrame:
+    """
+    Runs the plan for a TableSpec over the given source data.
+
+    :param TableSpec spec: Spec for the table being built.
+    :param pl.DataFrame | pl.LazyFrame source: Raw data containing the spec's source columns.
+    :param Sequence[pl.Expr] predicates: Extra row filters on top of the spec's own.
+    :return pl.DataFrame: The table's rows.
+    """
+    return build_plan(spec, source, predicates).collect()
@@ -1,19 +1,122 @@
 import os
+import re
 import glob
 from argparse import ArgumentParser
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 import duckdb
 import polars as pl
 
+import dimensions
+import player_index
+import storage
+import staged_load
+import backup_journal
+import change_log
+import metrics
+import raw_lake
+import table_sync
+import season_aggregates
+
 
 ############## Constants ################
 
-DB_NAME = 'md:'
+# Number of games processed at once in batch mode
+DEFAULT_WORKERS = 4
+
+# Filenames are in the format date_gameID_team_state_(oi/st/goalies).csv
+FILENAME_PATTERN = (r'(?P<date>\d{4}-\d{2}-\d{2})_(?P<gameID>\d+)_(?P<team>[^_/\\]+)_'
+                    r'(?P<state>[^_/\\]+)_(?:st|oi|goalies)\.csv$')
+
+# Kind of CSV that every row of each table comes from
+TABLE_FILE_KINDS = {
+    'skater_games': 'oi',
+    'goalie_games': 'goalies'
+}
+
+# Columns read from each kind of CSV, and the types they are parsed as
+INDIVIDUAL_SCHEMA = {
+    'Player': pl.String,
+    'Position': pl.String,
+    'TOI': pl.Float64,
+    'Goals': pl.Int64,
+    'First Assists': pl.Int64,
+    'Second Assists': pl.Int64,
+    'Shots': pl.Int64,
+    'ixG': pl.Float64,
+    'Total Penalties': pl.Int64,
+    'Penalties Drawn': pl.Int64,
+    'Hits': pl.Int64
+}
+ONICE_SCHEMA = {
+    'Player': pl.String,
+    'Position': pl.String,
+    'CF': pl.Int64,
+    'CA': pl.Int64,
+    'GF': pl.Int64,
+    'GA': pl.Int64,
+    'xGF': pl.Float64,
+    'xGA': pl.Float64
+}
+GOALIE_SCHEMA = {
+    'Player': pl.String,
+    'TOI': pl.Float64,
+    'Shots Against': pl.Int64,
+    'Goals Against': pl.Int64,
+    'Expected Goals Against': pl.Float64
+}
 
 ########### End Constants ###############
 
 
-def process_skater_data(path: str, game_id: int) -> pl.DataFrame:
+def scan_game_files(path: str, game_id: str, kind: str, schema: dict[str, pl.DataType],
+                    from_lake: bool = False) -> pl.LazyFrame:
+    """
+    Lazily scans every CSV of one kind for a game as a single multi-file scan. Only the columns
+    in the schema are read, with their types applied at parse time, and empty values are read as
+    nulls rather than strings.
+
+    Filenames are in the format
+        date_gameID_team_state_(oi/st/goalies).csv
+    and the team, state, game ID, date and season are all extracted from the file paths in one
+    pass, rather than file by file.
+
+    :param str path: Filepath to folder containing raw CSVs, or the raw-data lake if from_lake.
+    :param str game_id: Game ID
+    :param str kind: One of 'st', 'oi' or 'goalies'.
+    :param dict[str, pl.DataType] schema: Columns to read from each file, and their types.
+    :param bool from_lake: If True, read the game's files from the raw-data lake (see
+                           raw_lake.py), where they are stored as text with their filenames.
+    :return pl.LazyFrame: Rows of every file, with the columns taken from the file paths.
+    """
+    if from_lake:
+        lf = raw_lake.scan_game(path, game_id, kind)\
+            .with_columns(pl.col(column).cast(dtype) for column, dtype in schema.items())
+    else:
+        filenames = sorted(glob.glob(os.path.join(path, f'*{game_id}*{kind}.csv')))
+        if not filenames:
+            raise ValueError(f'No {kind} CSVs found for game {game_id} in {path}, exiting...')
+
+        lf = pl.scan_csv(filenames, infer_schema=False, schema_overrides=schema,
+                         null_values=[''], include_file_paths='file')
+
+    parts = pl.col('file').str.extract_groups(FILENAME_PATTERN)
+    date = parts.struct.field('date')
+
+    return lf.select(
+            *schema,
+            # Fix team names to match MoneyPuck, and store the team and state as enums
+            dimensions.team_code(parts.struct.field('team')).alias('team'),
+            parts.struct.field('state').cast(dimensions.SITUATION).alias('state'),
+            parts.struct.field('gameID').cast(pl.Int64).alias('gameID'),
+            date.alias('gameDate'),
+            # 'season' column will be the year the season started in.
+            (date.str.slice(0, 4).cast(pl.Int32)
+             - (date.str.slice(5, 2).cast(pl.Int32) < 9).cast(pl.Int32)).alias('season')
+        )
+
+
+def process_skater_data(path: str, game_id: str, from_lake: bool = False) -> pl.DataFrame:
     """
     Processes raw data for skaters into a single DataFrame containing all the columns
     needed to create the post-game report. For each team there will be 8 CSVs, one for
@@ -22,87 +125,26 @@ def process_skater_data(path: str, game_id: int) -> pl.DataFrame:
     Output DataFrame will have information from all 8, with each player having four rows
     for each game state that includes both the invididual and on-ice metrics.
 
-    :param str path: Filepath to folder containing raw CSVs.
+    :param str path: Filepath to folder containing raw CSVs, or the raw-data lake if from_lake.
     :param str game_id: Game ID
+    :param bool from_lake: If True, read the game from the raw-data lake.
     """
+    indiv_df = scan_game_files(path, game_id, 'st', INDIVIDUAL_SCHEMA, from_lake)\
+        .drop('gameID', 'gameDate', 'season')
 
-    final_df = pl.DataFrame()
-
-    indiv_df = pl.DataFrame()
-    for filename in glob.glob(os.path.join(path, f'*{game_id}*st.csv')):
-        # Filename will be in the format
-        #   date_gameID_team_state_(oi/st).csv
-        # We only want the team name and state from this for the dataframe,
-        # and then also get the date to use for the output filename.
-        date, _, team, state, _ = os.path.basename(filename).split('_')
-
-        # 'season' column will be the year the season started in.
-        if int(date.split('-')[1]) >= 9:
-            season = int(date.split('-')[0])
-        else:
-            season = int(date.split('-')[0]) - 1
-
-        df = pl.read_csv(filename)[['Player', 'Position', 'TOI', 'Goals', 'First Assists',
-                                    'Second Assists', 'Shots', 'ixG', 'Total Penalties',
-                                    'Penalties Drawn', 'Hits']]
-
-        df = df.with_columns(
-            pl.lit(state).alias('state'),
-            pl.lit(team).alias('team'),
-            pl.lit(game_id).alias('game_id'),
-            pl.lit(date).alias('game_date'),
-            pl.lit(season).alias('season')
-        ).cast(
-            {
-                'TOI': pl.Float64,
-                'Goals': pl.Int64,
-                'First Assists': pl.Int64,
-                'Second Assists': pl.Int64,
-                'Shots': pl.Int64,
-                'ixG': pl.Float64,
-                'Total Penalties': pl.Int64,
-                'Penalties Drawn': pl.Int64,
-                'Hits': pl.Int64
-            }
-        )
-
-        if len(indiv_df) == 0:
-            indiv_df = df
-        else:
-            indiv_df = pl.concat([indiv_df, df])
-
-    onice_df = pl.DataFrame()
-    for filename in glob.glob(os.path.join(path, f'*{game_id}*oi.csv')):
-        _, _, team, state, _ = os.path.basename(filename).split('_')
-
-        df = pl.read_csv(filename)[['Player', 'Position', 'CF', 'CA', 'GF', 'GA',
-                                    'xGF', 'xGA']]
-
-        df = df.with_columns(
-            pl.lit(state).alias('state'),
-            pl.lit(team).alias('team'),
-            ((pl.col('GF') / (pl.col('GF') + pl.col('GA'))) * 100).round(2).alias('goalsShare'),
-            ((pl.col('xGF') / (pl.col('xGF') + pl.col('xGA'))) * 100).round(2).alias('xGoalsShare'),
-            ((pl.col('CF') / (pl.col('CF') + pl.col('CA'))) * 100).round(2).alias('corsiShare'),
-        ).cast(
-            {
-                'xGF': pl.Float64,
-                'xGA': pl.Float64
-            }
-        )
-
-        if len(onice_df) == 0:
-            onice_df = df
-        else:
-            onice_df = pl.concat([onice_df, df])
+    onice_df = scan_game_files(path, game_id, 'oi', ONICE_SCHEMA, from_lake).with_columns(
+        ((pl.col('GF') / (pl.col('GF') + pl.col('GA'))) * 100).round(2).alias('goalsShare'),
+        ((pl.col('xGF') / (pl.col('xGF') + pl.col('xGA'))) * 100).round(2).alias('xGoalsShare'),
+        ((pl.col('CF') / (pl.col('CF') + pl.col('CA'))) * 100).round(2).alias('corsiShare'),
+    )
 
+    # Every player has on-ice rows, but not necessarily individual ones, so the game ID, date and
+    # season are taken from the on-ice side of the join.
     final_df = indiv_df.join(onice_df, on=['Player', 'team', 'state', 'Position'], how='right')
     final_df = final_df.rename({
         'Player': 'name',
-        'game_id': 'gameID',
-        'game_date': 'gameDate',
         'Position': 'position',
-				'state': 'situation',
+        'state': 'situation',
         'TOI': 'iceTime',
         'Goals': 'goals',
         'First Assists': 'primaryAssists',
@@ -120,26 +162,11 @@ def process_skater_data(path: str, game_id: int) -> pl.DataFrame:
         'Hits': 'hits'
     })
 
-    # Some columns (such as date and game id) will be null for certain players in certain game
-    # states, so fill those seperately before filling the remaining null/NaN values with 0s.
-    final_df = final_df.sort(by='name', descending=False)\
+    final_df = final_df.sort(by='name', descending=False).fill_nan(0).fill_null(0)\
         .with_columns(
-            pl.col('gameID').fill_null(game_id),
-            pl.col('gameDate').fill_null(date),
-            pl.col('season').fill_null(season)
-        ).fill_nan(0).fill_null(0)
-
-    # Fix issue with NST using '\xa0' instead of a space in names
-    final_df = final_df.with_columns(
-        pl.col('name').str.replace_all('\xa0', ' ', literal=True),
-    )
-
-    # Fix names to match MoneyPuck
-    for bad, good in zip(['SJ', 'LA', 'TB', 'NJ'],
-                         ['SJS', 'LAK', 'TBL', 'NJD']):
-        final_df = final_df.with_columns(
-            pl.col('team').str.replace_all(f'^{bad}$', good)
-        )
+            # Fix issue with NST using '\xa0' instead of a space in names
+            pl.col('name').str.replace_all('\xa0', ' ', literal=True),
+        ).collect()
 
     # Check for and handle an error with the data source where xG values are all given as 0
     col_sum = final_df['individualxGoals'].sum()
@@ -152,88 +179,31 @@ def process_skater_data(path: str, game_id: int) -> pl.DataFrame:
                      'xGoalsShare', 'corsiFor', 'corsiAgainst', 'corsiShare', 'penaltiesTaken',
                      'penaltiesDrawn', 'hits']]
 
-def process_goalie_data(path, game_id):
+def process_goalie_data(path, game_id, from_lake=False):
     """
     Raw goalie data is provided as one CSV for each game state, per team. Combines all 8
     into one DataFrame and return it.
 
-    :param str path: Filepath to folder containing raw CSVs.
+    :param str path: Filepath to folder containing raw CSVs, or the raw-data lake if from_lake.
     :param str game_id: Game ID
+    :param bool from_lake: If True, read the game from the raw-data lake.
     """
-
-    goalie_df = pl.DataFrame()
-    for filename in glob.glob(os.path.join(path, f'*{game_id}*goalies.csv')):
-        date, _, team, state, _ = os.path.basename(filename).split('_')
-
-        # 'season' column will be the year the season started in.
-        if int(date.split('-')[1]) >= 9:
-            season = int(date.split('-')[0])
-        else:
-            season = int(date.split('-')[0]) - 1
-
-        df = pl.read_csv(filename)[['Player', 'TOI', 'Shots Against', 'Goals Against',
-                                    'Expected Goals Against']]
-        df = df.with_columns(
-            pl.lit(team).alias('team'),
-            pl.lit(state).alias('state'),
-            pl.lit(game_id).alias('game_id'),
-            pl.lit(date).alias('game_date'),
-            pl.lit(season).alias('season'),
-        )
-
-        # Sometimes columns that are supposed to be numerical will have an empty string value,
-        # so replace those with 0s
-        for column in ['Shots Against', 'Goals Against', 'Expected Goals Against']:
-            if df[column].dtype == pl.String:
-                df = df.with_columns(
-                    pl.col(column).replace("", "0")
-                )
-
-        df = df.cast(
-            {
-                'TOI': pl.Float64,
-                'Shots Against': pl.Int64,
-                'Goals Against': pl.Int64,
-                'Expected Goals Against': pl.Float64,
-            }
-        )
-
-        if len(goalie_df) == 0:
-            goalie_df = df
-        else:
-            goalie_df = pl.concat([goalie_df, df])
-
-    goalie_df = goalie_df.rename({
+    # Sometimes columns that are supposed to be numerical will have an empty string value, which
+    # are read as nulls and filled with 0s
+    goalie_df = scan_game_files(path, game_id, 'goalies', GOALIE_SCHEMA, from_lake).rename({
         'Player': 'name',
         'TOI': 'iceTime',
-				'state': 'situation',
+        'state': 'situation',
         'Shots Against': 'shotsAgainst',
         'Goals Against': 'goalsAgainst',
         'Expected Goals Against': 'xGoalsAgainst',
-        'game_id': 'gameID',
-        'game_date': 'gameDate',
     })
 
-    # Some columns (such as date and game id) will be null for certain players in certain game 
-    # states, so fill those seperately before filling the remaining null/NaN values with 0s.
-    goalie_df = goalie_df.sort(by='name', descending=False)\
+    goalie_df = goalie_df.sort(by='name', descending=False).fill_nan(0).fill_null(0)\
         .with_columns(
-            pl.col('gameID').fill_null(game_id),
-            pl.col('gameDate').fill_null(date),
-            pl.col('season').fill_null(season)
-        ).fill_nan(0).fill_null(0)
-
-    # Fix issue with NST using '\xa0' instead of a space in names
-    goalie_df = goalie_df.with_columns(
-        pl.col('name').str.replace_all('\xa0', ' ', literal=True),
-    )
-
-    # Fix names to match MoneyPuck
-    for bad, good in zip(['SJ', 'LA', 'TB', 'NJ'],
-                         ['SJS', 'LAK', 'TBL', 'NJD']):
-        goalie_df = goalie_df.with_columns(
-            pl.col('team').str.replace_all(f'^{bad}$', good)
-        )
+            # Fix issue with NST using '\xa0' instead of a space in names
+            pl.col('name').str.replace_all('\xa0', ' ', literal=True),
+        ).collect()
 
     # Check for and handle an error with the data source where xG values are all given as 0
     col_sum = goalie_df['xGoalsAgainst'].sum()
@@ -245,26 +215,250 @@ def process_goalie_data(path, game_id):
                       'shotsAgainst', 'goalsAgainst', 'xGoalsAgainst']]
 
 
-def main(path, game_id):
+def discover_game_ids(path: str, from_lake: bool = False) -> list[str]:
     """
-    Opens the CSV files containing raw game data from NaturalStatTrick, combines into two 
-    dataframes (one for skaters, one for goalies), and saves them to CSVs to be used
-    for plotting.
-    :param str path: Path to directory containing raw CSV files.
-    :param str game_id: ID for game that will be processed.
+    Finds every game with a set of CSVs in the given folder. Filenames are in the format
+        date_gameID_team_state_(oi/st/goalies).csv
+
+    :param str path: Filepath to folder containing raw CSVs, or the raw-data lake if from_lake.
+    :param bool from_lake: If True, find every game stored in the raw-data lake instead.
+    :return list[str]: IDs of every game found, in order.
     """
-    print("Processing raw skater and goalie data...")
-    skater_df = process_skater_data(path, game_id)
-    goalie_df = process_goalie_data(path, game_id)
+    if from_lake:
+        return raw_lake.game_ids(path)
+
+    return sorted({os.path.basename(filename).split('_')[1]
+                   for filename in glob.glob(os.path.join(path, '*_*_*_*_st.csv'))})
 
-    print('Connecting to database...')
-    conn = duckdb.connect(database=DB_NAME, read_only=False)
 
-    print("Updating skater table...")
-    conn.execute("INSERT INTO skater_games SELECT * FROM skater_df")
+def loaded_game_ids(conn: duckdb.DuckDBPyConnection, path: str, game_ids: list[str],
+                    from_lake: bool = False) -> set[str]:
+    """
+    Finds which of the games are already fully loaded, without parsing any of their CSVs. A game
+    is fully loaded if, in both game tables, it has rows for every team and situation that there
+    is a CSV for.
+
+    :param duckdb.DuckDBPyConnection conn: Connection to the database.
+    :param str path: Filepath to folder containing raw CSVs, or the raw-data lake if from_lake.
+    :param list[str] game_ids: IDs of the games to check.
+    :param bool from_lake: If True, check against the CSVs stored in the raw-data lake.
+    :return set[str]: IDs of the games that are already loaded.
+    """
+    loaded = set(game_ids)
+    for table_name, kind in TABLE_FILE_KINDS.items():
+        expected = {}
+        filenames = raw_lake.game_files(path, kind, list(loaded)) if from_lake \
+            else glob.glob(os.path.join(path, f'*_*_*_*_{kind}.csv'))
+        for filename in filenames:
+            match = re.search(FILENAME_PATTERN, os.path.basename(filename))
+            if match is not None and match['gameID'] in loaded:
+                team = dimensions.NST_TEAM_CODES.get(match['team'], match['team'])
+                expected.setdefault(match['gameID'], set()).add((team, match['state']))
+
+        stored = {}
+        for game_id, team, situation in conn.execute(f"""
+            SELECT DISTINCT gameID, team, situation FROM {table_name}
+            WHERE gameID IN (SELECT unnest(?::INT[]))
+        """, [[int(game_id) for game_id in loaded]]).fetchall():
+            stored.setdefault(str(game_id), set()).add((team, situation))
+
+        loaded = {game_id for game_id in loaded
+                  if game_id in expected and stored.get(game_id) == expected[game_id]}
+
+    return loaded
+
+
+def process_game(path: str, game_id: str,
+                 from_lake: bool = False) -> tuple[pl.DataFrame, pl.DataFrame]:
+    """
+    :param str path: Filepath to folder containing raw CSVs, or the raw-data lake if from_lake.
+    :param str game_id: Game ID
+    :param bool from_lake: If True, read the game from the raw-data lake.
+    :return tuple[pl.DataFrame, pl.DataFrame]: Skater and goalie data for the game.
+    """
+    return process_skater_data(path, game_id, from_lake), \
+        process_goalie_data(path, game_id, from_lake)
+
 
-    print("Updating goalie table...")
-    conn.execute("INSERT INTO goalie_games SELECT * FROM goalie_df")
+def process_games(path: str, game_ids: list[str], workers: int = DEFAULT_WORKERS,
+                  index_path: str = player_index.DEFAULT_INDEX_PATH, from_lake: bool = False) \
+        -> tuple[pl.DataFrame, pl.DataFrame]:
+    """
+    Processes a batch of games in parallel, and combines them into one skater and one goalie
+    DataFrame, so that each table can be written with a single insert.
+
+    Every row is then given its player's MoneyPuck playerID (as the last column), from the player
+    identity index. The index is first brought up to date for the seasons in the batch, and is
+    matched against the whole batch at once.
+
+    A game that fails to process (e.g. because of the all-zero xG issue with the data source) is
+    reported and left out of the batch, rather than failing every other game with it.
+
+    :param str path: Filepath to folder containing raw CSVs.
+    :param list[str] game_ids: IDs of the games to process.
+    :param int workers: Number of games processed at once.
+    :param str index_path: Location of the player identity index.
+    :param bool from_lake: If True, read the games from the raw-data lake at path.
+    :raises ValueError: If none of the games could be processed.
+    :return tuple[pl.DataFrame, pl.DataFrame]: Skater and goalie data for every game.
+    """
+    skater_dfs, goalie_dfs, failed = [], [], []
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(process_game, path, game_id, from_lake): game_id
+                   for game_id in game_ids}
+        for future in as_completed(futures):
+            try:
+                skater_df, goalie_df = future.result()
+            except Exception as e:
+                if len(game_ids) == 1:
+                    raise
+                print(f'Failed to process game {futures[future]}: {e}')
+                failed.append(futures[future])
+                continue
+
+            skater_dfs.append(skater_df)
+            goalie_dfs.append(goalie_df)
+
+    if not skater_dfs:
+        raise ValueError('None of the games could be processed, exiting...')
+
+    if failed:
+        print(f"Skipping {len(failed)} game(s) that failed to process: {', '.join(sorted(failed))}")
+
+    skater_df = pl.concat(skater_dfs).sort(['gameID', 'name'])
+    goalie_df = pl.concat(goalie_dfs).sort(['gameID', 'name'])
+
+    print('Assigning playerIDs...')
+    with metrics.span('player_index'):
+        index = player_index.update_index(skater_df['season'].unique().to_list(), index_path)
+        skater_df = player_index.assign_player_ids(skater_df, index)
+        goalie_df = player_index.assign_player_ids(goalie_df, index, goalies=True)
+
+    return skater_df, goalie_df
+
+
+def main(path, game_ids=None, staged=False, journal=False, workers=DEFAULT_WORKERS,
+         force=False, lake_dir=None, from_lake=False):
+    """
+    Opens the CSV files containing raw game data from NaturalStatTrick, combines into two 
+    dataframes (one for skaters, one for goalies), and writes them to the game tables.
+
+    Any number of games can be processed in one run, in which case every game's rows are
+    written to each table in one bulk write. Every game in the batch is replaced as a whole, so
+    loading a game again never duplicates it, and rows dropped from a corrected game are removed.
+    Games that are already fully loaded are skipped before any of their CSVs are parsed. The keys
+    of the rows written are added to the change log (see change_log.py).
+
+    :param str path: Path to directory containing raw CSV files.
+    :param list[str] game_ids: IDs for games that will be processed. If not provided, every game
+                               with CSVs in the directory is processed.
+    :param bool staged: If True, stage both tables first and publish them together in one
+                        transaction, instead of writing to each table separately.
+    :param bool journal: If True, record the rows written in the backup journal, so the tables can
+                         be rolled back without a full backup before every run.
+    :param int workers: Number of games processed at once.
+    :param bool force: If True, process and write games even if they are already loaded.
+    :param str lake_dir: If provided, store every game's CSVs in this raw-data lake (see
+                         raw_lake.py), or read them from it if from_lake is set.
+    :param bool from_lake: If True, process the games stored in the lake instead of the CSVs in
+                           the path, e.g. to rebuild the tables after a change to the processing.
+    """
+    if from_lake:
+        path = lake_dir or raw_lake.DEFAULT_LAKE_DIR
+
+    if not game_ids:
+        game_ids = discover_game_ids(path, from_lake)
+        if not game_ids:
+            raise ValueError(f'No game CSVs found in {path}, exiting...')
+
+    conn = storage.get_connection()
+
+    with metrics.span('update_player_game_tables', staged=staged, from_lake=from_lake):
+        if lake_dir is not None and not from_lake:
+            # Every game is stored, loaded or not, so the lake keeps the latest version of each
+            print(f"Storing raw data for {len(game_ids)} game(s) in {lake_dir}...")
+            with metrics.span('lake') as span:
+                span.rows_out = sum(raw_lake.store_game(lake_dir, path, game_id)
+                                    for game_id in game_ids)
+
+        if not force:
+            loaded = loaded_game_ids(conn, path, game_ids, from_lake)
+            if loaded:
+                print(f"Skipping {len(loaded)} game(s) that are already loaded: "
+                      f"{', '.join(sorted(loaded))}")
+            game_ids = [game_id for game_id in game_ids if game_id not in loaded]
+            if not game_ids:
+                print('Nothing to update!')
+                return
+
+        print(f"Processing raw skater and goalie data for {len(game_ids)} game(s)...")
+        with metrics.span('process') as span:
+            skater_df, goalie_df = process_games(path, game_ids, workers, from_lake=from_lake)
+            span.rows_out = len(skater_df) + len(goalie_df)
+
+        journal_ids = []
+        if journal:
+            print("Recording batch in backup journal...")
+            journal_ids = [backup_journal.record_batch(conn, 'skater_games', skater_df),
+                           backup_journal.record_batch(conn, 'goalie_games', goalie_df)]
+
+        frames = {'skater_games': skater_df, 'goalie_games': goalie_df}
+
+        def after_write(*table_names: str,
+                        captured: dict[str, pl.DataFrame] | None = None) -> None:
+            # Run inside the write's transaction, so the change log and totals are committed
+            # along with it
+            for table_name in table_names:
+                change_log.record(conn, table_name,
+                                  captured[table_name] if captured is not None else None)
+
+                totals_table = season_aggregates.TOTALS_TABLES[table_name]
+                print(f"Updating {totals_table} table...")
+                with metrics.span('totals', table=totals_table) as span:
+                    span.rows_in = len(frames[table_name])
+                    span.rows_out = season_aggregates.apply(conn, table_name, frames[table_name],
+                                                            replaced[table_name])
+                print(f"{span.rows_out} rows updated")
+
+        try:
+            # Sum the rows the batch replaces before writing, to take them out of the totals after
+            replaced = {table_name: season_aggregates.capture(conn, table_name, df)
+                        for table_name, df in frames.items()}
+
+            # Every game in the batch is replaced as a whole
+            batch = ', '.join(str(game_id) for game_id in skater_df['gameID'].unique())
+            scope = f'gameID IN ({batch})'
+
+            if staged:
+                print("Staging and publishing skater and goalie tables...")
+                with metrics.span('publish') as span:
+                    span.rows_in = span.rows_out = len(skater_df) + len(goalie_df)
+                    captured = {table_name: change_log.capture(conn, table_name, df, scope)
+                                for table_name, df in frames.items()}
+                    staged_load.staged_load(conn, frames,
+                                            scopes={'skater_games': scope, 'goalie_games': scope},
+                                            before_commit=lambda: after_write(
+                                                *frames, captured=captured))
+            else:
+                for table_name, df in frames.items():
+                    print(f"Updating {table_name} table...")
+                    with metrics.span('write', table=table_name) as span:
+                        span.rows_in = len(df)
+                        counts = table_sync.upsert(
+                            conn, df, table_name, scope,
+                            before_commit=lambda: after_write(table_name))
+                        span.rows_out = sum(counts.values())
+                    print(f"{counts['insert']} rows inserted, {counts['update']} updated, "
+                          f"{counts['delete']} deleted")
+        except Exception:
+            # The batch never made it into the tables, so there is nothing to undo
+            for journal_id in journal_ids:
+                backup_journal.discard(conn, journal_id)
+            raise
+
+        change_log.export(conn)
+        with metrics.span('persist'):
+            storage.persist()
 
     print('Database update complete!')
 
@@ -273,8 +467,25 @@ if __name__ == '__main__':
     parser = ArgumentParser()
     parser.add_argument('-p', '--path', default=os.path.join(os.getcwd(), 'data'),
                         help='Path to folder containing CSV data.')
-    parser.add_argument('-g', '--game_id', required=True,
-                        help='Game ID for which tables should be processed.')
+    parser.add_argument('-g', '--game_id', nargs='*', default=None,
+                        help='Game ID(s) for which tables should be processed. If not given, '
+                             'every game with CSVs in the path is processed.')
+    parser.add_argument('--staged', action='store_true', default=False,
+                        help='Stage both tables and publish them together in one transaction.')
+    parser.add_argument('--journal', action='store_true', default=False,
+                        help='Record the rows written in the backup journal.')
+    parser.add_argument('-w', '--workers', type=int, default=DEFAULT_WORKERS,
+                        help='Number of games processed at once.')
+    parser.add_argument('--force', action='store_true', default=False,
+                        help='Process and write games even if they are already fully loaded.')
+    parser.add_argument('--lake-dir', type=str, default=None,
+                        help="Raw-data lake to store every game's CSVs in, or to read from with "
+                             f'--from-lake (defaults to {raw_lake.DEFAULT_LAKE_DIR} then).')
+    parser.add_argument('--from-lake', action='store_true', default=False,
+                        help='Process the games stored in the raw-data lake instead of the CSVs '
+                             'in the path.')
     args = parser.parse_args()
 
-    main(path=args.path, game_id=args.game_id)
+    main(path=args.path, game_ids=args.game_id, staged=args.staged, journal=args.journal,
+         workers=args.workers, force=args.force, lake_dir=args.lake_dir,
+         from_lake=args.from_lake)
@@ -1,53 +1,406 @@
 from datetime import datetime
 from argparse import ArgumentParser
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait, FIRST_COMPLETED
 
 import duckdb
+import polars as pl
+import requests
 
+import change_log
+import download
+import metrics
 import process_skater_data
 import process_goalie_data
 import process_team_data
 import process_game_data
+import raw_lake
+import storage
+import table_sync
+import staged_load
+import rolling_tables
+import transforms
+from response_cache import ResponseCache
 
 
 ############## Constants ################
 
-#DB_NAME = 'hockey-stats.db'
-DB_NAME = 'md:'
+# Maps each table in the DB to the module used to gather its data
+SOURCES = {
+    'skaters': process_skater_data,
+    'goalies': process_goalie_data,
+    'teams': process_team_data,
+    'team_games': process_game_data
+}
+
+# Maps each table to the source file it's stored under in the raw-data lake
+LAKE_SOURCES = {
+    'skaters': 'skaters',
+    'goalies': 'goalies',
+    'teams': 'teams',
+    'team_games': 'all_teams'
+}
+
+# Ways of writing a season's data to a table:
+#   diff: only write rows that were inserted, changed or deleted (see table_sync.py)
+#   replace: delete the whole season and insert it again
+#   staged: stage every table first, then replace the season in all of them in one transaction
+#           (see staged_load.py)
+WRITE_MODES = ['diff', 'replace', 'staged']
+
+# Number of source files downloaded and transformed at once during a backfill
+DEFAULT_BACKFILL_WORKERS = 4
 
 ########### End Constants ###############
 
 
-def main(season: int) -> None:
+def gather_from_lake(table_name: str, season: int,
+                     lake_dir: str = raw_lake.DEFAULT_LAKE_DIR) -> pl.DataFrame:
     """
-    This script is designed to be run every morning within a GitHub Actions workflow. 
-    
-    It works by pulling CSV data from MoneyPuck into dataframes and then using those to
-    update tables in the DuckDB database, which is stored as a GitHub Artifact.
+    Builds a table's data for a season from the raw-data lake instead of downloading it, e.g. to
+    rebuild the tables after a change to their transforms.
+
+    :param str table_name: Table being updated.
+    :param int season: Season being updated.
+    :param str lake_dir: Root directory of the lake.
+    :raises ValueError: If the season isn't stored in the lake.
+    :return pl.DataFrame: Processed data for the season.
+    """
+    module = SOURCES[table_name]
+    with metrics.span('gather_df', table=table_name, season=season, source='lake') as span:
+        with metrics.span('parse'):
+            df = raw_lake.read_source(lake_dir, LAKE_SOURCES[table_name], season,
+                                      module.USED_COLUMNS)
+        span.rows_in = len(df)
+
+        with metrics.span('transform'):
+            df = transforms.transform(module.SPEC, df)
+        span.rows_out = len(df)
+
+    return df
+
+
+def gather(table_name: str, season: int, session: requests.Session | None = None,
+           cache: ResponseCache | None = None, lake_dir: str | None = None,
+           from_lake: bool = False) -> pl.DataFrame:
+    """
+    :param str table_name: Table being updated.
+    :param int season: Season being updated.
+    :param requests.Session session: Optional pooled session to download with.
+    :param ResponseCache cache: Optional response cache to make the download conditional on.
+    :param str lake_dir: Raw-data lake to store the download in, or to read from.
+    :param bool from_lake: If True, read the data from the lake rather than downloading it.
+    :raises download.NotModified: If a cache was given and the source file is unchanged.
+    :return pl.DataFrame: Processed data for the season.
+    """
+    if from_lake:
+        return gather_from_lake(table_name, season, lake_dir or raw_lake.DEFAULT_LAKE_DIR)
+
+    return SOURCES[table_name].gather_df(season, session, cache, lake_dir=lake_dir)
+
+
+def write_table(conn: duckdb.DuckDBPyConnection, df: pl.DataFrame, table_name: str,
+                season: int, cache: ResponseCache | None = None, write_mode: str = 'diff') -> None:
+    """
+    Makes the rows for the given season in a table match the contents of the DataFrame, and adds
+    the rows it touched to the change log. For team_games, the rolling table is brought up to date
+    too. Both are done in the write's transaction, so they are never left behind by a write that
+    went through.
+
+    If a response cache is in use, the validators for the table's source file are committed once
+    the write has gone through, so the next run can skip the file if it's unchanged.
+
+    :param duckdb.DuckDBPyConnection conn: Connection to the database.
+    :param pl.DataFrame df: Processed data for the season.
+    :param str table_name: Table being updated.
+    :param int season: Season being updated.
+    :param ResponseCache cache: Optional response cache used to download the data.
+    :param str write_mode: One of WRITE_MODES.
+    """
+    captured = None
+
+    def after_write() -> None:
+        # Run inside the write's transaction, so that everything is committed along with it
+        change_log.record(conn, table_name, captured)
+
+        if table_name == rolling_tables.SOURCE_TABLE:
+            # Only the games the diff touched need their windows recomputed
+            game_ids = None
+            if write_mode == 'diff':
+                game_ids = [row[0] for row in
+                            conn.execute('SELECT DISTINCT gameID FROM changes').fetchall()]
+            update_rolling(conn, season, game_ids)
+
+    print(f"Updating {table_name} table...")
+    with metrics.span('write', table=table_name, write_mode=write_mode) as span:
+        span.rows_in = len(df)
+        if write_mode == 'diff':
+            counts = table_sync.sync_season(conn, df, table_name, season,
+                                            before_commit=after_write)
+            print(f"{counts['insert']} rows inserted, {counts['update']} updated, "
+                  f"{counts['delete']} deleted")
+            span.rows_out = sum(counts.values())
+        else:
+            captured = change_log.capture(conn, table_name, df, f'season = {season}')
+            conn.execute('BEGIN TRANSACTION')
+            try:
+                conn.execute(f'DELETE FROM {table_name} WHERE season = {season}')
+                conn.execute(f'INSERT INTO {table_name} BY NAME SELECT * FROM df;')
+                after_write()
+                conn.execute('COMMIT')
+            except Exception:
+                conn.execute('ROLLBACK')
+                raise
+            span.rows_out = len(df)
+
+    if cache is not None:
+        cache.commit(SOURCES[table_name].DATA_URL.format(season))
+
+
+def update_rolling(conn: duckdb.DuckDBPyConnection, season: int,
+                   game_ids: list[int] | None = None) -> None:
+    """
+    Brings the rolling team table up to date after team_games has been written. Must be called
+    inside the transaction of the write.
+
+    :param duckdb.DuckDBPyConnection conn: Connection to the database.
+    :param int season: Season that was written.
+    :param list[int] game_ids: IDs of the games that changed, or None if the whole season was
+                               replaced.
+    """
+    print(f"Updating {rolling_tables.ROLLING_TABLE} table...")
+    with metrics.span('rolling', table=rolling_tables.ROLLING_TABLE) as span:
+        rows = rolling_tables.update_rolling(conn, season, game_ids)
+        span.rows_out = rows
+    print(f"{rows} rows recomputed")
+
+
+def publish_tables(conn: duckdb.DuckDBPyConnection, frames: dict[str, pl.DataFrame], season: int,
+                   cache: ResponseCache | None = None) -> None:
+    """
+    Loads the season's data for every table through staging tables, and publishes all of them
+    together in one transaction.
+
+    :param duckdb.DuckDBPyConnection conn: Connection to the database.
+    :param dict[str, pl.DataFrame] frames: Table name -> processed data for the season.
+    :param int season: Season being updated.
+    :param ResponseCache cache: Optional response cache used to download the data.
+    """
+    if not frames:
+        return
+
+    print(f"Staging and publishing {', '.join(frames)} tables...")
+    scopes = {table_name: f'season = {season}' for table_name in frames}
+    with metrics.span('publish') as span:
+        span.rows_in = sum(len(df) for df in frames.values())
+        captured = {table_name: change_log.capture(conn, table_name, df, scopes[table_name])
+                    for table_name, df in frames.items()}
+
+        def after_publish() -> None:
+            # Run inside the publishing transaction, so that everything is committed along with it
+            for table_name in frames:
+                change_log.record(conn, table_name, captured[table_name])
+            if rolling_tables.SOURCE_TABLE in frames:
+                update_rolling(conn, season)
+
+        staged_load.staged_load(conn, frames, scopes=scopes, before_commit=after_publish)
+        span.rows_out = span.rows_in
+
+    if cache is not None:
+        for table_name in frames:
+            cache.commit(SOURCES[table_name].DATA_URL.format(season))
+
+
+def run_pipelined(season: int, cache: ResponseCache | None = None, write_mode: str = 'diff',
+                  lake_dir: str | None = None, from_lake: bool = False) -> None:
+    """
+    Runs all downloads concurrently over one pooled HTTP session, and writes each table as soon
+    as its DataFrame is ready, rather than waiting for every download to finish first.
+
+    Writes are all done from this thread, since the DB connection is not shared between threads.
+    In the 'staged' write mode, the tables are instead all published together once every download
+    has finished.
 
     :param int season: NHL season for which to pull data
+    :param ResponseCache cache: Optional response cache to make the downloads conditional on.
+    :param str write_mode: One of WRITE_MODES.
+    :param str lake_dir: Raw-data lake to store the downloads in, or to read from.
+    :param bool from_lake: If True, read every table's data from the lake rather than downloading.
+    """
+    with download.create_session(pool_size=len(SOURCES)) as session, \
+            ThreadPoolExecutor(max_workers=len(SOURCES)) as pool:
+
+        print('Gathering data for all tables...')
+        futures = {pool.submit(metrics.propagate(gather), table_name, season, session, cache,
+                               lake_dir, from_lake): table_name for table_name in SOURCES}
+
+        # Connect while the downloads are in flight
+        conn = storage.get_connection()
+
+        frames = {}
+        for future in as_completed(futures):
+            try:
+                df = future.result()
+            except download.NotModified:
+                print(f"Source for {futures[future]} table is unchanged, skipping...")
+                continue
+
+            if write_mode == 'staged':
+                frames[futures[future]] = df
+            else:
+                write_table(conn, df, futures[future], season, cache, write_mode)
+
+        publish_tables(conn, frames, season, cache)
+
+
+def backfill(first_season: int, last_season: int, tables: list[str] | None = None,
+             workers: int = DEFAULT_BACKFILL_WORKERS, write_mode: str = 'diff',
+             lake_dir: str | None = None, from_lake: bool = False) -> None:
     """
+    Rebuilds a range of seasons in the tables, e.g. after a schema change.
+
+    Each season's source file is downloaded and transformed by a pool of workers sharing one
+    pooled HTTP session, and written as soon as it's ready, one season of one table at a time.
+    Only a few files are queued ahead of the workers, so memory is bounded by the number of
+    workers rather than by the length of the range. team_games comes from the all_teams CSV,
+    which holds every season, so it is downloaded once for the whole range. Reading from the
+    raw-data lake, each season of team_games is read on its own like the other tables.
+
+    In the 'staged' write mode, each season is published in every table together once all of its
+    tables are ready.
+
+    :param int first_season: First season to rebuild.
+    :param int last_season: Last season to rebuild, inclusive.
+    :param list[str] tables: Tables to rebuild, defaults to every table in SOURCES.
+    :param int workers: Number of source files downloaded and transformed at once.
+    :param str write_mode: One of WRITE_MODES.
+    :param str lake_dir: Raw-data lake to store the downloads in, or to read from.
+    :param bool from_lake: If True, read every season from the lake rather than downloading it.
+    :raises ValueError: If the range is empty, a table is unknown, or reading from the lake and a
+                        season isn't stored in it.
+    """
+    tables = tables if tables is not None else list(SOURCES)
+    unknown = [table_name for table_name in tables if table_name not in SOURCES]
+    if unknown:
+        raise ValueError(f"Unknown table(s) {', '.join(unknown)}, must be in "
+                         f"{', '.join(SOURCES)}, exiting...")
+    if first_season > last_season:
+        raise ValueError(f'Backfill range {first_season}-{last_season} is empty, exiting...')
+
+    seasons = list(range(first_season, last_season + 1))
+    season_tables = [table_name for table_name in tables
+                     if table_name != 'team_games' or from_lake]
 
-    print('Gathering skater data...')
-    skater_df = process_skater_data.gather_df(season)
+    conn = storage.get_connection()
+    # Future of the team_games rows for every season, if team_games is being rebuilt
+    team_games = None
+    # Frames of each season waiting for the rest of its tables, in the staged write mode
+    pending = {}
 
-    print('Gathering goalie data...')
-    goalie_df = process_goalie_data.gather_df(season)
+    def store(table_name: str, season: int, df: pl.DataFrame) -> None:
+        if write_mode != 'staged':
+            write_table(conn, df, table_name, season, write_mode=write_mode)
+            return
 
-    print('Gathering team data...')
-    team_df = process_team_data.gather_df(season)
+        frames = pending.setdefault(season, {})
+        frames[table_name] = df
+        if len(frames) == len(season_tables):
+            if team_games is not None and season in team_games.result():
+                frames['team_games'] = team_games.result()[season]
+            publish_tables(conn, pending.pop(season), season)
+
+    with metrics.span('backfill', first_season=first_season, last_season=last_season,
+                      write_mode=write_mode), \
+            download.create_session(pool_size=workers) as session, \
+            ThreadPoolExecutor(max_workers=workers) as pool:
+
+        print(f"Backfilling {', '.join(tables)} for seasons {first_season}-{last_season}...")
+        if 'team_games' in tables and not from_lake:
+            team_games = pool.submit(metrics.propagate(process_game_data.gather_seasons),
+                                     seasons, session, lake_dir)
+
+        # Season by season, so that every table of a season finishes close together
+        tasks = iter([(table_name, season) for season in seasons for table_name in season_tables])
+        futures = {}
+
+        def submit_next() -> None:
+            task = next(tasks, None)
+            if task is not None:
+                table_name, season = task
+                futures[pool.submit(metrics.propagate(gather), table_name, season, session,
+                                    lake_dir=lake_dir, from_lake=from_lake)] = task
+
+        for _ in range(2 * workers):
+            submit_next()
+
+        while futures:
+            done, _ = wait(futures, return_when=FIRST_COMPLETED)
+            for future in done:
+                table_name, season = futures.pop(future)
+                submit_next()
+                store(table_name, season, future.result())
+
+        # In the staged write mode, team_games is published along with each season's other tables
+        if team_games is not None and not (write_mode == 'staged' and season_tables):
+            for season, df in team_games.result().items():
+                if write_mode == 'staged':
+                    publish_tables(conn, {'team_games': df}, season)
+                else:
+                    write_table(conn, df, 'team_games', season, write_mode=write_mode)
+
+        change_log.export(conn)
+        with metrics.span('persist'):
+            storage.persist()
+
+    print('Backfill complete!')
+
+
+def main(season: int, pipelined: bool = False, cache_dir: str | None = None,
+         write_mode: str = 'diff', lake_dir: str | None = None, from_lake: bool = False) -> None:
+    """
+    This script is designed to be run every morning within a GitHub Actions workflow.
+
+    It works by pulling CSV data from MoneyPuck into dataframes and then using those to
+    update tables in the DuckDB database, which is stored as a GitHub Artifact.
+
+    :param int season: NHL season for which to pull data
+    :param bool pipelined: If True, download all tables concurrently and write each one as soon
+                           as it is ready. Otherwise, gather each table in turn before writing.
+    :param str cache_dir: If provided, keep a response cache in this directory and skip any table
+                          whose source file hasn't changed since the last successful run.
+    :param str write_mode: One of WRITE_MODES, how each table is brought up to date.
+    :param str lake_dir: If provided, store every downloaded file in this raw-data lake (see
+                         raw_lake.py), or read from it if from_lake is set.
+    :param bool from_lake: If True, rebuild the tables from the files stored in the lake instead of
+                           downloading them. The response cache isn't used then.
+    """
+    # Nothing is downloaded from the lake, so there are no validators to check or commit
+    cache = ResponseCache(cache_dir) if cache_dir is not None and not from_lake else None
 
-    print('Gathering game-by-game team data...')
-    team_games_df = process_game_data.gather_df(season)
+    with metrics.span('update_tables', season=season, write_mode=write_mode,
+                      pipelined=pipelined, from_lake=from_lake):
+        if pipelined:
+            run_pipelined(season, cache, write_mode, lake_dir, from_lake)
+        else:
+            frames = {}
+            for table_name in SOURCES:
+                print(f'Gathering {table_name} data...')
+                try:
+                    frames[table_name] = gather(table_name, season, cache=cache,
+                                                lake_dir=lake_dir, from_lake=from_lake)
+                except download.NotModified:
+                    print(f"Source for {table_name} table is unchanged, skipping...")
 
-    print('Connecting to database...')
-    conn = duckdb.connect(database=DB_NAME, read_only=False)
+            conn = storage.get_connection()
 
-    for df, table_name in zip([skater_df, goalie_df, team_df, team_games_df],
-                              ['skaters', 'goalies', 'teams', 'team_games']):
+            if write_mode == 'staged':
+                publish_tables(conn, frames, season, cache)
+            else:
+                for table_name, df in frames.items():
+                    write_table(conn, df, table_name, season, cache, write_mode)
 
-        print(f"Updating {table_name} table...")
-        conn.execute(f'DELETE FROM {table_name} WHERE season = {season}')
-        conn.execute(f'INSERT INTO {table_name} SELECT * FROM df;')
+        change_log.export(storage.get_connection())
+        with metrics.span('persist'):
+            storage.persist()
 
     print('Database update complete!')
 
@@ -58,6 +411,36 @@ if __name__ == '__main__':
                         default=datetime.now().year - 1 if datetime.now().month < 10 \
                                 else datetime.now().year,
                         help='Season for which we pull data')
+    parser.add_argument('--backfill', type=int, nargs=2, default=None,
+                        metavar=('FIRST_SEASON', 'LAST_SEASON'),
+                        help='Rebuild every season in this range (inclusive) instead of a single '
+                             'season.')
+    parser.add_argument('-t', '--tables', type=str, nargs='+', default=None,
+                        help='Tables to rebuild in a backfill, defaults to all of them.')
+    parser.add_argument('--workers', type=int, default=DEFAULT_BACKFILL_WORKERS,
+                        help='Number of source files downloaded and transformed at once in a '
+                             'backfill.')
+    parser.add_argument('--pipelined', action='store_true', default=False,
+                        help='Download all tables concurrently and write each one as soon as '
+                             'its data is ready.')
+    parser.add_argument('--cache-dir', type=str, default=None,
+                        help='Directory for a response cache. If given, tables whose source file '
+                             'has not changed since the last run are skipped.')
+    parser.add_argument('--write-mode', choices=WRITE_MODES, default='diff',
+                        help="How each table is updated: 'diff' writes only the rows that "
+                             "changed, 'replace' deletes and re-inserts the whole season, "
+                             "'staged' replaces the season in every table in one transaction.")
+    parser.add_argument('--lake-dir', type=str, default=None,
+                        help='Raw-data lake to store every downloaded file in, or to read from '
+                             f'with --from-lake (defaults to {raw_lake.DEFAULT_LAKE_DIR} then).')
+    parser.add_argument('--from-lake', action='store_true', default=False,
+                        help='Rebuild the tables from the files stored in the raw-data lake '
+                             'instead of downloading them.')
     args = parser.parse_args()
 
-    main(season=args.season)
+    if args.backfill is not None:
+        backfill(*args.backfill, tables=args.tables, workers=args.workers,
+                 write_mode=args.write_mode, lake_dir=args.lake_dir, from_lake=args.from_lake)
+    else:
+        main(season=args.season, pipelined=args.pipelined, cache_dir=args.cache_dir,
+             write_mode=args.write_mode, lake_dir=args.lake_dir, from_lake=args.from_lake)
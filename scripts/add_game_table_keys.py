@@ -0,0 +1,46 @@
+"""
+One-off script for adding the natural key (gameID, name, team, situation) to the NST tables
+(skater_games and goalie_games) as a primary key. Any duplicate rows left by earlier retried
+loads are removed first, keeping the most recently inserted copy of each row.
+"""
+
+import os
+import sys
+
+# The modules in hockey/ import each other by name, so that directory needs to be on the path
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'hockey'))
+
+import storage
+
+
+############## Constants ################
+
+TABLES = ['skater_games', 'goalie_games']
+
+KEY = ['gameID', 'name', 'team', 'situation']
+
+########### End Constants ###############
+
+
+def main():
+    connection = storage.get_connection()
+
+    for table in TABLES:
+        print(f'Adding primary key to {table}...')
+
+        duplicates = connection.execute(f"""
+            DELETE FROM {table}
+            WHERE rowid NOT IN (
+                SELECT max(rowid) FROM {table} GROUP BY {', '.join(KEY)}
+            )
+        """).fetchone()[0]
+        print(f'Removed {duplicates} duplicate rows from {table}')
+
+        # DuckDB can't alter a table in the same transaction that modified it
+        connection.execute(f"ALTER TABLE {table} ADD PRIMARY KEY ({', '.join(KEY)})")
+
+    storage.persist()
+
+if __name__ == '__main__':
+    main()
+    print('Primary keys added!')
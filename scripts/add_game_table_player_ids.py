@@ -0,0 +1,61 @@
+"""
+One-off script for adding a playerID column to the NST tables (skater_games and goalie_games),
+and filling it in for every existing row from the player identity index (hockey/player_index.py).
+
+The column is added last, so that rows written before and after the change line up. The same
+column is also added to the backup and journal copies of each table, so that restores from them
+still match the table.
+"""
+
+import os
+import sys
+
+# The modules in hockey/ import each other by name, so that directory needs to be on the path
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'hockey'))
+
+import storage
+import player_index
+
+
+############## Constants ################
+
+# Table -> whether its rows are for goalies
+TABLES = {
+    'skater_games': False,
+    'goalie_games': True
+}
+
+########### End Constants ###############
+
+
+def main():
+    connection = storage.get_connection()
+
+    existing = {row[0] for row in connection.execute('SHOW TABLES').fetchall()}
+
+    for table, goalies in TABLES.items():
+        for copy in [table, f'backup_{table}', f'journal_{table}']:
+            if copy in existing:
+                print(f'Adding playerID column to {copy}...')
+                connection.execute(f'ALTER TABLE {copy} ADD COLUMN IF NOT EXISTS playerID INT')
+
+        players = connection.execute(f"""
+            SELECT DISTINCT name, season, team::VARCHAR AS team FROM {table}
+        """).pl()
+
+        index = player_index.update_index(players['season'].unique().to_list())
+        players = player_index.assign_player_ids(players, index, goalies=goalies)
+
+        print(f'Filling in playerIDs for {table}...')
+        connection.execute(f"""
+            UPDATE {table} t SET playerID = p.playerID
+            FROM players p
+            WHERE t.name = p.name AND t.season = p.season AND t.team::VARCHAR = p.team
+        """)
+
+    storage.persist()
+
+
+if __name__ == '__main__':
+    main()
+    print('playerID columns added!')
@@ -0,0 +1,80 @@
+"""
+One-off script for converting the team, situation and position columns of every table to the
+DuckDB ENUM types defined in hockey/dimensions.py. Any NST team codes left in the tables are
+mapped to MoneyPuck's on the way.
+
+DuckDB can't change the type of a column that is part of a primary key, so each table is
+rebuilt with the new types and swapped in, and its primary key (if any) is added back.
+"""
+
+import os
+import sys
+
+# The modules in hockey/ import each other by name, so that directory needs to be on the path
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'hockey'))
+
+import storage
+import dimensions
+
+
+############## Constants ################
+
+# Columns converted in each table, and the type they are converted to
+TABLES = {
+    'skaters': {'team': 'team_code', 'position': 'position_code', 'situation': 'situation_code'},
+    'goalies': {'team': 'team_code', 'situation': 'situation_code'},
+    'teams': {'team': 'team_code', 'situation': 'situation_code'},
+    'team_games': {'team': 'team_code', 'situation': 'situation_code'},
+    'skater_games': {'team': 'team_code', 'situation': 'situation_code'},
+    'goalie_games': {'team': 'team_code', 'situation': 'situation_code'}
+}
+
+########### End Constants ###############
+
+
+def convert_table(connection, table, columns):
+    primary_key = connection.execute("""
+        SELECT constraint_column_names FROM duckdb_constraints()
+        WHERE table_name = ? AND constraint_type = 'PRIMARY KEY'
+    """, [table]).fetchone()
+
+    team_codes = ' '.join(f"WHEN '{bad}' THEN '{good}'"
+                          for bad, good in dimensions.NST_TEAM_CODES.items())
+    replacements = []
+    for column, type_name in columns.items():
+        if type_name == 'team_code':
+            replacements.append(f'(CASE {column} {team_codes} ELSE {column} END)::{type_name} '
+                                f'AS {column}')
+        else:
+            replacements.append(f'{column}::{type_name} AS {column}')
+
+    connection.execute(f"""
+        CREATE OR REPLACE TABLE {table}_enums AS
+        SELECT * REPLACE ({', '.join(replacements)}) FROM {table}
+    """)
+
+    if primary_key is not None:
+        connection.execute(f"ALTER TABLE {table}_enums ADD PRIMARY KEY "
+                           f"({', '.join(primary_key[0])})")
+
+    connection.execute('BEGIN TRANSACTION')
+    connection.execute(f'DROP TABLE {table}')
+    connection.execute(f'ALTER TABLE {table}_enums RENAME TO {table}')
+    connection.execute('COMMIT')
+
+
+def main():
+    connection = storage.get_connection()
+
+    dimensions.create_types(connection)
+
+    for table, columns in TABLES.items():
+        print(f'Converting {table}...')
+        convert_table(connection, table, columns)
+
+    storage.persist()
+
+
+if __name__ == '__main__':
+    main()
+    print('Table conversion complete!')
@@ -3,13 +3,20 @@ One-off script for renaming all the columns in the NST tables (skater_games and
 better align with the naming conventions of the MoneyPuck tables.
 """
 
-import duckdb
+import os
+import sys
+
 import polars as pl
 
+# The modules in hockey/ import each other by name, so that directory needs to be on the path
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'hockey'))
+
+import storage
+
 def main():
     pl.Config(tbl_cols=40)
 
-    connection = duckdb.connect('md:', read_only=False)
+    connection = storage.get_connection()
 
     # Start with skater_games
 
@@ -39,6 +46,7 @@ def main():
 
     connection.sql('CREATE OR REPLACE TABLE skater_games AS SELECT * FROM s_df;')
     #connection.sql('CREATE OR REPLACE TABLE goalie_games AS SELECT * FROM g_df;')
+    storage.persist()
 
 if __name__ == '__main__':
     main()
@@ -2,72 +2,40 @@
 One-off script which can be used to add new columns to team_games table
 """
 
-from datetime import datetime
-import polars as pl
-import duckdb
-
+import os
+import sys
 
-############## Constants ################
+import polars as pl
 
-# URL used to download CSV data from MoneyPuck
-DATA_URL = 'https://moneypuck.com/moneypuck/playerData/careers/gameByGame/all_teams.csv'
+# The modules in hockey/ import each other by name, so that directory needs to be on the path
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'hockey'))
 
-# Columns that will be used from base CSV
-USED_COLUMNS = ['gameId', 'season', 'team', 'gameDate', 'home_or_away', 'situation', 'iceTime',
-                'xGoalsFor', 'xGoalsAgainst', 'xGoalsPercentage',
-                'penalityMinutesFor', 'penalityMinutesAgainst',
-                'corsiPercentage', 'goalsFor', 'goalsAgainst', 
-                'playoffGame']
+import storage
+import dimensions
+import transforms
+import process_game_data
 
-########### End Constants ###############
 
 def main():
-    df = pl.read_csv(DATA_URL, columns=USED_COLUMNS)
-
-    df = df.filter(pl.col('playoffGame') == 0).drop(['playoffGame'])
-
-    df = df.with_columns(
-        # Convert gameDate from a YYYYMMDD format to a YYYY-MM-DD format using datetime
-        pl.col('gameDate').map_elements(
-            lambda date: datetime.strftime(datetime.strptime(str(date), '%Y%m%d'), '%Y-%m-%d'),
-            return_dtype=pl.String
-        ),
-        # Also convert 'home_or_away' into a boolean column
-        pl.col('home_or_away').map_elements(
-            lambda a: bool(a == 'HOME'),
-            return_dtype=pl.Boolean
-        ).alias('isHomeTeam'),
-        # And convert iceTime from seconds into minutes
-        pl.col('iceTime') / 60.0
-    )
-
-    df = df.drop('home_or_away')
-
-    # Rename a few columns to better align with the rest of the tables in the DB
-    df = df.rename({
-        'gameId': 'gameID',
-        'xGoalsPercentage': 'xGoalsShare',
-        'corsiPercentage': 'corsiShare',
-        'penalityMinutesFor': 'penaltyMinutesFor',
-        'penalityMinutesAgainst': 'penaltyMinutesAgainst'
-    })
+    df = pl.read_csv(process_game_data.DATA_URL, columns=process_game_data.USED_COLUMNS,
+                     schema_overrides=process_game_data.SCHEMA_OVERRIDES)
 
-    conn = duckdb.connect(database='md:', read_only=False)
+    # Same transform as the daily update, but over every season. Playoff games are still
+    # excluded by the spec.
+    df = transforms.transform(process_game_data.SPEC, df)
 
-    # Have columns in correct order
-    df = df[['team', 'season', 'gameID', 'gameDate', 'isHomeTeam', 'iceTime', 'situation',
-             'xGoalsFor', 'xGoalsAgainst', 'xGoalsShare', 'corsiShare', 'goalsFor',
-             'goalsAgainst', 'penaltyMinutesFor', 'penaltyMinutesAgainst']]
+    conn = storage.get_connection()
+    dimensions.create_types(conn)
 
     conn.execute("""
                 CREATE OR REPLACE TABLE team_games (
-                    team VARCHAR,
+                    team team_code,
                     season INT,
                     gameID INT,
                     gameDate DATE,
                     isHomeTeam BOOL,
                     iceTime FLOAT,
-                    situation VARCHAR,
+                    situation situation_code,
                     xGoalsFor FLOAT,
                     xGoalsAgainst FLOAT,
                     xGoalsShare FLOAT,
@@ -79,7 +47,8 @@ def main():
                  );
                 """)
 
-    conn.execute("INSERT INTO team_games SELECT * FROM df")
+    conn.execute("INSERT INTO team_games BY NAME SELECT * FROM df")
+    storage.persist()
 
 
 if __name__ == '__main__':